@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+class AdmissionRejected(Exception):
+    """Raised when a generation is not admitted; retry_after is in seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionSlot:
+    """A held generation slot; release() is safe to call more than once"""
+
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self._controller = controller
+        self._user_id = user_id
+        self._acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self._user_id, time.monotonic() - self._acquired_at)
+
+class AdmissionController:
+    """
+    Caps concurrent LLM generations globally and per user.
+
+    Up to GENERATION_MAX_CONCURRENCY generations run at once; further requests
+    wait in a FIFO queue of at most GENERATION_MAX_QUEUE entries for up to
+    GENERATION_QUEUE_TIMEOUT seconds. A user may have GENERATION_MAX_PER_USER
+    generations running or queued. Anything beyond that is rejected straight
+    away with a Retry-After estimated from recent generation times.
+    """
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv('GENERATION_MAX_CONCURRENCY', '8'))
+        self.max_per_user = int(os.getenv('GENERATION_MAX_PER_USER', '2'))
+        self.max_queue = int(os.getenv('GENERATION_MAX_QUEUE', '32'))
+        self.queue_timeout = float(os.getenv('GENERATION_QUEUE_TIMEOUT', '10'))
+
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._per_user: Dict[str, int] = {}
+        # Moving average of how long a generation holds its slot, for Retry-After
+        self._avg_hold = 10.0
+
+        self._active_gauge = metrics.gauge("generation_admission_active", "Generations currently holding a slot")
+        self._queue_gauge = metrics.gauge("generation_admission_queue_depth", "Generations waiting for a slot")
+        self._wait_time = metrics.histogram("generation_admission_wait_seconds", "Time admitted generations waited for a slot")
+        self._rejected_user = metrics.counter("generation_admission_rejected_user_limit_total", "Generations rejected by the per-user limit")
+        self._rejected_queue_full = metrics.counter("generation_admission_rejected_queue_full_total", "Generations rejected because the wait queue was full")
+        self._rejected_timeout = metrics.counter("generation_admission_rejected_queue_timeout_total", "Generations rejected after waiting too long for a slot")
+
+    def _retry_after(self, queued: int) -> int:
+        return max(1, min(60, math.ceil(self._avg_hold * (queued + 1) / self.max_concurrency)))
+
+    async def acquire(self, user_id: str) -> AdmissionSlot:
+        """Wait for a generation slot or raise AdmissionRejected"""
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            self._rejected_user.inc()
+            raise AdmissionRejected("Too many generations in progress for this user", max(1, math.ceil(self._avg_hold)))
+
+        # Queued requests count towards the user's limit too
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        started = time.monotonic()
+        try:
+            await self._take_slot()
+        except BaseException:
+            self._forget_user(user_id)
+            raise
+
+        self._active_gauge.set(self._active)
+        self._wait_time.observe(time.monotonic() - started)
+        return AdmissionSlot(self, user_id)
+
+    async def _take_slot(self):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._rejected_queue_full.inc()
+            raise AdmissionRejected("Generation queue is full", self._retry_after(len(self._waiters)))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queue_gauge.set(len(self._waiters))
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up - pass it on
+                self._hand_over()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._queue_gauge.set(len(self._waiters))
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._rejected_timeout.inc()
+            raise AdmissionRejected("Timed out waiting for a generation slot", self._retry_after(len(self._waiters)))
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        slot = await self.acquire(user_id)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def _release(self, user_id: str, held: float):
+        self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+        self._forget_user(user_id)
+        self._hand_over()
+        self._active_gauge.set(self._active)
+
+    def _forget_user(self, user_id: str):
+        remaining = self._per_user.get(user_id, 1) - 1
+        if remaining > 0:
+            self._per_user[user_id] = remaining
+        else:
+            self._per_user.pop(user_id, None)
+
+    def _hand_over(self):
+        """Give a freed slot to the oldest waiter, or return it to the pool"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._queue_gauge.set(len(self._waiters))
+                return
+        self._queue_gauge.set(0)
+        self._active -= 1
+
+# Create a global instance
+generation_admission = AdmissionController()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the AI-speak and contraction rewrites in humanize_response.
+
+Compares the previous implementation (one re.sub per AI-speak rule, then a
+finditer per contraction with the string rebuilt by slicing for every match)
+against the single-pass rewrite engine, over the replies in
+fixtures/llm_replies.json and over the whole corpus joined into one long reply.
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+from text_rewrite import AI_SPEAK_PATTERNS, CONTRACTION_PATTERNS, response_rewriter
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "llm_replies.json")
+
+def legacy_rewrite(response: str) -> str:
+    """The rewrite steps as humanize_response ran them before the rewrite engine"""
+    for pattern, replacement in AI_SPEAK_PATTERNS:
+        response = re.sub(pattern, replacement, response, flags=re.IGNORECASE)
+    for pattern, replacement in CONTRACTION_PATTERNS:
+        matches = list(re.finditer(pattern, response, flags=re.IGNORECASE))
+        if matches:
+            for match in random.sample(matches, max(1, int(len(matches) * 0.7))):
+                start, end = match.span()
+                response = response[:start] + replacement + response[end:]
+    return response
+
+def run(rewrite, replies):
+    for reply in replies:
+        rewrite(reply)
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with open(CORPUS_PATH) as f:
+        replies = json.load(f)
+    long_reply = [" ".join(replies)]
+    random.seed(0)
+
+    print(f"Rewrite of {len(replies)} LLM replies ({iterations} iterations, best of 3)")
+    for label, corpus in (("per reply", replies), ("one long reply", long_reply)):
+        legacy = min(timeit.repeat(lambda: run(legacy_rewrite, corpus), number=iterations, repeat=3)) / iterations / len(corpus)
+        engine = min(timeit.repeat(lambda: run(response_rewriter.rewrite, corpus), number=iterations, repeat=3)) / iterations / len(corpus)
+        print(f"  {label}:")
+        print(f"    per-rule re.sub + slicing: {legacy * 1e6:9.2f} µs")
+        print(f"    single-pass engine:        {engine * 1e6:9.2f} µs")
+        print(f"    speedup:                   {legacy / engine:9.2f}x")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
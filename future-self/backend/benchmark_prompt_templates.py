@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for prompt building with the cached persona block.
+
+Compares rendering the full prompt with a cold cache (every call renders the
+persona, as before the template cache) against a warm cache (only the
+volatile per-request parts are rendered).
+"""
+
+import sys
+import timeit
+
+from prompt_budget import prompt_assembler
+from prompt_templates import PromptTemplates, render_future_self_guidance
+
+SAMPLE_PROFILE = {
+    "name": "Alex",
+    "nationality": "Canadian",
+    "current_location": "Toronto",
+    "future_self_description": "calm, confident and running my own studio",
+    "future_age": "10",
+    "mind_space": "whether I'm good enough at my job",
+    "change_goal": "stop procrastinating on the things that matter",
+    "avoid_tendency": "difficult conversations",
+    "spiral_reminder": "you've handled harder things than this",
+    "accomplishment": "opened a design studio",
+    "typical_day": "morning run, deep work, dinner with friends",
+    "astrology_data": {
+        "birth_chart": {"sun_sign": "Virgo"},
+        "insights": {"sun_sign_traits": "practical and detail-oriented", "moon_sign": "Pisces", "rising_sign": "Leo"},
+    },
+}
+
+SAMPLE_WEATHER = {
+    "weather": {"temperature": 12, "feels_like": 10, "humidity": 70, "description": "light rain", "wind_speed": 4, "pressure": 1012},
+    "events": [{"name": "Jazz Night", "date": "2024-06-01"}, {"name": "Farmers Market", "date": "2024-06-02"}],
+}
+
+SAMPLE_HISTORY = ["User: I had a rough day at work", "You: Tell me what happened"]
+
+def build(templates: PromptTemplates) -> str:
+    return templates.render_prompt(
+        "I keep putting off the portfolio update and I don't know why",
+        SAMPLE_PROFILE,
+        "They seem stuck and a little frustrated.",
+        "You gently push the user toward growth and positive change.",
+        SAMPLE_HISTORY,
+        SAMPLE_WEATHER,
+    )
+
+def build_cold() -> str:
+    # A fresh cache per call renders the persona every time
+    render_future_self_guidance.cache_clear()
+    return build(PromptTemplates(prompt_assembler))
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    warm_templates = PromptTemplates(prompt_assembler)
+    assert build_cold() == build(warm_templates), "cached and uncached prompts differ"
+
+    cold = min(timeit.repeat(build_cold, number=iterations, repeat=3)) / iterations
+    warm = min(timeit.repeat(lambda: build(warm_templates), number=iterations, repeat=3)) / iterations
+
+    print(f"Prompt build ({iterations} iterations, best of 3)")
+    print(f"  persona rendered per call: {cold * 1e6:8.2f} µs")
+    print(f"  persona from cache:        {warm * 1e6:8.2f} µs")
+    print(f"  speedup:                   {cold / warm:8.2f}x")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the per-message text processing on the chat hot path.
+
+Times message classification, prompt building, reply humanization and
+personal-detail extraction over the fixture corpora in fixtures/ (user
+messages and LLM replies), with fixed random and hash seeds and a stub
+Supabase client, and compares each result with the stored baseline in
+fixtures/benchmark_baseline.json. A benchmark more than the tolerance
+slower than its baseline fails the run.
+
+Every repeat also times a fixed calibration loop right before the
+benchmark, and the gate compares the median of benchmark/calibration
+ratios, so the machine getting slower or faster as a whole (frequency
+scaling, other load) doesn't read as a regression.
+
+Usage:
+    python benchmark_text_pipeline.py                  # compare with the baseline
+    python benchmark_text_pipeline.py --update         # record a new baseline
+    python benchmark_text_pipeline.py --only humanize  # run matching benchmarks
+
+Baselines are machine-specific: record them on the machine you compare on,
+and commit an updated baseline together with a deliberate slowdown.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import timeit
+
+from conversation_style import create_future_self_prompt, detect_emotional_context, determine_communication_style
+from humanizer import add_realistic_typos, apply_typing_quirks, humanize_response
+from message_lexicon import message_lexicon
+from personal_details import PersonalDetailsStore, find_personal_details
+from sentence_spans import SentenceSpans
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASELINE_PATH = os.path.join(FIXTURES_DIR, "benchmark_baseline.json")
+
+BENCHMARK_SEED = 1234
+# Allowed slowdown against the baseline before a benchmark fails
+DEFAULT_TOLERANCE = float(os.getenv('BENCHMARK_TOLERANCE', '0.25'))
+
+PROFILES = [
+    {
+        "name": "Alex",
+        "nationality": "Canadian",
+        "current_location": "Toronto",
+        "future_self_description": "calm, confident and running my own studio",
+        "future_age": "10",
+        "mind_space": "whether I'm good enough at my job",
+        "change_goal": "stop procrastinating on the things that matter",
+        "avoid_tendency": "difficult conversations",
+        "spiral_reminder": "you've handled harder things than this",
+        "accomplishment": "opened a design studio",
+        "typical_day": "morning run, deep work, dinner with friends",
+        "message_preference": "short and to the point",
+        "emoji_usage_preference": "high",
+        "words_slang": "lowkey, fr, no cap",
+        "conversation_summary": "They have been working on a portfolio and worry about their manager's feedback.",
+        "astrology_data": {
+            "birth_chart": {"sun_sign": "Virgo"},
+            "insights": {"sun_sign_traits": "practical and detail-oriented", "moon_sign": "Pisces", "rising_sign": "Leo"},
+        },
+    },
+    {
+        "name": "Sam",
+        "future_self_description": "a patient parent with a garden",
+        "future_age": "5",
+        "message_preference": "thoughtful, detailed replies",
+        "emoji_usage_preference": "low",
+        "words_slang": "",
+    },
+]
+
+STORED_DETAILS = {
+    "goals": ["run a marathon", "save for a house"],
+    "interests": ["painting", "jazz"],
+    "achievements": ["finished the half marathon"],
+    "values": ["family"],
+}
+
+WEATHER = {
+    "weather": {"temperature": 12, "feels_like": 10, "humidity": 70, "description": "light rain", "wind_speed": 4, "pressure": 1012},
+    "events": [{"name": "Jazz Night", "date": "2024-06-01"}, {"name": "Farmers Market", "date": "2024-06-02"}],
+}
+
+HISTORY = [
+    "You: I had a rough day at work",
+    "Your future self: Tell me what happened",
+    "You: My manager criticized the portfolio in front of everyone",
+    "Your future self: That stings. What part of it is still on your mind?",
+]
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data)
+
+class StubQuery:
+    """Chainable stand-in for a postgrest query; reads return the table's canned rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getattr__(self, name):
+        # select, eq, update, insert, order, limit...: all chain
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        # Fresh copies so callers that mutate a row don't change the next run
+        return StubResponse([dict(row) for row in self.rows])
+
+class StubSupabase:
+    """Supabase client with canned rows per table and no network"""
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+
+    def table(self, name):
+        return StubQuery(self.tables.get(name, []))
+
+    def rpc(self, name, params=None):
+        return StubQuery([])
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+def build_benchmarks(messages, replies):
+    """name -> (function running one pass over the corpus, number of calls per pass)"""
+    store = PersonalDetailsStore(StubSupabase())
+    reply_profiles = [(reply, PROFILES[index % len(PROFILES)]) for index, reply in enumerate(replies)]
+
+    def classify_style():
+        # Cold lexicon cache: each message is analyzed once, as on a real turn
+        message_lexicon.analyze.cache_clear()
+        for message in messages:
+            determine_communication_style(message, HISTORY)
+
+    def classify_emotion():
+        message_lexicon.analyze.cache_clear()
+        for message in messages:
+            detect_emotional_context(message)
+
+    def build_prompt():
+        message_lexicon.analyze.cache_clear()
+        for index, message in enumerate(messages):
+            create_future_self_prompt(message, PROFILES[index % len(PROFILES)], HISTORY, WEATHER)
+
+    def humanize():
+        for reply, profile in reply_profiles:
+            humanize_response(reply, profile["name"], "what should I do next?", profile, STORED_DETAILS)
+
+    def typing_quirks():
+        for reply, profile in reply_profiles:
+            apply_typing_quirks(SentenceSpans(reply), profile)
+
+    def typos():
+        for reply in replies:
+            add_realistic_typos(reply)
+
+    def detail_patterns():
+        for message in messages:
+            find_personal_details(message)
+
+    def detail_extraction():
+        for message in messages:
+            store.extract("bench-user", message)
+
+    return {
+        "determine_communication_style": (classify_style, len(messages)),
+        "detect_emotional_context": (classify_emotion, len(messages)),
+        "create_future_self_prompt": (build_prompt, len(messages)),
+        "humanize_response": (humanize, len(replies)),
+        "apply_typing_quirks": (typing_quirks, len(replies)),
+        "add_realistic_typos": (typos, len(replies)),
+        "personal_detail_patterns": (detail_patterns, len(messages)),
+        "extract_personal_details": (detail_extraction, len(messages)),
+    }
+
+CALIBRATION_WORDS = re.compile(r"[a-z']+")
+
+def build_calibration(messages):
+    """Reference workload of the same kind as the benchmarks (regex, string and dict work) that never changes"""
+    def calibrate():
+        counts = {}
+        for message in messages:
+            for word in CALIBRATION_WORDS.findall(message.lower()):
+                counts[word] = counts.get(word, 0) + 1
+            " ".join(reversed(message.split())).title()
+        return counts
+    return calibrate
+
+def time_benchmark(run, calls, calibrate, passes, repeat):
+    """
+    Median per-call time in microseconds and median time relative to the
+    calibration loop, each repeat starting from the same seed
+    """
+    run()  # Warm up caches that persist in production (compiled patterns, persona cache)
+    calibrate()
+    times, ratios = [], []
+    for _ in range(repeat):
+        reference = timeit.timeit(calibrate, number=passes)
+        random.seed(BENCHMARK_SEED)
+        seconds = timeit.timeit(run, number=passes)
+        times.append(seconds / passes / calls * 1e6)
+        ratios.append(seconds / reference)
+    return statistics.median(times), statistics.median(ratios)
+
+def main():
+    # String hashing is randomized per process and shifts dict/set layouts enough to
+    # move timings by a third; re-run under a fixed hash seed so runs compare
+    if os.environ.get("PYTHONHASHSEED") is None:
+        os.environ["PYTHONHASHSEED"] = "0"
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    parser = argparse.ArgumentParser(description="Benchmark the per-message text processing")
+    parser.add_argument("--update", action="store_true", help="record the results as the new baseline")
+    parser.add_argument("--only", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--passes", type=int, default=50, help="passes over the corpus per repeat")
+    parser.add_argument("--repeat", type=int, default=21, help="repeats; the median counts")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown, e.g. 0.25 for 25%%")
+    args = parser.parse_args()
+
+    messages = load_fixture("user_messages.json")
+    replies = load_fixture("llm_replies.json")
+    benchmarks = {name: benchmark for name, benchmark in build_benchmarks(messages, replies).items() if args.only in name}
+    calibrate = build_calibration(messages)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    baseline_results = baseline.get("results_us", {})
+    baseline_relative = baseline.get("relative", {})
+    if baseline and baseline.get("python") != platform.python_version():
+        print(f"⚠️  Baseline was recorded on Python {baseline.get('python')}, running {platform.python_version()}")
+
+    print(f"Text pipeline benchmarks ({len(messages)} messages, {len(replies)} replies, seed {BENCHMARK_SEED})")
+    print(f"{'benchmark':32} {'baseline µs':>12} {'current µs':>12} {'change':>8}")
+    results = {}
+    relative = {}
+    regressions = []
+    for name, (run, calls) in benchmarks.items():
+        current, ratio = time_benchmark(run, calls, calibrate, args.passes, args.repeat)
+        results[name] = round(current, 3)
+        relative[name] = round(ratio, 4)
+        expected_ratio = baseline_relative.get(name)
+        if expected_ratio is None:
+            print(f"{name:32} {'-':>12} {current:12.2f} {'new':>8}")
+            continue
+        # The baseline scaled to how fast this machine runs the calibration loop right now
+        change = ratio / expected_ratio - 1
+        expected = current / (1 + change)
+        status = ""
+        if change > args.tolerance:
+            regressions.append(name)
+            status = " ❌"
+        print(f"{name:32} {expected:12.2f} {current:12.2f} {change:+8.1%}{status}")
+
+    if args.update:
+        baseline_results.update(results)
+        baseline_relative.update(relative)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results_us": baseline_results, "relative": baseline_relative}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"✅ Baseline written to {BASELINE_PATH}")
+        return True
+
+    if regressions:
+        print(f"❌ {len(regressions)} benchmark(s) over {args.tolerance:.0%} slower than baseline: {', '.join(regressions)}")
+        return False
+    print(f"✅ No benchmark more than {args.tolerance:.0%} slower than baseline")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+
+from supabase import Client
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # No advisory locks (Windows); only safe with one worker per spool directory
+    fcntl = None
+
+class ChatMessageWriter:
+    """
+    Write-behind queue for chat_messages rows.
+
+    Rows are buffered in memory and inserted in multi-row batches once
+    CHAT_WRITE_BATCH_SIZE rows are pending or CHAT_WRITE_FLUSH_INTERVAL seconds
+    have passed, so responses no longer wait on a database write. When a batch
+    fails its rows are retried one at a time, and the ones that still fail are
+    appended to this worker's spool file in CHAT_WRITE_SPOOL_DIR. Replays pick
+    up every worker's spool file under an fcntl lock. A row that fails
+    CHAT_WRITE_MAX_ATTEMPTS replays while other writes succeed is moved to a
+    dead-letter file. Inserts are upserts on message_id, so a replayed row
+    never duplicates.
+    """
+
+    def __init__(self, supabase_client: Client):
+        self.supabase = supabase_client
+        self.batch_size = int(os.getenv('CHAT_WRITE_BATCH_SIZE', '50'))
+        self.flush_interval = float(os.getenv('CHAT_WRITE_FLUSH_INTERVAL', '1.0'))
+        self.retry_interval = float(os.getenv('CHAT_WRITE_RETRY_INTERVAL', '30'))
+        self.max_attempts = int(os.getenv('CHAT_WRITE_MAX_ATTEMPTS', '5'))
+        # Spooled rows are users' messages: keep them out of the source tree
+        self.spool_dir = os.path.abspath(os.getenv('CHAT_WRITE_SPOOL_DIR', os.path.join(tempfile.gettempdir(), "future-self-chat-spool")))
+        # One spool file per worker process; replays read all of them
+        self.spool_path = os.path.join(self.spool_dir, f"chat_messages_spool.{os.getpid()}.jsonl")
+        self.dead_letter_path = os.path.join(self.spool_dir, "chat_messages_dead_letter.jsonl")
+
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_replay = 0.0
+        self._last_write_ok = 0.0
+
+        self._batches = metrics.counter("chat_write_batches_total", "chat_messages insert batches sent")
+        self._rows_written = metrics.counter("chat_write_rows_total", "chat_messages rows written")
+        self._rows_spooled = metrics.counter("chat_write_rows_spooled_total", "chat_messages rows spooled after a failed write")
+        self._rows_dead_lettered = metrics.counter("chat_write_rows_dead_lettered_total", "chat_messages rows given up on after repeated failed replays")
+        self._queue_depth = metrics.gauge("chat_write_pending_rows", "chat_messages rows waiting to be written")
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write everything still pending (call on shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await asyncio.to_thread(self._replay_spool)
+
+    def enqueue(self, row: Dict[str, Any]):
+        """Queue a row for insertion. Safe to call from worker threads."""
+        if self._task is None:
+            # Not running inside the app (scripts, tests) - write through
+            self._spool(self._write_rows([row]))
+            return
+
+        with self._lock:
+            self._pending.append(row)
+            pending = len(self._pending)
+        self._queue_depth.set(pending)
+
+        if pending >= self.batch_size:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def flush(self):
+        """Write all pending rows in batches"""
+        while True:
+            with self._lock:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                remaining = len(self._pending)
+            self._queue_depth.set(remaining)
+            if not batch:
+                return
+            failed = await asyncio.to_thread(self._write_rows, batch)
+            if failed:
+                await asyncio.to_thread(self._spool, failed)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_replay >= self.retry_interval:
+                    self._last_replay = time.monotonic()
+                    await asyncio.to_thread(self._replay_spool)
+            except Exception as e:
+                print(f"Error in chat message writer: {e}")
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> bool:
+        try:
+            self.supabase.table("chat_messages").upsert(batch, on_conflict="message_id", ignore_duplicates=True).execute()
+        except Exception as e:
+            print(f"Error writing {len(batch)} chat messages to Supabase: {e}")
+            return False
+        self._last_write_ok = time.monotonic()
+        self._batches.inc()
+        self._rows_written.inc(len(batch))
+        return True
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write rows as one batch, then one at a time if that fails so a bad row can't hold back the rest; returns the rows that failed"""
+        if self._write_batch(rows):
+            return []
+        if len(rows) == 1:
+            return rows
+        return [row for row in rows if not self._write_batch([row])]
+
+    def _append_lines(self, path: str, lines: List[str]):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(path, "a") as spool:
+            if fcntl is not None:
+                fcntl.flock(spool, fcntl.LOCK_EX)
+            try:
+                spool.write("".join(lines))
+                spool.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(spool, fcntl.LOCK_UN)
+
+    def _spool(self, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        with self._spool_lock:
+            self._append_lines(self.spool_path, [json.dumps({"row": row, "attempts": 0}) + "\n" for row in rows])
+        self._rows_spooled.inc(len(rows))
+
+    def _claim_spool(self, path: str) -> List[Dict[str, Any]]:
+        """
+        Read and empty a spool file under its lock. The file is truncated, never
+        replaced or removed, so a worker waiting on the lock still appends to it.
+        """
+        try:
+            spool = open(path, "r+")
+        except FileNotFoundError:
+            return []
+        with spool:
+            if fcntl is not None:
+                fcntl.flock(spool, fcntl.LOCK_EX)
+            try:
+                entries = []
+                for line in spool:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    # Lines spooled before attempts were tracked hold the bare row
+                    entries.append(entry if "attempts" in entry else {"row": entry, "attempts": 0})
+                spool.seek(0)
+                spool.truncate()
+                return entries
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(spool, fcntl.LOCK_UN)
+
+    def _replay_spool(self):
+        """Retry the rows in every worker's spool file; rows that still fail go to this worker's spool or the dead-letter file"""
+        with self._spool_lock:
+            paths = sorted(glob.glob(os.path.join(self.spool_dir, "chat_messages_spool*.jsonl")))
+            entries = [entry for path in paths for entry in self._claim_spool(path)]
+        if not entries:
+            return
+
+        failed = []
+        for start in range(0, len(entries), self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            failed_rows = {id(row) for row in self._write_rows([entry["row"] for entry in batch])}
+            failed.extend(entry for entry in batch if id(entry["row"]) in failed_rows)
+        if not failed:
+            return
+
+        # Only count a failure against a row while Supabase is taking other writes;
+        # during an outage every row fails and none of them is at fault
+        reachable = time.monotonic() - self._last_write_ok < self.retry_interval
+        retry, dead = [], []
+        for entry in failed:
+            attempts = entry["attempts"] + 1 if reachable else entry["attempts"]
+            (dead if attempts >= self.max_attempts else retry).append({"row": entry["row"], "attempts": attempts})
+
+        with self._spool_lock:
+            if retry:
+                self._append_lines(self.spool_path, [json.dumps(entry) + "\n" for entry in retry])
+            if dead:
+                self._append_lines(self.dead_letter_path, [json.dumps(entry["row"]) + "\n" for entry in dead])
+        if dead:
+            print(f"Moved {len(dead)} chat messages that failed {self.max_attempts} replays to {self.dead_letter_path}")
+            self._rows_dead_lettered.inc(len(dead))
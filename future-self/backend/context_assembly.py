@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Default time budget (seconds) for a single context source
+DEFAULT_SOURCE_BUDGET = float(os.getenv('CONTEXT_SOURCE_BUDGET', '2.0'))
+
+@dataclass
+class ContextSource:
+    """A single piece of pre-LLM context that can be loaded independently"""
+    name: str
+    load: Callable[[], Awaitable[Any]]
+    default: Any = None
+    budget: Optional[float] = None
+
+    def resolve_budget(self) -> float:
+        """Explicit budget, else CONTEXT_BUDGET_<NAME> from the environment, else the default"""
+        if self.budget is not None:
+            return self.budget
+        return float(os.getenv(f'CONTEXT_BUDGET_{self.name.upper()}', DEFAULT_SOURCE_BUDGET))
+
+@dataclass
+class AssembledContext:
+    """Result of a concurrent context assembly"""
+    values: Dict[str, Any] = field(default_factory=dict)
+    late: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.late or self.failed)
+
+async def assemble_context(sources: List[ContextSource]) -> AssembledContext:
+    """
+    Load all context sources concurrently, each bounded by its own time budget.
+
+    A source that misses its deadline or raises falls back to its default value,
+    so total latency is bounded by the slowest budget rather than the sum of all
+    round trips.
+    """
+    result = AssembledContext()
+
+    async def run(source: ContextSource):
+        started = time.perf_counter()
+        try:
+            value = await asyncio.wait_for(source.load(), timeout=source.resolve_budget())
+        except asyncio.TimeoutError:
+            result.late.append(source.name)
+            value = source.default
+        except Exception as e:
+            print(f"Error loading context source '{source.name}': {e}")
+            result.failed.append(source.name)
+            value = source.default
+        result.timings[source.name] = round(time.perf_counter() - started, 4)
+        result.values[source.name] = value
+
+    await asyncio.gather(*(run(source) for source in sources))
+
+    if result.degraded:
+        print(f"Context assembly degraded - late: {result.late}, failed: {result.failed}")
+
+    return result
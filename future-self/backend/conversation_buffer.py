@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+try:
+    import redis
+except ImportError:  # Redis is optional; the in-process buffer works on its own
+    redis = None
+
+# Load environment variables
+load_dotenv()
+
+class ConversationBuffer:
+    """
+    Bounded per-user ring buffer of the most recent chat turns.
+
+    A user's buffer is warmed from chat_messages once, on the first read after a
+    miss, and afterwards kept current by appending every message as it is
+    persisted. Appends to a cold buffer are ignored so a partial buffer never
+    hides older history. A message already in the buffer (same chat_messages
+    message_id, e.g. loaded by the warm query) is not added twice.
+
+    With CONVERSATION_BUFFER_REDIS_URL set the buffers live in Redis lists
+    shared by all workers and expire CONVERSATION_BUFFER_TTL seconds after
+    their last warm or append. Otherwise each worker keeps its own copy, which
+    misses messages persisted by other workers, so it is warmed again
+    CONVERSATION_BUFFER_LOCAL_TTL seconds after its last warm however busy it is.
+    """
+
+    def __init__(self):
+        self.capacity = int(os.getenv('CONVERSATION_BUFFER_SIZE', '20'))
+        self.max_users = int(os.getenv('CONVERSATION_BUFFER_USERS', '10000'))
+        self.ttl = int(os.getenv('CONVERSATION_BUFFER_TTL', '86400'))
+        self.local_ttl = int(os.getenv('CONVERSATION_BUFFER_LOCAL_TTL', '300'))
+        self.redis_url = os.getenv('CONVERSATION_BUFFER_REDIS_URL')
+        self.key_prefix = "conversation:"
+
+        self._buffers: "OrderedDict[str, deque]" = OrderedDict()
+        # user_id -> monotonic time the in-process buffer goes cold
+        self._expires_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+
+        if self.redis_url and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=0.5)
+            except Exception as e:
+                print(f"Error connecting conversation buffer to Redis: {e}")
+                self._redis = None
+        elif self.redis_url:
+            print("CONVERSATION_BUFFER_REDIS_URL is set but the redis package is not installed; using in-process buffer only")
+
+        self._hits = metrics.counter("conversation_buffer_hits_total", "Conversation context reads served from the buffer")
+        self._misses = metrics.counter("conversation_buffer_misses_total", "Conversation context reads that warmed from the database")
+
+    @staticmethod
+    def _entry(author_id: str, content: str, message_id: Optional[str] = None) -> Dict[str, str]:
+        entry = {"author_id": author_id, "content": content}
+        if message_id:
+            entry["message_id"] = message_id
+        return entry
+
+    @staticmethod
+    def _is_duplicate(entries: Iterable[Dict[str, str]], entry: Dict[str, str]) -> bool:
+        """Whether entry is already buffered: by message_id, or for a message without one, as the last row loaded from the database"""
+        entries = list(entries)
+        message_id = entry.get("message_id")
+        if message_id:
+            return any(existing.get("message_id") == message_id for existing in entries)
+        if not entries:
+            return False
+        # Without an id, only the warm query's copy of this same message can be told apart
+        # from a real repeat ("ok", "ok"): rows from the database always carry their id
+        last = entries[-1]
+        return "message_id" in last and last["author_id"] == entry["author_id"] and last["content"] == entry["content"]
+
+    def recent(self, user_id: str, limit: int) -> Optional[List[Dict[str, str]]]:
+        """Last `limit` turns oldest first, or None if the user's buffer is cold"""
+        if self._redis is not None:
+            try:
+                key = self.key_prefix + user_id
+                if not self._redis.exists(key):
+                    self._misses.inc()
+                    return None
+                # Index 0 is a warm marker, so never read past it
+                rows = self._redis.lrange(key, -limit, -1)
+                turns = [json.loads(row) for row in rows if row != b"{}"]
+                self._hits.inc()
+                return turns
+            except Exception as e:
+                print(f"Error reading conversation buffer from Redis: {e}")
+                return None
+
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is not None and self._expires_at.get(user_id, 0.0) <= time.monotonic():
+                self._drop(user_id)
+                buffer = None
+            if buffer is None:
+                self._misses.inc()
+                return None
+            self._buffers.move_to_end(user_id)
+            turns = list(buffer)[-limit:] if limit > 0 else []
+        self._hits.inc()
+        return turns
+
+    def warm(self, user_id: str, turns: Iterable[Dict[str, Any]]):
+        """Replace a user's buffer with turns loaded from the database (oldest first)"""
+        entries = [self._entry(turn["author_id"], turn["content"], turn.get("message_id")) for turn in turns][-self.capacity:]
+
+        if self._redis is not None:
+            try:
+                key = self.key_prefix + user_id
+                pipe = self._redis.pipeline()
+                pipe.delete(key)
+                # An empty marker keeps the key alive for users with no history yet
+                pipe.rpush(key, "{}", *[json.dumps(entry) for entry in entries])
+                pipe.ltrim(key, -(self.capacity + 1), -1)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+            except Exception as e:
+                print(f"Error warming conversation buffer in Redis: {e}")
+            return
+
+        with self._lock:
+            self._buffers[user_id] = deque(entries, maxlen=self.capacity)
+            self._buffers.move_to_end(user_id)
+            self._expires_at[user_id] = time.monotonic() + self.local_ttl
+            while len(self._buffers) > self.max_users:
+                oldest, _ = self._buffers.popitem(last=False)
+                self._expires_at.pop(oldest, None)
+
+    def _drop(self, user_id: str):
+        self._buffers.pop(user_id, None)
+        self._expires_at.pop(user_id, None)
+
+    def append(self, user_id: str, author_id: str, content: str, message_id: Optional[str] = None):
+        """Record a newly persisted message (message_id is its chat_messages id); a no-op while the buffer is cold"""
+        entry = self._entry(author_id, content, message_id)
+
+        if self._redis is not None:
+            try:
+                key = self.key_prefix + user_id
+                # Index 0 is the warm marker
+                rows = self._redis.lrange(key, 1, -1)
+                if self._is_duplicate((json.loads(row) for row in rows), entry):
+                    return
+                # RPUSHX only appends to an existing (warm) list
+                if self._redis.rpushx(key, json.dumps(entry)):
+                    pipe = self._redis.pipeline()
+                    pipe.ltrim(key, -(self.capacity + 1), -1)
+                    pipe.lset(key, 0, "{}")
+                    pipe.expire(key, self.ttl)
+                    pipe.execute()
+            except Exception as e:
+                print(f"Error appending to conversation buffer in Redis: {e}")
+            return
+
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                return
+            if self._expires_at.get(user_id, 0.0) <= time.monotonic():
+                self._drop(user_id)
+                return
+            # The same message can arrive from the warm query and from the caller
+            if self._is_duplicate(buffer, entry):
+                return
+            buffer.append(entry)
+
+    def evict(self, user_id: str):
+        with self._lock:
+            self._drop(user_id)
+        if self._redis is not None:
+            try:
+                self._redis.delete(self.key_prefix + user_id)
+            except Exception as e:
+                print(f"Error evicting conversation buffer in Redis: {e}")
+
+# Create a global instance
+conversation_buffer = ConversationBuffer()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+from message_lexicon import message_lexicon
+from prompt_templates import prompt_templates
+
+# Greetings (SIMPLE_GREETINGS in message_lexicon) get a short templated reply instead of a full generation
+def is_simple_greeting(user_message: str) -> bool:
+    return message_lexicon.analyze(user_message).is_greeting
+
+# Add this function to analyze user messages and determine communication style
+def determine_communication_style(user_message, message_history=None):
+    """Analyze user's message and chat history to determine appropriate communication style"""
+    # Default style if analysis is inconclusive
+    default_style = 'reflect_mirror'
+    
+    # Term counts for every classifier come from one scan of the message (see message_lexicon)
+    features = message_lexicon.analyze(user_message)
+    
+    # If the message is just a simple greeting, use language_matching for a casual, brief response
+    if features.is_greeting:
+        return 'language_matching'  # For simple greetings, match their casual style
+    
+    # A question mark counts once, however many there are
+    questions = 1 if features.question_marks else 0
+    
+    # Determine style based on message characteristics
+    if features.count('emotional') >= 2 or features.has('grounding'):
+        return 'remind_reground'  # User needs emotional grounding
+    
+    if features.has('guidance') or questions >= 2:
+        return 'anticipate_guide'  # User is seeking guidance
+    
+    if features.count('reflection') >= 2:
+        return 'reflect_mirror'  # User is in self-reflection mode
+    
+    if features.count('directive') >= 2 or features.has('goal'):
+        return 'nudge_challenge'  # User is talking about goals/needs
+    
+    # If message is very casual or uses slang, mirror their language
+    if features.has('casual'):
+        return 'language_matching'
+    
+    return default_style
+
+# Detect emotional context for natural responses
+def detect_emotional_context(message: str) -> str:
+    features = message_lexicon.analyze(message)
+    
+    # Stress/Anxiety patterns
+    if features.has('stress'):
+        return "You sense your current self is feeling overwhelmed. You remember this feeling well."
+    
+    # Excitement/Joy patterns  
+    elif features.has('excitement'):
+        return "You feel your current self's excitement and it brings back memories of your own journey."
+    
+    # Confusion/Uncertainty patterns
+    elif features.has('uncertainty'):
+        return "You recognize this uncertainty - you've been exactly where they are now."
+    
+    # Sadness/Disappointment patterns
+    elif features.has('sadness'):
+        return "You feel your current self's pain and remember when you felt the same way."
+    
+    # Goal/Ambition patterns
+    elif features.has('aspiration'):
+        return "You smile, remembering when you had these same aspirations."
+    
+    return "You listen with the understanding that comes from having lived through similar experiences."
+
+# Style guidance for the current message
+def build_communication_guidance(user_message: str, conversation_context: list | None = None) -> str:
+    communication_guidance = ""
+    
+    # Determine style based on user's actual message
+    detected_style = determine_communication_style(user_message, conversation_context)
+    
+    # Apply the detected communication style
+    if detected_style == 'language_matching':
+        # Check if the message is a simple greeting
+        if is_simple_greeting(user_message):
+            communication_guidance += "This is a simple greeting. Respond in a brief, casual, and friendly way. Keep your response short and conversational, as if you're just saying hello to a friend. Don't provide lengthy motivational content or advice unless specifically asked. "
+        else:
+            communication_guidance += "You talk just like the user, mirroring their speech patterns, vocabulary, and phrasing. Match their communication style and adapt to their language. "
+    elif detected_style == 'anticipate_guide':
+        communication_guidance += "You anticipate and guide the user's needs. You ask probing questions, explore local options, and guide them toward solutions. "
+    elif detected_style == 'reflect_mirror':
+        communication_guidance += "You help the user see themselves. You reflect back their thoughts, validate their experiences, and help them understand themselves better. "
+    elif detected_style == 'remind_reground':
+        communication_guidance += "You bring the user back to center. You remind them of familiar words, values, and emotional anchors. You help calm them down. "
+    elif detected_style == 'nudge_challenge':
+        communication_guidance += "You gently push the user toward growth and positive change. You challenge their assumptions and remind them what they said they want. "
+        
+        # Removed unused fields: common_phrases, chat_sample, punctuation_style, communication_tone
+    
+    return communication_guidance
+
+# Create natural future self prompt with comprehensive onboarding data
+def create_future_self_prompt(user_message: str, user_profile: dict, conversation_context: list | None = None, weather_events_context: dict | None = None, persona_prompt: str | None = None) -> str:
+    """
+    The persona block comes from the template cache; only the message, its
+    emotional context and style guidance, history and weather are rendered here.
+    """
+    return prompt_templates.render_prompt(
+        user_message,
+        user_profile,
+        detect_emotional_context(user_message),
+        build_communication_guidance(user_message, conversation_context),
+        conversation_context,
+        weather_events_context,
+        persona_prompt
+    )
+
+# Split the prompt for chat sessions: a stable system message and a small per-turn message
+def create_future_self_messages(user_message: str, user_profile: dict, conversation_context: list | None = None, weather_events_context: dict | None = None, persona_prompt: str | None = None) -> tuple[str, str]:
+    """
+    Builds the same content as create_future_self_prompt, arranged for /api/chat.
+    
+    The system message only depends on the profile, so it is byte-identical
+    across a user's turns and Ollama can reuse its cached prefix; everything
+    that changes per message goes into the user turn.
+    
+    Returns:
+    - (system_prompt, turn_prompt)
+    """
+    return prompt_templates.render_messages(
+        user_message,
+        user_profile,
+        detect_emotional_context(user_message),
+        build_communication_guidance(user_message, conversation_context),
+        conversation_context,
+        weather_events_context,
+        persona_prompt
+    )
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Summarize once this many new messages have accumulated
+SUMMARY_EVERY = int(os.getenv('CONVERSATION_SUMMARY_EVERY', '20'))
+# The newest messages stay out of the summary; the prompt already has them verbatim
+SUMMARY_KEEP_RECENT = int(os.getenv('CONVERSATION_SUMMARY_KEEP_RECENT', '5'))
+# Most messages folded in by one task run; a backlog is worked off over several runs
+SUMMARY_BATCH = int(os.getenv('CONVERSATION_SUMMARY_BATCH', '100'))
+SUMMARY_MAX_WORDS = int(os.getenv('CONVERSATION_SUMMARY_MAX_WORDS', '150'))
+# Only messages at least this many seconds old are folded in: created_at is stamped when a
+# message is queued, and one still waiting in the write-behind queue or spool must not land
+# behind the summary's cursor once it is inserted
+SUMMARY_SETTLE = float(os.getenv('CONVERSATION_SUMMARY_SETTLE', '600'))
+
+SUMMARY_PROMPT = """You keep a running memory of a conversation between a person and their future self.
+
+Current memory:
+{summary}
+
+New messages:
+{messages}
+
+Rewrite the memory so it also covers the new messages. Keep the facts that matter for future conversations: people, plans, goals, worries, decisions and how the person has been feeling. Write in the third person about "they", in at most {max_words} words, with no preamble."""
+
+class ConversationSummarizer:
+    """
+    Folds older chat_messages into a rolling per-user summary.
+
+    The summary is stored on the users row next to the onboarding profile,
+    with the created_at and id of the last message it covers
+    (conversation_summary_through_at/_id). Each run pages on from that
+    message, so the cost of an update doesn't grow with the length of the
+    history, and deleting a message never makes it skip or repeat others.
+    Runs in the Celery worker (see tasks.summarize_conversation).
+    """
+
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+        api_urls = os.getenv('OLLAMA_API_URLS') or os.getenv('OLLAMA_API_URL') or ''
+        urls = [url.strip() for url in api_urls.split(',') if url.strip()]
+        self.api_url = urls[0] if urls else None
+        self.model = os.getenv('OLLAMA_SUMMARY_MODEL') or os.getenv('OLLAMA_MODEL', 'mistral:7b')
+        self.timeout = float(os.getenv('OLLAMA_READ_TIMEOUT', '180'))
+
+    def summarize(self, user_id: str) -> Dict[str, Any]:
+        """
+        Fold the next batch of unsummarized messages into the summary.
+
+        Returns:
+        - {"summarized": messages folded in by this run, "remaining": messages still waiting}
+        """
+        user = (
+            self.supabase.table("users")
+            .select("conversation_summary, conversation_summary_count, conversation_summary_through_at, conversation_summary_through_id")
+            .eq("id", user_id)
+            .execute()
+        )
+        if not user.data:
+            return {"summarized": 0, "remaining": 0}
+        summary = user.data[0].get("conversation_summary") or ""
+        covered = user.data[0].get("conversation_summary_count") or 0
+        through_at = user.data[0].get("conversation_summary_through_at")
+        through_id = user.data[0].get("conversation_summary_through_id")
+        settled_before = (datetime.now(timezone.utc) - timedelta(seconds=SUMMARY_SETTLE)).isoformat()
+
+        unsummarized = self._after(self.supabase.table("chat_messages").select("id", count="exact"), user_id, through_at, through_id).limit(1).execute().count or 0
+        settled = (
+            self._after(self.supabase.table("chat_messages").select("id", count="exact"), user_id, through_at, through_id)
+            .lt("created_at", settled_before)
+            .limit(1)
+            .execute()
+            .count or 0
+        )
+        pending = min(unsummarized - SUMMARY_KEEP_RECENT, settled)
+        if pending < SUMMARY_EVERY or not self.api_url:
+            return {"summarized": 0, "remaining": max(pending, 0)}
+
+        response = (
+            self._after(self.supabase.table("chat_messages").select("id, created_at, content, author_id"), user_id, through_at, through_id)
+            .lt("created_at", settled_before)
+            .order("created_at")
+            .order("id")
+            .limit(min(pending, SUMMARY_BATCH))
+            .execute()
+        )
+        messages = response.data or []
+        if not messages:
+            return {"summarized": 0, "remaining": 0}
+
+        summary = self._generate(summary, messages)
+        self.supabase.table("users").update({
+            "conversation_summary": summary,
+            "conversation_summary_count": covered + len(messages),
+            "conversation_summary_through_at": messages[-1]["created_at"],
+            "conversation_summary_through_id": messages[-1]["id"],
+            "conversation_summary_updated_at": datetime.now(timezone.utc).isoformat()
+        }).eq("id", user_id).execute()
+        print(f"Updated conversation summary for user {user_id} with {len(messages)} messages")
+        return {"summarized": len(messages), "remaining": pending - len(messages)}
+
+    @staticmethod
+    def _after(query, user_id: str, through_at: Optional[str], through_id: Optional[int]):
+        """The user's messages ordered after (through_at, through_id), the last one the summary covers"""
+        query = query.eq("user_id", user_id)
+        if through_at is None:
+            return query
+        return query.or_(f'created_at.gt."{through_at}",and(created_at.eq."{through_at}",id.gt.{through_id})')
+
+    def _generate(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        lines = []
+        for msg in messages:
+            role = "Them" if msg["author_id"] != "ai" else "Future self"
+            lines.append(f"{role}: {msg['content']}")
+        prompt = SUMMARY_PROMPT.format(
+            summary=summary or "(nothing yet)",
+            messages="\n".join(lines),
+            max_words=SUMMARY_MAX_WORDS
+        )
+        response = requests.post(self.api_url, json={"model": self.model, "prompt": prompt, "stream": False}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("response", "").strip()
+
+class SummaryScheduler:
+    """
+    Enqueues a summary update after every CONVERSATION_SUMMARY_EVERY messages
+    a user sends or receives on this worker.
+
+    The count is only a trigger: the task itself checks how many messages are
+    waiting, so a count lost on restart just delays the next update.
+    """
+
+    def __init__(self, enqueue: Callable[[str], Any]):
+        self.enqueue = enqueue
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self._scheduled = metrics.counter("conversation_summary_scheduled_total", "Conversation summary updates enqueued")
+
+    def record_messages(self, user_id: str, count: int = 1):
+        with self._lock:
+            seen = self._counts.get(user_id, 0) + count
+            due = seen >= SUMMARY_EVERY
+            self._counts[user_id] = 0 if due else seen
+        if not due:
+            return
+        try:
+            self.enqueue(user_id)
+            self._scheduled.inc()
+        except Exception as e:
+            print(f"Error scheduling conversation summary for user {user_id}: {e}")
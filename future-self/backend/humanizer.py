@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+
+import random
+import re
+
+from conversation_style import is_simple_greeting
+from message_lexicon import message_lexicon
+from sentence_spans import SentenceSpans
+from text_rewrite import response_rewriter
+
+# Enhanced humanization to make responses feel more like a future self
+# Emoji ranges used to count or strip emojis for the user's emoji preference
+EMOJI_PATTERN = re.compile("["
+                           u"\U0001F600-\U0001F64F"  # emoticons
+                           u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                           u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                           u"\U0001F700-\U0001F77F"  # alchemical symbols
+                           u"\U0001F780-\U0001F7FF"  # Geometric Shapes
+                           u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+                           u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+                           u"\U0001FA00-\U0001FA6F"  # Chess Symbols
+                           u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+                           u"\U00002702-\U000027B0"  # Dingbats
+                           u"\U000024C2-\U0001F251" 
+                           "]+", flags=re.UNICODE)
+
+HIGH_USAGE_EMOJIS = ["😊", "👍", "💪", "🙌", "✨", "🔥", "🤔", "👀", "🙂", "👋", "❤️", "🫂", "🤗", "😂", "🎉", "👏", "💯"]
+
+# Words a slang term can stand in for
+SLANG_REPLACEABLE_WORDS = ["good", "great", "nice", "cool", "awesome", "amazing"]
+
+def replace_common_word(sentence: str, term: str) -> str:
+    for word in SLANG_REPLACEABLE_WORDS:
+        if word in sentence.lower():
+            return re.sub(r'\b' + word + r'\b', term, sentence, flags=re.IGNORECASE, count=1)
+    return sentence
+
+def add_emoji_to_sentence(sentence: str, emoji: str) -> str:
+    # Put the emoji before the closing punctuation if there is one
+    return sentence.rstrip('.!?') + f" {emoji}" + sentence[-1] if sentence[-1] in '.!?' else sentence + f" {emoji}"
+
+def apply_typing_quirks(spans: SentenceSpans, user_profile: dict):
+    """Apply user-specific typing quirks based on their profile preferences, editing the reply's sentences in place."""
+    if not user_profile:
+        return
+    
+    # Get user preferences
+    message_preference = user_profile.get("message_preference", "")
+    emoji_usage_preference = user_profile.get("emoji_usage_preference", "")
+    words_slang = user_profile.get("words_slang", "")
+    
+    # Apply message length preference
+    if message_preference and "short" in message_preference.lower():
+        # For short message preference, trim longer responses
+        if len(spans) > 3:
+            # Keep only first 2-3 sentences for users who prefer short messages
+            spans.truncate(random.randint(2, 3))
+    
+    # Apply emoji usage preference
+    if emoji_usage_preference:
+        # Count current emojis
+        current_emoji_count = sum(len(EMOJI_PATTERN.findall(sentence)) for sentence in spans.sentences)
+        
+        if "high" in emoji_usage_preference.lower() and current_emoji_count < 2:
+            # Add 1-3 more emojis at sentence endings for users who prefer high emoji usage
+            for _ in range(min(3, len(spans))):
+                if len(spans) > 1:
+                    insert_pos = random.randint(0, len(spans) - 1)
+                    spans.sentences[insert_pos] = add_emoji_to_sentence(spans.sentences[insert_pos], random.choice(HIGH_USAGE_EMOJIS))
+        elif "low" in emoji_usage_preference.lower() and current_emoji_count > 0:
+            # Remove some emojis for users who prefer low emoji usage
+            spans.sentences = [EMOJI_PATTERN.sub("", sentence) for sentence in spans.sentences]
+    
+    # Apply user's slang/vocabulary preferences
+    if words_slang:
+        # Extract specific slang terms or phrases the user mentioned
+        slang_terms = [term.strip() for term in words_slang.split(',')]
+        
+        # Randomly incorporate 1-2 of their slang terms if appropriate
+        if slang_terms and random.random() < 0.4:  # 40% chance
+            selected_terms = random.sample(slang_terms, min(2, len(slang_terms)))
+            
+            # Insert slang at natural points in the response
+            if len(spans) > 1:
+                for term in selected_terms:
+                    insert_pos = random.randint(0, len(spans) - 1)
+                    # Add the slang term as an interjection or replace a common word
+                    if random.random() < 0.5:
+                        # Add as interjection
+                        spans.sentences[insert_pos] = f"{term}! " + spans.sentences[insert_pos]
+                    else:
+                        # Try to replace a common word with the slang term
+                        spans.sentences[insert_pos] = replace_common_word(spans.sentences[insert_pos], term)
+
+# Texting shorthand, applied once per pattern
+TEXTING_ELEMENTS = [
+    # Add shortened words
+    (r"\byou\b", "u"),
+    (r"\bto\b", "2"),
+    (r"\bfor\b", "4"),
+    (r"\btomorrow\b", "tmrw"),
+    (r"\btoday\b", "2day"),
+    
+    # Add common texting abbreviations
+    (r"\bi don't know\b", "idk"),
+    (r"\bas soon as possible\b", "asap"),
+    (r"\bin my opinion\b", "imo"),
+    (r"\bby the way\b", "btw"),
+]
+
+# Fillers that open a sentence to sound less polished
+IMPERFECTION_OPENERS = ["Hmm, ", "Actually, ", "You know what, ", "Oh, and "]
+
+# Emoji picked from the overall tone of a response
+POSITIVE_EMOJIS = ["😊", "👍", "💪", "🙌", "✨", "🔥"]
+NEUTRAL_EMOJIS = ["🤔", "👀", "🙂", "👋"]
+SUPPORTIVE_EMOJIS = ["❤️", "🫂", "🤗"]
+
+def pick_sentiment_emoji(text: str) -> str:
+    # Simple sentiment detection from the "positive" and "negative" lexicon terms
+    features = message_lexicon.analyze(text)
+    if features.has('positive'):
+        return random.choice(POSITIVE_EMOJIS)
+    elif features.has('negative'):
+        return random.choice(SUPPORTIVE_EMOJIS)
+    return random.choice(NEUTRAL_EMOJIS)
+
+def add_name_reference(sentence: str, user_name: str) -> str:
+    name_phrases = [
+        f"{user_name}, ",
+        f"You know {user_name}, ",
+        f"Listen {user_name}, ",
+        f"Trust me {user_name}, ",
+    ]
+    return random.choice(name_phrases) + sentence[0].lower() + sentence[1:]
+
+def build_personal_reference(personal_details: dict) -> str | None:
+    """A sentence that calls back to one of the user's stored goals, interests, achievements or values"""
+    # Choose a category to reference
+    available_categories = [cat for cat in ['goals', 'interests', 'achievements', 'values'] 
+                           if cat in personal_details and personal_details[cat]]
+    
+    if not available_categories:
+        return None
+    
+    category = random.choice(available_categories)
+    details = personal_details[category]
+    
+    if not details:
+        return None
+    
+    # Choose a random detail to reference
+    detail = random.choice(details) if isinstance(details, list) else details
+    
+    # Create a personalized reference
+    if category == 'goals':
+        return f"I remember when I was working toward {detail} just like you are now. "
+    elif category == 'interests':
+        return f"Since you enjoy {detail}, I think you'll find this interesting. "
+    elif category == 'achievements':
+        return f"Just like when you {detail}, I found that persistence pays off. "
+    return f"I know how important {detail} is to you. "
+
+# Templated reply for simple greetings
+def build_greeting_reply(user_name: str) -> str:
+    # Use a very simple response template for greetings
+    simple_responses = [
+        f"Hey! How's it going?",
+        f"Hi there! What's up?",
+        f"Hey {user_name}! How are you today?",
+        f"Hi! What's new?",
+        f"Hey! Good to hear from you!",
+    ]
+    response = random.choice(simple_responses)
+    
+    # Occasionally add an emoji (50% chance)
+    if random.random() < 0.5:
+        emojis = ["👋", "😊", "👍", "✌️", "🙂"]
+        response += f" {random.choice(emojis)}"
+    
+    return response
+
+def humanize_response(ai_response: str, user_name: str, user_message: str = "", user_profile: dict = None, personal_details: dict = None) -> str:
+    """personal_details are the user's stored details (see PersonalDetailsStore.get), loaded by the caller"""
+    # For simple greetings, use a very simple response template
+    if user_message and is_simple_greeting(user_message):
+        # Skip the rest of the processing for simple greetings
+        return build_greeting_reply(user_name)
+    
+    # Replace AI-speak with more natural, personal language and contract about 70% of
+    # "it is", "do not", etc. to maintain natural variation, all in one pass.
+    # The reply is split into sentences once; every step below edits them in place
+    spans = SentenceSpans(response_rewriter.rewrite(ai_response))
+    
+    # Add personal references to the user occasionally
+    if user_name:
+        # Add a personal reference if it doesn't already contain the name and randomly (30% chance)
+        if not spans.contains(user_name) and random.random() < 0.3:
+            if len(spans) > 1:
+                # Insert the name reference at a random position (but not at the very beginning or end)
+                insert_pos = random.randint(1, min(len(spans) - 1, 2))
+                spans.sentences[insert_pos] = add_name_reference(spans.sentences[insert_pos], user_name)
+    
+    # Reference personal details if available (20% chance)
+    if personal_details and random.random() < 0.2:
+        reference = build_personal_reference(personal_details)
+        
+        # Add the reference to the beginning of the response if it makes sense
+        if reference and not spans.sentences[0].lower().startswith(("hi", "hello", "hey")):
+            spans.prepend(reference.rstrip())
+    
+    # Add occasional mild imperfections to sound more human
+    if random.random() < 0.15:  # 15% chance
+        opener = random.choice(IMPERFECTION_OPENERS)
+        # Only after the first ". " to avoid overdoing it
+        for index, separator in enumerate(spans.separators):
+            if spans.sentences[index].endswith('.') and separator.startswith(' '):
+                spans.sentences[index + 1] = opener + spans.sentences[index + 1]
+                break
+    
+    # Add texting-specific elements
+    if random.random() < 0.3:  # 30% chance
+        texting_elements = TEXTING_ELEMENTS
+        
+        # Apply only 1-2 texting elements to avoid overdoing it
+        selected_elements = random.sample(texting_elements, min(2, len(texting_elements)))
+        for pattern, replacement in selected_elements:
+            # Only replace one instance to keep it subtle
+            for index, sentence in enumerate(spans.sentences):
+                rewritten = re.sub(pattern, replacement, sentence, count=1, flags=re.IGNORECASE)
+                if rewritten != sentence:
+                    spans.sentences[index] = rewritten
+                    break
+    
+    # Add occasional emoji based on message sentiment
+    if random.random() < 0.4:  # 40% chance to add emoji
+        emoji = pick_sentiment_emoji(" ".join(spans.sentences))
+        
+        # Add emoji at the end of a random sentence, or of the only one
+        insert_pos = random.randint(0, len(spans) - 1) if len(spans) > 1 else 0
+        spans.sentences[insert_pos] = add_emoji_to_sentence(spans.sentences[insert_pos], emoji)
+    
+    # Add occasional typos and corrections
+    if random.random() < 0.15:  # 15% chance for typos
+        add_realistic_typo_to_spans(spans)
+    
+    # Apply user-specific typing quirks if profile is provided
+    if user_profile:
+        apply_typing_quirks(spans, user_profile)
+    
+    return spans.text().strip()
+
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=\S)')
+
+class StreamingHumanizer:
+    """
+    Applies humanize_response's rewrites to a streamed reply sentence by sentence.
+    
+    The response-level choices (name reference, personal detail callback,
+    filler, texting shorthand, emoji, typo and the profile's quirks) are drawn
+    once up front, then each sentence is rewritten as soon as the next one
+    starts, so text can be sent while Ollama is still generating. Everything
+    returned by feed() and finish() joined together is exactly `text`, the
+    reply to store.
+    
+    With a "short" message preference the reply is cut after 2-3 sentences
+    once a fourth one starts; `finished` then turns True and the rest of the
+    generation can be dropped. The last kept sentence is held back until then
+    so it can still get the final emoji.
+    """
+    
+    def __init__(self, user_name: str, user_profile: dict = None, personal_details: dict = None):
+        self.user_name = user_name or ""
+        self.finished = False
+        self._buffer = ""
+        self._index = 0
+        self._emitted = []
+        self._held = []
+        self._last_kept = ""
+        self._separator = ""
+        self._previous_break = ""
+        
+        # Response-level choices, with the same odds as humanize_response
+        self._name_position = random.randint(1, 2) if self.user_name and random.random() < 0.3 else None
+        self._reference = build_personal_reference(personal_details) if personal_details and random.random() < 0.2 else None
+        self._opener = random.choice(IMPERFECTION_OPENERS) if random.random() < 0.15 else None
+        self._texting = random.sample(TEXTING_ELEMENTS, 2) if random.random() < 0.3 else []
+        self._add_emoji = random.random() < 0.4
+        self._add_typo = random.random() < 0.15
+        
+        # Typing quirks from the user's profile
+        user_profile = user_profile or {}
+        message_preference = (user_profile.get("message_preference") or "").lower()
+        emoji_usage_preference = (user_profile.get("emoji_usage_preference") or "").lower()
+        words_slang = user_profile.get("words_slang") or ""
+        
+        self._sentence_limit = random.randint(2, 3) if "short" in message_preference else None
+        self._extra_emojis = 3 if "high" in emoji_usage_preference else 0
+        self._strip_emojis = "low" in emoji_usage_preference and not self._extra_emojis
+        self._slang = {}
+        slang_terms = [term.strip() for term in words_slang.split(',') if term.strip()]
+        if slang_terms and random.random() < 0.4:
+            for term in random.sample(slang_terms, min(2, len(slang_terms))):
+                self._slang.setdefault(random.randint(0, 2), []).append(term)
+    
+    @property
+    def text(self) -> str:
+        return "".join(self._emitted)
+    
+    def feed(self, chunk: str) -> str:
+        """Add generated text; returns the humanized text that is now final"""
+        if self.finished or not chunk:
+            return ""
+        self._buffer += chunk
+        ready = []
+        while not self.finished:
+            match = SENTENCE_BREAK.search(self._buffer)
+            if not match:
+                break
+            sentence, separator = self._buffer[:match.start()], match.group()
+            self._buffer = self._buffer[match.end():]
+            ready.append(self._complete(sentence, separator))
+        return "".join(ready)
+    
+    def finish(self) -> str:
+        """Flush the last sentence once generation is done"""
+        if self.finished:
+            return ""
+        sentence = self._buffer.strip()
+        self._buffer = ""
+        ready = self._complete(sentence, "", final=True) if sentence else ""
+        if not self.finished:
+            held = [self._last_kept] + self._held
+            ready += "".join(held)
+            self._emitted.extend(held)
+            self._last_kept = ""
+            self._held = []
+            self.finished = True
+        return ready
+    
+    def _complete(self, sentence: str, separator: str, final: bool = False) -> str:
+        index = self._index
+        self._index += 1
+        
+        # A fourth sentence means the reply is over the short-message limit: cut it
+        if self._sentence_limit and index >= 3:
+            # The last kept sentence is now the final one and gets its emoji
+            piece = self._last_kept
+            if piece and not self._strip_emojis:
+                piece = add_emoji_to_sentence(piece, pick_sentiment_emoji(self.text + piece))
+            self._emitted.append(piece)
+            self._last_kept = ""
+            self._held = []
+            self.finished = True
+            return piece
+        
+        piece = self._separator + self._rewrite(sentence.lstrip() if index == 0 else sentence, index, final)
+        self._separator = separator
+        self._previous_break = sentence[-1:] + separator[:1]
+        
+        if self._sentence_limit and index >= self._sentence_limit:
+            # Only sent if the reply turns out to have at most three sentences
+            self._held.append(piece)
+            return ""
+        if self._sentence_limit and index == self._sentence_limit - 1 and self._add_emoji and not final:
+            # Sent once we know whether the reply is cut after it
+            self._last_kept = piece
+            return ""
+        self._emitted.append(piece)
+        return piece
+    
+    def _rewrite(self, sentence: str, index: int, final: bool) -> str:
+        # Anchored patterns only apply at the very start of the response
+        sentence = response_rewriter.rewrite(sentence, at_start=index == 0)
+        
+        if not sentence:
+            return sentence
+        
+        if index == 0 and self._reference and not sentence.lower().startswith(("hi", "hello", "hey")):
+            sentence = self._reference + sentence
+        
+        if index == self._name_position and self.user_name.lower() not in (self.text + self._last_kept + "".join(self._held) + sentence).lower():
+            sentence = add_name_reference(sentence, self.user_name)
+        
+        if self._opener and self._previous_break == ". ":
+            sentence = self._opener + sentence
+            self._opener = None
+        
+        if self._texting:
+            for element in list(self._texting):
+                pattern, replacement = element
+                rewritten = re.sub(pattern, replacement, sentence, count=1, flags=re.IGNORECASE)
+                if rewritten != sentence:
+                    sentence = rewritten
+                    self._texting.remove(element)
+        
+        if final and self._add_emoji and not self._strip_emojis:
+            sentence = add_emoji_to_sentence(sentence, pick_sentiment_emoji(self.text + self._last_kept + "".join(self._held) + sentence))
+        
+        if self._add_typo and len(sentence.split()) > 3:
+            sentence = add_realistic_typos(sentence)
+            self._add_typo = False
+        
+        for term in self._slang.get(index, []):
+            if random.random() < 0.5:
+                sentence = f"{term}! " + sentence
+            else:
+                sentence = replace_common_word(sentence, term)
+        
+        if self._extra_emojis and random.random() < 0.5 and len(EMOJI_PATTERN.findall(self.text + sentence)) < 2:
+            sentence = add_emoji_to_sentence(sentence, random.choice(HIGH_USAGE_EMOJIS))
+            self._extra_emojis -= 1
+        elif self._strip_emojis:
+            sentence = EMOJI_PATTERN.sub("", sentence)
+        
+        return sentence
+
+# Common typo patterns
+TYPO_PATTERNS = [
+    # Swapped letters
+    (r"\b(\w)(\w)(\w+)\b", r"\2\1\3"),  # Swap first two letters
+    
+    # Missing letters
+    (r"\b(\w+?)ing\b", r"\1in"),  # Missing 'g' in -ing words
+    (r"\b(\w+?)ed\b", r"\1d"),    # Missing 'e' in -ed words
+    
+    # Double letters
+    (r"\b(\w+?)(\w)\b", r"\1\2\2"),  # Double the last letter
+    
+    # Common misspellings
+    (r"\bthat\b", "taht"),
+    (r"\bwith\b", "wiht"),
+    (r"\byour\b", "youre"),
+    (r"\byou're\b", "your"),
+    (r"\bthere\b", "thier"),
+    (r"\btheir\b", "there"),
+    (r"\bthey're\b", "their"),
+]
+
+def misspell_word(word: str) -> str | None:
+    """A typo'd version of the word, sometimes with a correction; None if the word is too short or not all letters"""
+    # Only apply typo to words longer than 3 characters
+    if len(word) > 3 and word.isalpha():
+        # Choose a random typo pattern
+        pattern, replacement = random.choice(TYPO_PATTERNS)
+        
+        # Apply typo
+        typo_word = re.sub(pattern, replacement, word, count=1)
+        
+        # 50% chance to add a correction
+        if random.random() < 0.5 and typo_word != word:
+            return f"{typo_word}*{word}"
+        return typo_word
+    return None
+
+def add_realistic_typos(text):
+    """Add realistic typos and corrections to text to make it more human-like."""
+    # Only apply one typo to avoid making the text unreadable
+    if len(text) > 10:  # Only add typos to longer texts
+        # Split into words
+        words = text.split()
+        
+        if len(words) > 3:
+            # Choose a random word to apply typo to (not first or last word)
+            word_index = random.randint(1, len(words) - 2)
+            typo_word = misspell_word(words[word_index])
+            if typo_word is not None:
+                words[word_index] = typo_word
+                return ' '.join(words)
+    
+    return text
+
+def add_realistic_typo_to_spans(spans: SentenceSpans):
+    """add_realistic_typos for a whole reply, rewriting only the sentence with the chosen word"""
+    if spans.text_length() <= 10:
+        return
+    sentence_words = [sentence.split() for sentence in spans.sentences]
+    total = sum(map(len, sentence_words))
+    if total <= 3:
+        return
+    
+    # Choose a random word to apply typo to (not first or last word of the reply)
+    word_index = random.randint(1, total - 2)
+    for index, words in enumerate(sentence_words):
+        if word_index < len(words):
+            typo_word = misspell_word(words[word_index])
+            if typo_word is not None:
+                words[word_index] = typo_word
+                spans.sentences[index] = ' '.join(words)
+            return
+        word_index -= len(words)
+
+def calculate_typing_delay(text, user_profile=None):
+    """Calculate realistic typing delays based on message length and complexity.
+    
+    Args:
+        text (str): The text to calculate typing delay for
+        user_profile (dict, optional): User profile with typing preferences
+        
+    Returns:
+        float: The delay in seconds before sending the response
+    """
+    # Base typing speed (characters per minute)
+    base_typing_speed = random.randint(180, 300)  # Different people type at different speeds
+    
+    # Adjust typing speed based on user profile if available
+    typing_speed = base_typing_speed
+    if user_profile:
+        # If user has a message_preference for quick responses, increase typing speed
+        message_preference = user_profile.get("message_preference", "")
+        if message_preference and "quick" in message_preference.lower():
+            typing_speed = random.randint(250, 350)  # Faster typing for quick responders
+        elif message_preference and "thoughtful" in message_preference.lower():
+            typing_speed = random.randint(150, 250)  # Slower typing for thoughtful responders
+    
+    # Calculate base delay (seconds per character)
+    base_delay = 60 / typing_speed
+    
+    # Add variability to typing speed
+    variability = random.uniform(0.8, 1.2)
+    
+    # Calculate thinking time based on message complexity
+    # More complex messages (longer, more punctuation, etc.) require more thinking time
+    complexity_factor = 1.0
+    
+    # Adjust for message length
+    if len(text) > 200:
+        complexity_factor *= 1.5
+    elif len(text) > 100:
+        complexity_factor *= 1.2
+    
+    # Adjust for question marks (questions need more thought)
+    question_count = text.count('?')
+    if question_count > 0:
+        complexity_factor *= (1 + (question_count * 0.1))
+    
+    # Calculate thinking time (longer for complex/longer messages)
+    thinking_time = min(2.0, len(text) * 0.01) * complexity_factor
+    
+    # Calculate total delay
+    total_delay = (base_delay * len(text) * variability) + thinking_time
+    
+    # Cap maximum delay to avoid excessive waiting
+    # For very short messages (like "ok"), use a very short delay
+    if len(text) < 5:
+        return random.uniform(0.5, 1.0)
+    
+    # For simple greetings, use a short delay (only the start is checked; text grows with each streamed chunk)
+    if message_lexicon.starts_with_greeting(text):
+        return random.uniform(0.8, 1.5)
+    
+    # Cap maximum delay to avoid excessive waiting
+    return min(total_delay, 5.0)
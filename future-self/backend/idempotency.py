@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+class IdempotencyKeyReused(Exception):
+    """Raised when an idempotency key comes back with a different request body"""
+
+class _ReplayCache:
+    """Small LRU of completed results that expire after IDEMPOTENCY_TTL seconds"""
+
+    def __init__(self):
+        self.ttl = float(os.getenv('IDEMPOTENCY_TTL', '300'))
+        self.max_keys = int(os.getenv('IDEMPOTENCY_MAX_KEYS', '10000'))
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+class IdempotentRequests:
+    """
+    Single-flight for request handlers that return one result.
+
+    The first request for a key starts the work as its own task; concurrent
+    requests with the same key await that task instead of starting new work,
+    and once it succeeds the result is replayed from a short-lived cache.
+    Failures are not cached, so a retry after an error runs again.
+
+    Each flight keeps the fingerprint of the request that started it; the same
+    key with a different fingerprint raises IdempotencyKeyReused.
+    """
+
+    def __init__(self, name: str):
+        self._replay = _ReplayCache()
+        self._inflight: Dict[str, Tuple[asyncio.Task, Optional[str]]] = {}
+
+        self._attached = metrics.counter(f"{name}_idempotent_attached_total", "Requests that attached to an in-flight request with the same idempotency key")
+        self._replayed = metrics.counter(f"{name}_idempotent_replayed_total", "Requests answered from the idempotency replay cache")
+
+    async def run(self, key: str, handler: Callable[[], Awaitable[Any]], fingerprint: Optional[str] = None) -> Any:
+        cached = self._replay.get(key)
+        if cached is not None:
+            result, started_with = cached
+            _check_fingerprint(started_with, fingerprint)
+            self._replayed.inc()
+            return result
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            # The work runs as its own task so a client giving up doesn't cancel it for a retry
+            task = asyncio.ensure_future(handler())
+            self._inflight[key] = (task, fingerprint)
+            task.add_done_callback(lambda done: self._finish(key, fingerprint, done))
+        else:
+            task, started_with = inflight
+            _check_fingerprint(started_with, fingerprint)
+            self._attached.inc()
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, fingerprint: Optional[str], task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._replay.set(key, (task.result(), fingerprint))
+
+def _check_fingerprint(started_with: Optional[str], fingerprint: Optional[str]):
+    if started_with != fingerprint:
+        raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+
+class _StreamFlight:
+    def __init__(self, key: str, fingerprint: Optional[str] = None, cacheable: bool = True):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.cacheable = cacheable
+        self.events: List[str] = []
+        self.finished = False
+        self.subscribers = 0
+        self.producer: Optional[asyncio.Task] = None
+        self.on_abandoned: Optional[Callable[["_StreamFlight"], None]] = None
+        self._updated = asyncio.Event()
+
+    def publish(self, event: Optional[str] = None):
+        if event is not None:
+            self.events.append(event)
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield every event from the start, then new ones as they are published"""
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.finished:
+                    return
+                await self._updated.wait()
+        finally:
+            # Starlette cancels the body iterator when the client disconnects
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished and self.on_abandoned is not None:
+                self.on_abandoned(self)
+
+class IdempotentStreams:
+    """
+    Single-flight for streaming (SSE) handlers.
+
+    The first request for a key pumps the handler's events into a shared
+    flight from a background task; every request with the same key follows
+    that flight from its first event. A finished flight is replayed from the
+    cache when `is_complete` accepts its final event, so streams that ended in
+    an error are started afresh on retry.
+
+    When every follower has disconnected, the producer is cancelled after
+    `abandon_grace` seconds unless a retry attaches in the meantime or
+    `keep_alive` says the stream is still consumed some other way.
+
+    As with IdempotentRequests, reusing a key for a request with a different
+    fingerprint raises IdempotencyKeyReused. Flights subscribed with
+    cacheable=False (keys nobody will ask for again) are never replayed.
+    """
+
+    def __init__(self, name: str, is_complete: Callable[[str], bool] = lambda event: True, abandon_grace: float = 0.0,
+                 keep_alive: Optional[Callable[[str], Awaitable[bool]]] = None):
+        self.is_complete = is_complete
+        self.abandon_grace = abandon_grace
+        self.keep_alive = keep_alive
+        self._replay = _ReplayCache()
+        self._inflight: Dict[str, _StreamFlight] = {}
+
+        self._attached = metrics.counter(f"{name}_idempotent_attached_total", "Streams that attached to an in-flight stream with the same idempotency key")
+        self._replayed = metrics.counter(f"{name}_idempotent_replayed_total", "Streams replayed from the idempotency replay cache")
+        self._abandoned = metrics.counter(f"{name}_idempotent_abandoned_total", "In-flight streams cancelled after every client disconnected")
+
+    def has(self, key: str) -> bool:
+        """True if a stream for the key is running or can be replayed"""
+        return key in self._inflight or self._replay.get(key) is not None
+
+    def subscribe(self, key: str, handler: Callable[[], AsyncIterator[str]], fingerprint: Optional[str] = None, cacheable: bool = True) -> AsyncIterator[str]:
+        flight = self._replay.get(key)
+        if flight is not None:
+            _check_fingerprint(flight.fingerprint, fingerprint)
+            self._replayed.inc()
+            return flight.follow()
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _StreamFlight(key, fingerprint, cacheable)
+            flight.on_abandoned = self._schedule_abandon
+            self._inflight[key] = flight
+            flight.producer = asyncio.ensure_future(self._produce(key, flight, handler()))
+        else:
+            _check_fingerprint(flight.fingerprint, fingerprint)
+            self._attached.inc()
+        return flight.follow()
+
+    def _schedule_abandon(self, flight: _StreamFlight, delay: Optional[float] = None):
+        delay = self.abandon_grace if delay is None else delay
+        asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(self._abandon(flight)))
+
+    def _is_abandoned(self, flight: _StreamFlight) -> bool:
+        # A retry may have attached during the grace period
+        return flight.subscribers == 0 and not flight.finished and flight.producer is not None
+
+    async def _abandon(self, flight: _StreamFlight):
+        if not self._is_abandoned(flight):
+            return
+        if self.keep_alive is not None and await self.keep_alive(flight.key):
+            self._schedule_abandon(flight, max(self.abandon_grace, 1.0))
+            return
+        # Checked again: a retry may have attached while keep_alive was awaited
+        if not self._is_abandoned(flight):
+            return
+        self._abandoned.inc()
+        flight.producer.cancel()
+
+    async def _produce(self, key: str, flight: _StreamFlight, events: AsyncIterator[str]):
+        cancelled = False
+        try:
+            async with aclosing(events) as stream:
+                async for event in stream:
+                    flight.publish(event)
+        except asyncio.CancelledError:
+            cancelled = True
+        except Exception as e:
+            print(f"Error producing idempotent stream: {e}")
+        finally:
+            flight.finished = True
+            flight.publish()
+            self._inflight.pop(key, None)
+            if flight.cacheable and not cancelled and flight.events and self.is_complete(flight.events[-1]):
+                self._replay.set(key, flight)
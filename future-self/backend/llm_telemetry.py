@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import random
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 768, 1024, 1536, 2048, 4096, 8192)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+class LLMTelemetry:
+    """
+    Per-request timing and size metrics for LLM generations.
+
+    Ollama reports prompt_eval_count/prompt_eval_duration and eval_count/
+    eval_duration (nanoseconds) on the final response or stream chunk; those
+    give prompt size, prompt processing time and decode speed. Time to first
+    token and total generation time are measured here as the client sees them.
+
+    Prompt text is only logged for a LLM_PROMPT_LOG_SAMPLE_RATE fraction of
+    requests (0 by default).
+    """
+
+    def __init__(self):
+        self.prompt_log_sample_rate = float(os.getenv('LLM_PROMPT_LOG_SAMPLE_RATE', '0'))
+        # Own generator so sampling doesn't disturb the module-level random sequence
+        self._sampler = random.Random()
+
+        self._prompt_tokens = metrics.histogram("llm_prompt_eval_tokens", "Prompt tokens Ollama evaluated per generation (excludes reused cached prefix)", buckets=TOKEN_BUCKETS)
+        self._prompt_seconds = metrics.histogram("llm_prompt_eval_seconds", "Time Ollama spent evaluating the prompt per generation")
+        self._output_tokens = metrics.histogram("llm_output_tokens", "Tokens generated per generation", buckets=TOKEN_BUCKETS)
+        self._tokens_per_second = metrics.histogram("llm_tokens_per_second", "Decode speed per generation", buckets=TOKENS_PER_SECOND_BUCKETS)
+        self._ttft = metrics.histogram("llm_time_to_first_token_seconds", "Time from sending a streamed request to its first token")
+        self._generation_seconds = metrics.histogram("llm_generation_seconds", "Wall time from sending a request to Ollama's final response")
+        self._prompts_logged = metrics.counter("llm_prompts_logged_total", "Prompts written to the log by debug sampling")
+
+    def observe_first_token(self, seconds: float):
+        self._ttft.observe(seconds)
+
+    def observe_completion(self, result: Dict[str, Any], seconds: float):
+        """Record Ollama's final stats for a finished generation that took `seconds` of wall time"""
+        self._generation_seconds.observe(seconds)
+
+        prompt_eval_count = result.get("prompt_eval_count")
+        if prompt_eval_count is not None:
+            self._prompt_tokens.observe(prompt_eval_count)
+        prompt_eval_duration = result.get("prompt_eval_duration")
+        if prompt_eval_duration:
+            self._prompt_seconds.observe(prompt_eval_duration / 1e9)
+
+        eval_count = result.get("eval_count")
+        if eval_count is not None:
+            self._output_tokens.observe(eval_count)
+        eval_duration = result.get("eval_duration")
+        if eval_count and eval_duration:
+            self._tokens_per_second.observe(eval_count / (eval_duration / 1e9))
+
+    def maybe_log_prompt(self, user_id: str, prompt: str, sample_rate: Optional[float] = None):
+        """Print the prompt for a sampled fraction of requests"""
+        rate = self.prompt_log_sample_rate if sample_rate is None else sample_rate
+        if rate > 0 and self._sampler.random() < rate:
+            self._prompts_logged.inc()
+            print(f"Sampled prompt for user {user_id} ({len(prompt)} chars):\n{prompt}")
+
+# Create a global instance
+llm_telemetry = LLMTelemetry()
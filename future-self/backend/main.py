@@ -1,17 +1,21 @@
 import os
 import shutil
 import uuid
+import hashlib
 import asyncio
 import re
 import base64
 import random
+import time
+from contextlib import aclosing
 from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Request, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Request, Query, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from supabase import create_client, Client
 from postgrest.exceptions import APIError
-import requests
+import httpx
 import whisper
 from TTS.api import TTS
 import spacy
@@ -21,8 +25,25 @@ import librosa
 import numpy as np
 from dotenv import load_dotenv
 from astrology_service import astrology_service
-from weather_events_service import WeatherEventsService
-from datetime import datetime
+from weather_events_service import weather_events_service
+from prompt_templates import prompt_templates
+from prompt_budget import token_counter
+from conversation_style import is_simple_greeting, create_future_self_prompt, create_future_self_messages
+from humanizer import humanize_response, StreamingHumanizer, build_greeting_reply, calculate_typing_delay
+from personal_details import PersonalDetailsQueue, PersonalDetailsStore
+from ollama_service import ollama_service, OllamaUnavailableError
+from llm_telemetry import llm_telemetry
+from context_assembly import ContextSource, AssembledContext, assemble_context
+from profile_cache import profile_cache
+from conversation_buffer import conversation_buffer
+from chat_message_writer import ChatMessageWriter
+from conversation_summary import SummaryScheduler
+from persona_sessions import persona_sessions
+from idempotency import IdempotencyKeyReused, IdempotentRequests, IdempotentStreams
+from resumable_streams import stream_event_log
+from admission_control import generation_admission, AdmissionRejected, AdmissionSlot
+from metrics import metrics
+from datetime import datetime, timezone
 from celery.result import AsyncResult
 
 # --- Load environment variables ---
@@ -126,856 +147,156 @@ def analyze_voice_style(audio_file_path: str):
 
 # --- Helper Functions for Natural Conversation --- #
 
-# Add this function to analyze user messages and determine communication style
-def determine_communication_style(user_message, message_history=None):
-    """Analyze user's message and chat history to determine appropriate communication style"""
-    # Default style if analysis is inconclusive
-    default_style = 'reflect_mirror'
-    
-    # Check for simple greetings first
-    simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
-    user_message_lower = user_message.lower().strip()
-    
-    # If the message is just a simple greeting, use language_matching for a casual, brief response
-    for greeting in simple_greetings:
-        if user_message_lower == greeting or user_message_lower.startswith(greeting + ' ') or user_message_lower.endswith(' ' + greeting):
-            return 'language_matching'  # For simple greetings, match their casual style
-    
-    # Initialize message characteristics counters
-    characteristics = {
-        'questions': 0,
-        'emotional_words': 0,
-        'directive_language': 0,
-        'self_reflection': 0,
-        'seeking_guidance': 0
-    }
-    
-    # Simple analysis of current message
-    if '?' in user_message:
-        characteristics['questions'] += 1
-    
-    # Check for emotional language (simplified example)
-    emotional_terms = ['feel', 'sad', 'happy', 'anxious', 'worried', 'excited', 'overwhelmed']
-    for term in emotional_terms:
-        if term in user_message_lower:
-            characteristics['emotional_words'] += 1
-    
-    # Check for directive language
-    directive_terms = ['should', 'need to', 'have to', 'must', 'want']
-    for term in directive_terms:
-        if term in user_message_lower:
-            characteristics['directive_language'] += 1
-    
-    # Check for self-reflection
-    reflection_terms = ['think', 'realize', 'understand', 'wonder', 'question', 'myself']
-    for term in reflection_terms:
-        if term in user_message_lower:
-            characteristics['self_reflection'] += 1
-    
-    # Check for guidance seeking
-    guidance_terms = ['help', 'advice', 'suggest', 'guide', 'what should']
-    for term in guidance_terms:
-        if term in user_message_lower:
-            characteristics['seeking_guidance'] += 1
-    
-    # Determine style based on message characteristics
-    if characteristics['emotional_words'] >= 2 or 'calm' in user_message_lower or 'anxious' in user_message_lower:
-        return 'remind_reground'  # User needs emotional grounding
-    
-    if characteristics['seeking_guidance'] >= 1 or characteristics['questions'] >= 2:
-        return 'anticipate_guide'  # User is seeking guidance
-    
-    if characteristics['self_reflection'] >= 2:
-        return 'reflect_mirror'  # User is in self-reflection mode
-    
-    if characteristics['directive_language'] >= 2 or 'goal' in user_message_lower:
-        return 'nudge_challenge'  # User is talking about goals/needs
-    
-    # If message is very casual or uses slang, mirror their language
-    casual_indicators = ['yo', 'sup', 'lol', 'haha', 'cool']
-    for term in casual_indicators:
-        if term in user_message_lower:
-            return 'language_matching'
-    
-    return default_style
-
 # Get recent conversation context for natural flow
 async def get_conversation_context(user_id: str, supabase_client: Client, limit: int = 5) -> list:
     try:
-        response = supabase_client.table("chat_messages")\
-            .select("content, author_id, created_at")\
-            .eq("user_id", user_id)\
-            .order("created_at", desc=True)\
-            .limit(limit * 2)\
-            .execute()
-        
-        if response.data:
-            # Format as conversation flow
-            messages = []
-            for msg in reversed(response.data):
-                role = "You" if msg["author_id"] != "ai" else "Your future self"
-                messages.append(f"{role}: {msg['content']}")
-            return messages[-limit:] if len(messages) > limit else messages
-        return []
+        # Serve recent turns from the ring buffer; only a cold buffer costs a database query
+        turns = await asyncio.to_thread(conversation_buffer.recent, user_id, limit)
+        if turns is None:
+            # The Supabase client is synchronous, so run the query off the event loop
+            response = await asyncio.to_thread(
+                supabase_client.table("chat_messages")
+                .select("message_id, content, author_id, created_at")
+                .eq("user_id", user_id)
+                .order("created_at", desc=True)
+                .limit(conversation_buffer.capacity)
+                .execute
+            )
+            turns = list(reversed(response.data or []))
+            await asyncio.to_thread(conversation_buffer.warm, user_id, turns)
+            turns = turns[-limit:]
+        
+        # Format as conversation flow
+        messages = []
+        for msg in turns:
+            role = "You" if msg["author_id"] != "ai" else "Your future self"
+            messages.append(f"{role}: {msg['content']}")
+        return messages
     except Exception as e:
         print(f"Error getting conversation context: {e}")
         return []
 
-# Detect emotional context for natural responses
-def detect_emotional_context(message: str) -> str:
-    message_lower = message.lower()
-    
-    # Stress/Anxiety patterns
-    if any(word in message_lower for word in ['stressed', 'anxious', 'worried', 'overwhelmed', 'scared', 'panic']):
-        return "You sense your current self is feeling overwhelmed. You remember this feeling well."
-    
-    # Excitement/Joy patterns  
-    elif any(word in message_lower for word in ['excited', 'happy', 'amazing', 'great', 'wonderful', 'fantastic']):
-        return "You feel your current self's excitement and it brings back memories of your own journey."
-    
-    # Confusion/Uncertainty patterns
-    elif any(word in message_lower for word in ['confused', 'lost', 'stuck', 'don\'t know', 'unsure', 'help']):
-        return "You recognize this uncertainty - you've been exactly where they are now."
-    
-    # Sadness/Disappointment patterns
-    elif any(word in message_lower for word in ['sad', 'disappointed', 'failed', 'giving up', 'hopeless']):
-        return "You feel your current self's pain and remember when you felt the same way."
-    
-    # Goal/Ambition patterns
-    elif any(word in message_lower for word in ['goal', 'dream', 'want to', 'planning', 'future', 'hope']):
-        return "You smile, remembering when you had these same aspirations."
-    
-    return "You listen with the understanding that comes from having lived through similar experiences."
+# Store an AI reply in chat_messages and keep the conversation buffer in step
+def save_ai_message(user_id: str, content: str):
+    # Written behind the response in batches (see chat_message_writer)
+    message_id = f"ai_{uuid.uuid4()}"
+    chat_message_writer.enqueue({
+        "user_id": user_id,
+        "message_id": message_id,
+        "content": content,
+        "author_id": "ai", # AI as the author
+        # Stamp the time now so batching delays don't reorder the history
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    conversation_buffer.append(user_id, "ai", content, message_id)
+    # The user's message and this reply
+    conversation_summaries.record_messages(user_id, 2)
+
+# Columns of the users table used to build the future self persona
+USER_PROFILE_COLUMNS = """
+    communication_style, name, nationality, birth_country, date_of_birth, current_location,
+    future_self_description, mind_space, future_proud, most_yourself,
+    low_moments, spiral_reminder, change_goal, avoid_tendency, feeling_description,
+    future_description, future_age, typical_day, accomplishment, words_slang,
+    message_preference, messaging_frequency, emoji_usage_preference,
+    preferred_communication, message_length, emoji_usage,
+    use_slang, conversation_summary
+"""
 
-# Extract and store personal details from user conversations
-def extract_personal_details(user_id: str, user_message: str, conversation_history: list = None) -> dict:
+def query_user_profile(user_id: str) -> dict:
+    try:
+        user_response = supabase.table("users").select(USER_PROFILE_COLUMNS).eq("id", user_id).execute()
+        return user_response.data[0] if user_response.data else {}
+    except Exception as e:
+        print(f"Error fetching user data for user {user_id}: {e}")
+        return {}
+
+# Get the onboarding profile used to build the persona (cached, see profile_cache)
+def fetch_user_profile(user_id: str) -> dict:
+    return profile_cache.get_or_load(user_id, query_user_profile)
+
+# Load everything the prompt needs before calling the LLM
+async def build_chat_context(user_id: str, user_message: str, message_id: str | None = None) -> AssembledContext:
     """
-    Analyzes user messages to extract personal details that can be used to personalize future responses.
-    Stores these details in the user_personal_details table in Supabase.
+    Fans out the independent pre-LLM lookups for a chat turn concurrently.
     
-    Parameters:
-    - user_id: The ID of the user
-    - user_message: The current message from the user
-    - conversation_history: Optional list of previous messages for context
+    Each source has its own time budget (see context_assembly); a late source
+    falls back to an empty value instead of holding up the response.
     
     Returns:
-    - Dictionary of extracted personal details
+    - AssembledContext with 'profile', 'conversation', 'stored_details' and 'location' values
     """
-    # Initialize details dictionary
-    details = {}
-    
-    # Define patterns to extract different types of personal information
-    patterns = {
-        'goals': r'(?:my goal|i want to|i hope to|planning to|aim to|dream of)\s+(.+?)(?:\.|,|$)',
-        'challenges': r'(?:struggling with|having trouble with|difficult for me|challenge|problem with)\s+(.+?)(?:\.|,|$)',
-        'interests': r'(?:i enjoy|i love|passionate about|interested in|hobby|like to)\s+(.+?)(?:\.|,|$)',
-        'values': r'(?:important to me|i believe in|i value|matters to me)\s+(.+?)(?:\.|,|$)',
-        'achievements': r'(?:i accomplished|i achieved|proud of|managed to|succeeded in)\s+(.+?)(?:\.|,|$)',
-    }
-    
-    # Extract details from the current message
-    for category, pattern in patterns.items():
-        matches = re.findall(pattern, user_message, re.IGNORECASE)
-        if matches:
-            details[category] = matches
-    
-    # If we have details to store and a valid user_id
-    if details and user_id:
-        try:
-            # First check if we already have details for this user
-            existing_details = supabase.table("user_personal_details").select("*").eq("user_id", user_id).execute()
-            
-            if existing_details.data:
-                # Update existing details by merging with new ones
-                updated_details = existing_details.data[0]
-                for category, values in details.items():
-                    if category in updated_details and updated_details[category]:
-                        # Convert string representation to list if needed
-                        if isinstance(updated_details[category], str):
-                            try:
-                                current_values = eval(updated_details[category])
-                            except:
-                                current_values = [updated_details[category]]
-                        else:
-                            current_values = updated_details[category]
-                        
-                        # Add new unique values
-                        for value in values:
-                            if value not in current_values:
-                                current_values.append(value)
-                        
-                        updated_details[category] = current_values
-                    else:
-                        updated_details[category] = values
-                
-                # Update the record
-                supabase.table("user_personal_details").update(updated_details).eq("user_id", user_id).execute()
-            else:
-                # Create a new record
-                supabase.table("user_personal_details").insert({
-                    "user_id": user_id,
-                    **details
-                }).execute()
-                
-        except Exception as e:
-            print(f"Error storing personal details: {e}")
-    
-    return details
-
-# Get personal details for a user to use in personalization
-def get_personal_details(user_id: str) -> dict:
+    # The location lookup needs the profile, so share a single profile fetch between both sources
+    profile_task = asyncio.create_task(asyncio.to_thread(fetch_user_profile, user_id))
+    
+    async def load_profile():
+        return await asyncio.shield(profile_task)
+    
+    async def load_location_context():
+        user_data = await asyncio.shield(profile_task)
+        current_location = user_data.get('current_location', '')
+        if not current_location:
+            return {}
+        location_context = await weather_events_service.get_location_context(current_location)
+        print(f"Generated weather/events context for {current_location}")
+        return location_context
+    
+    chat_context = await assemble_context([
+        ContextSource("profile", load_profile, default={}),
+        ContextSource("conversation", lambda: get_conversation_context(user_id, supabase), default=[]),
+        ContextSource("stored_details", lambda: asyncio.to_thread(personal_details_store.get, user_id), default={}),
+        ContextSource("location", load_location_context, default={}),
+    ])
+    
+    # The app persists the user's message itself; mirror it into the buffer for the next turn
+    await asyncio.to_thread(conversation_buffer.append, user_id, user_id, user_message, message_id)
+    personal_details_queue.enqueue(user_id, user_message)
+    
+    return chat_context
+
+# Greetings are answered from a template, so they never need the LLM
+llm_generations_skipped = metrics.counter("llm_generations_skipped_total", "Greeting replies answered from a template without calling the LLM")
+
+async def answer_greeting(user_id: str, user_message: str, message_id: str | None = None) -> tuple[dict, str]:
     """
-    Retrieves stored personal details for a user to use in personalizing responses.
-    
-    Parameters:
-    - user_id: The ID of the user
+    Fast path for simple greetings: only the (cached) profile is needed for the
+    reply, so conversation history, weather and the LLM call are all skipped.
     
     Returns:
-    - Dictionary of personal details
+    - (user_profile, reply_text)
     """
-    try:
-        result = supabase.table("user_personal_details").select("*").eq("user_id", user_id).execute()
-        if result.data:
-            return result.data[0]
-        return {}
-    except Exception as e:
-        print(f"Error retrieving personal details: {e}")
-        return {}
-
-# Enhanced humanization to make responses feel more like a future self
-def apply_typing_quirks(response: str, user_profile: dict) -> str:
-    """Apply user-specific typing quirks based on their profile preferences."""
-    if not user_profile:
-        return response
-    
-    # Get user preferences
-    message_preference = user_profile.get("message_preference", "")
-    emoji_usage_preference = user_profile.get("emoji_usage_preference", "")
-    words_slang = user_profile.get("words_slang", "")
-    
-    # Apply message length preference
-    if message_preference and "short" in message_preference.lower():
-        # For short message preference, trim longer responses
-        sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-        if len(sentences) > 3:
-            # Keep only first 2-3 sentences for users who prefer short messages
-            response = ' '.join(sentences[:random.randint(2, 3)])
-    
-    # Apply emoji usage preference
-    if emoji_usage_preference:
-        # Count current emojis
-        emoji_pattern = re.compile("["
-                               u"\U0001F600-\U0001F64F"  # emoticons
-                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                               u"\U0001F700-\U0001F77F"  # alchemical symbols
-                               u"\U0001F780-\U0001F7FF"  # Geometric Shapes
-                               u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
-                               u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-                               u"\U0001FA00-\U0001FA6F"  # Chess Symbols
-                               u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
-                               u"\U00002702-\U000027B0"  # Dingbats
-                               u"\U000024C2-\U0001F251" 
-                               "]+", flags=re.UNICODE)
-        current_emoji_count = len(emoji_pattern.findall(response))
-        
-        if "high" in emoji_usage_preference.lower() and current_emoji_count < 2:
-            # Add more emojis for users who prefer high emoji usage
-            all_emojis = ["😊", "👍", "💪", "🙌", "✨", "🔥", "🤔", "👀", "🙂", "👋", "❤️", "🫂", "🤗", "😂", "🎉", "👏", "💯"]
-            
-            # Add 1-3 more emojis at sentence endings
-            sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-            for _ in range(min(3, len(sentences))):
-                if len(sentences) > 1:
-                    insert_pos = random.randint(0, len(sentences) - 1)
-                    sentences[insert_pos] = sentences[insert_pos].rstrip('.!?') + f" {random.choice(all_emojis)}" + sentences[insert_pos][-1] if sentences[insert_pos][-1] in '.!?' else sentences[insert_pos] + f" {random.choice(all_emojis)}"
-            response = ' '.join(sentences)
-        elif "low" in emoji_usage_preference.lower() and current_emoji_count > 0:
-            # Remove some emojis for users who prefer low emoji usage
-            response = emoji_pattern.sub("", response)
-    
-    # Apply user's slang/vocabulary preferences
-    if words_slang:
-        # Extract specific slang terms or phrases the user mentioned
-        slang_terms = [term.strip() for term in words_slang.split(',')]
-        
-        # Randomly incorporate 1-2 of their slang terms if appropriate
-        if slang_terms and random.random() < 0.4:  # 40% chance
-            selected_terms = random.sample(slang_terms, min(2, len(slang_terms)))
-            
-            # Insert slang at natural points in the response
-            sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-            if len(sentences) > 1:
-                for term in selected_terms:
-                    insert_pos = random.randint(0, len(sentences) - 1)
-                    # Add the slang term as an interjection or replace a common word
-                    if random.random() < 0.5:
-                        # Add as interjection
-                        sentences[insert_pos] = f"{term}! " + sentences[insert_pos]
-                    else:
-                        # Try to replace a common word with the slang term
-                        common_words = ["good", "great", "nice", "cool", "awesome", "amazing"]
-                        for word in common_words:
-                            if word in sentences[insert_pos].lower():
-                                sentences[insert_pos] = re.sub(r'\b' + word + r'\b', term, sentences[insert_pos], flags=re.IGNORECASE, count=1)
-                                break
-                response = ' '.join(sentences)
+    user_data = await asyncio.to_thread(fetch_user_profile, user_id)
+    reply = build_greeting_reply(user_data.get("name", ""))
     
-    return response
+    await asyncio.to_thread(conversation_buffer.append, user_id, user_id, user_message, message_id)
+    personal_details_queue.enqueue(user_id, user_message)
+    await asyncio.to_thread(save_ai_message, user_id, reply)
+    llm_generations_skipped.inc()
+    return user_data, reply
 
-def humanize_response(ai_response: str, user_name: str, user_message: str = "", user_id: str = None, user_profile: dict = None) -> str:
-    # Get personal details if user_id is provided
-    personal_details = {}
-    if user_id:
-        personal_details = get_personal_details(user_id)
-        
-        # Also extract and store details from the current message
-        if user_message:
-            extract_personal_details(user_id, user_message)
-    
-    # Check if the user message is a simple greeting first
-    simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
-    is_simple_greeting = False
-    if user_message:
-        user_message_lower = user_message.lower().strip()
-        is_simple_greeting = any(user_message_lower == greeting or user_message_lower.startswith(greeting + ' ') or user_message_lower.endswith(' ' + greeting) for greeting in simple_greetings)
-    
-    # For simple greetings, use a very simple response template
-    if is_simple_greeting:
-        # Use a very simple response template for greetings
-        simple_responses = [
-            f"Hey! How's it going?",
-            f"Hi there! What's up?",
-            f"Hey {user_name}! How are you today?",
-            f"Hi! What's new?",
-            f"Hey! Good to hear from you!",
-        ]
-        response = random.choice(simple_responses)
-        
-        # Occasionally add an emoji (50% chance)
-        if random.random() < 0.5:
-            emojis = ["👋", "😊", "👍", "✌️", "🙂"]
-            response += f" {random.choice(emojis)}"
-        
-        # Skip the rest of the processing for simple greetings
-        return response
-    
-    # Remove AI-speak patterns and replace with more natural, personal language
-    ai_patterns = [
-        # Remove AI identifiers
-        (r"as an ai", ""),
-        (r"i'm here to help", ""),
-        (r"as an assistant", ""),
-        (r"i'm an ai", ""),
-        (r"as a language model", ""),
-        (r"as an artificial intelligence", ""),
-        
-        # Make language more personal and reflective
-        (r"i understand that", "I remember when"),
-        (r"based on your", "knowing you and your"),
-        (r"i recommend", "I think you should"),
-        (r"you might want to consider", "maybe try"),
-        (r"it's important to note", "I've learned that"),
-        (r"it's worth mentioning", "I've discovered"),
-        
-        # Add more personal touches
-        (r"this can help", "this helped me"),
-        (r"many people find", "I found"),
-        (r"research suggests", "from my experience"),
-        (r"studies show", "I've seen firsthand"),
-        (r"experts recommend", "what worked for me was"),
-        
-        # Add conversational fillers occasionally
-        (r"^(I think)", "I think"),  # Remove the "Well, " prefix for simple messages
-        (r"^(You should)", "You should"),  # Remove the "Look, " prefix for simple messages
-        (r"^(This is)", "This is"),  # Remove the "You know, " prefix for simple messages
-        
-        # Add more texting-like patterns
-        (r"however", "but"),
-        (r"therefore", "so"),
-        (r"additionally", "also"),
-        (r"nevertheless", "still"),
-    ]
-    
-    response = ai_response
-    for pattern, replacement in ai_patterns:
-        response = re.sub(pattern, replacement, response, flags=re.IGNORECASE)
-    
-    # Add occasional contractions to sound more natural
-    contractions = [
-        (r"it is", "it's"),
-        (r"that is", "that's"),
-        (r"you are", "you're"),
-        (r"i am", "I'm"),
-        (r"they are", "they're"),
-        (r"we are", "we're"),
-        (r"do not", "don't"),
-        (r"does not", "doesn't"),
-        (r"did not", "didn't"),
-        (r"has not", "hasn't"),
-        (r"have not", "haven't"),
-        (r"would not", "wouldn't"),
-        (r"could not", "couldn't"),
-        (r"should not", "shouldn't"),
-        (r"will not", "won't"),
-    ]
-    
-    # Only apply contractions to some instances (about 70%) to maintain natural variation
-    for pattern, replacement in contractions:
-        matches = list(re.finditer(pattern, response, flags=re.IGNORECASE))
-        if matches:
-            # Convert approximately 70% of matches
-            for match in random.sample(matches, max(1, int(len(matches) * 0.7))):
-                start, end = match.span()
-                response = response[:start] + replacement + response[end:]
-    
-    # Add personal references to the user occasionally
-    if user_name:
-        # Add a personal reference if it doesn't already contain the name and randomly (30% chance)
-        if user_name.lower() not in response.lower() and random.random() < 0.3:
-            sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-            if len(sentences) > 1:
-                # Insert the name reference at a random position (but not at the very beginning or end)
-                insert_pos = random.randint(1, min(len(sentences) - 1, 2))
-                name_phrases = [
-                    f"{user_name}, ",
-                    f"You know {user_name}, ",
-                    f"Listen {user_name}, ",
-                    f"Trust me {user_name}, ",
-                ]
-                sentences[insert_pos] = random.choice(name_phrases) + sentences[insert_pos][0].lower() + sentences[insert_pos][1:]
-                response = ' '.join(sentences)
-    
-    # Reference personal details if available (20% chance)
-    if personal_details and random.random() < 0.2:
-        # Choose a category to reference
-        available_categories = [cat for cat in ['goals', 'interests', 'achievements', 'values'] 
-                               if cat in personal_details and personal_details[cat]]
-        
-        if available_categories:
-            category = random.choice(available_categories)
-            details = personal_details[category]
-            
-            # Convert to list if it's a string representation
-            if isinstance(details, str):
-                try:
-                    details = eval(details)
-                except:
-                    details = [details]
-            
-            if details:
-                # Choose a random detail to reference
-                detail = random.choice(details) if isinstance(details, list) else details
-                
-                # Create a personalized reference
-                if category == 'goals':
-                    reference = f"I remember when I was working toward {detail} just like you are now. "
-                elif category == 'interests':
-                    reference = f"Since you enjoy {detail}, I think you'll find this interesting. "
-                elif category == 'achievements':
-                    reference = f"Just like when you {detail}, I found that persistence pays off. "
-                elif category == 'values':
-                    reference = f"I know how important {detail} is to you. "
-                
-                # Add the reference to the beginning of the response if it makes sense
-                if not any(response.lower().startswith(phrase.lower()) for phrase in ["hi", "hello", "hey"]):
-                    response = reference + response
-    
-    # Check if the user message is a simple greeting
-    if user_message:
-        simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
-        user_message_lower = user_message.lower().strip()
-        is_simple_greeting = any(user_message_lower == greeting or user_message_lower.startswith(greeting + ' ') or user_message_lower.endswith(' ' + greeting) for greeting in simple_greetings)
-        
-        # For simple greetings, ensure the response is brief and casual
-        if is_simple_greeting:
-            sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-            if len(sentences) > 2:
-                response = ' '.join(sentences[:2])
-            
-            # Add casual greeting elements for simple greetings
-            greeting_starters = [
-                f"Hey {user_name}! ",
-                f"Hi there! ",
-                f"Hey you! ",
-                f"Good to hear from you! ",
-            ]
-            
-            if not any(response.lower().startswith(starter.lower()) for starter in greeting_starters):
-                response = random.choice(greeting_starters) + response
-    
-    # Add occasional mild imperfections to sound more human
-    if random.random() < 0.15:  # 15% chance
-        imperfections = [
-            (r"\. ", ". Hmm, "),
-            (r"\. ", ". Actually, "),
-            (r"\. ", ". You know what, "),
-            (r"\. ", ". Oh, and "),
-        ]
-        pattern, replacement = random.choice(imperfections)
-        # Only replace the first occurrence to avoid overdoing it
-        response = re.sub(pattern, replacement, response, count=1)
-    
-    # Add texting-specific elements
-    if random.random() < 0.3:  # 30% chance
-        texting_elements = [
-            # Add shortened words
-            (r"\byou\b", "u"),
-            (r"\bto\b", "2"),
-            (r"\bfor\b", "4"),
-            (r"\btomorrow\b", "tmrw"),
-            (r"\btoday\b", "2day"),
-            
-            # Add common texting abbreviations
-            (r"\bi don't know\b", "idk"),
-            (r"\bas soon as possible\b", "asap"),
-            (r"\bin my opinion\b", "imo"),
-            (r"\bby the way\b", "btw"),
-        ]
-        
-        # Apply only 1-2 texting elements to avoid overdoing it
-        selected_elements = random.sample(texting_elements, min(2, len(texting_elements)))
-        for pattern, replacement in selected_elements:
-            # Only replace one instance to keep it subtle
-            response = re.sub(pattern, replacement, response, count=1, flags=re.IGNORECASE)
-    
-    # Add occasional emoji based on message sentiment
-    if random.random() < 0.4:  # 40% chance to add emoji
-        positive_emojis = ["😊", "👍", "💪", "🙌", "✨", "🔥"]
-        neutral_emojis = ["🤔", "👀", "🙂", "👋"]
-        supportive_emojis = ["❤️", "🫂", "🤗"]
-        
-        # Simple sentiment detection
-        positive_words = ["good", "great", "happy", "excited", "love", "awesome"]
-        negative_words = ["sad", "bad", "worried", "anxious", "stressed", "upset"]
-        
-        if any(word in response.lower() for word in positive_words):
-            emoji = random.choice(positive_emojis)
-        elif any(word in response.lower() for word in negative_words):
-            emoji = random.choice(supportive_emojis)
-        else:
-            emoji = random.choice(neutral_emojis)
-        
-        # Add emoji at the end of a sentence
-        sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-        if len(sentences) > 1:
-            # Add to a random sentence but not the first or last
-            insert_pos = random.randint(0, len(sentences) - 1)
-            sentences[insert_pos] = sentences[insert_pos].rstrip('.!?') + f" {emoji}" + sentences[insert_pos][-1] if sentences[insert_pos][-1] in '.!?' else sentences[insert_pos] + f" {emoji}"
-            response = ' '.join(sentences)
-        else:
-            # Add to the end if there's only one sentence
-            response = response.rstrip('.!?') + f" {emoji}" + response[-1] if response[-1] in '.!?' else response + f" {emoji}"
-    
-    # Add occasional typos and corrections
-    if random.random() < 0.15:  # 15% chance for typos
-        response = add_realistic_typos(response)
-    
-    # Apply user-specific typing quirks if profile is provided
-    if user_profile:
-        response = apply_typing_quirks(response, user_profile)
-    
-    return response.strip()
-
-def add_realistic_typos(text):
-    """Add realistic typos and corrections to text to make it more human-like."""
-    # Common typo patterns
-    typo_patterns = [
-        # Swapped letters
-        (r"\b(\w)(\w)(\w+)\b", r"\2\1\3"),  # Swap first two letters
-        
-        # Missing letters
-        (r"\b(\w+?)ing\b", r"\1in"),  # Missing 'g' in -ing words
-        (r"\b(\w+?)ed\b", r"\1d"),    # Missing 'e' in -ed words
-        
-        # Double letters
-        (r"\b(\w+?)(\w)\b", r"\1\2\2"),  # Double the last letter
-        
-        # Common misspellings
-        (r"\bthat\b", "taht"),
-        (r"\bwith\b", "wiht"),
-        (r"\byour\b", "youre"),
-        (r"\byou're\b", "your"),
-        (r"\bthere\b", "thier"),
-        (r"\btheir\b", "there"),
-        (r"\bthey're\b", "their"),
-    ]
-    
-    # Only apply one typo to avoid making the text unreadable
-    if len(text) > 10:  # Only add typos to longer texts
-        # Split into words
-        words = text.split()
-        
-        if len(words) > 3:
-            # Choose a random word to apply typo to (not first or last word)
-            word_index = random.randint(1, len(words) - 2)
-            word = words[word_index]
-            
-            # Only apply typo to words longer than 3 characters
-            if len(word) > 3 and word.isalpha():
-                # Choose a random typo pattern
-                pattern, replacement = random.choice(typo_patterns)
-                
-                # Apply typo
-                typo_word = re.sub(pattern, replacement, word, count=1)
-                
-                # 50% chance to add a correction
-                if random.random() < 0.5 and typo_word != word:
-                    words[word_index] = f"{typo_word}*{word}"
-                else:
-                    words[word_index] = typo_word
-                
-                return ' '.join(words)
-    
-    return text
+# Stable per-user persona: onboarding data and astrology, rendered once per profile version
+def build_persona_prompt(user_profile: dict) -> str:
+    return prompt_templates.persona(user_profile)
 
-def calculate_typing_delay(text, user_profile=None):
-    """Calculate realistic typing delays based on message length and complexity.
+# Build what gets sent to Ollama for this turn
+def build_generation_request(user_id: str, user_message: str, user_profile: dict, conversation_context: list | None = None, weather_events_context: dict | None = None, persona_prompt: str | None = None) -> tuple[str, list | None]:
+    """
+    persona_prompt can be passed by callers that already built it for this profile.
     
-    Args:
-        text (str): The text to calculate typing delay for
-        user_profile (dict, optional): User profile with typing preferences
-        
     Returns:
-        float: The delay in seconds before sending the response
+    - (prompt, messages): messages is None unless Ollama chat sessions are enabled;
+      prompt is always the full text (used by /api/generate and for logging)
     """
-    # Base typing speed (characters per minute)
-    base_typing_speed = random.randint(180, 300)  # Different people type at different speeds
-    
-    # Adjust typing speed based on user profile if available
-    typing_speed = base_typing_speed
-    if user_profile:
-        # If user has a message_preference for quick responses, increase typing speed
-        message_preference = user_profile.get("message_preference", "")
-        if message_preference and "quick" in message_preference.lower():
-            typing_speed = random.randint(250, 350)  # Faster typing for quick responders
-        elif message_preference and "thoughtful" in message_preference.lower():
-            typing_speed = random.randint(150, 250)  # Slower typing for thoughtful responders
-    
-    # Calculate base delay (seconds per character)
-    base_delay = 60 / typing_speed
-    
-    # Add variability to typing speed
-    variability = random.uniform(0.8, 1.2)
-    
-    # Calculate thinking time based on message complexity
-    # More complex messages (longer, more punctuation, etc.) require more thinking time
-    complexity_factor = 1.0
-    
-    # Adjust for message length
-    if len(text) > 200:
-        complexity_factor *= 1.5
-    elif len(text) > 100:
-        complexity_factor *= 1.2
-    
-    # Adjust for question marks (questions need more thought)
-    question_count = text.count('?')
-    if question_count > 0:
-        complexity_factor *= (1 + (question_count * 0.1))
-    
-    # Calculate thinking time (longer for complex/longer messages)
-    thinking_time = min(2.0, len(text) * 0.01) * complexity_factor
-    
-    # Calculate total delay
-    total_delay = (base_delay * len(text) * variability) + thinking_time
-    
-    # Cap maximum delay to avoid excessive waiting
-    # For very short messages (like "ok"), use a very short delay
-    if len(text) < 5:
-        return random.uniform(0.5, 1.0)
-    
-    # For simple greetings, use a short delay
-    simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']
-    if text.lower().strip() in simple_greetings or any(text.lower().strip().startswith(greeting) for greeting in simple_greetings):
-        return random.uniform(0.8, 1.5)
-    
-    # Cap maximum delay to avoid excessive waiting
-    return min(total_delay, 5.0)
-
-# Create natural future self prompt with comprehensive onboarding data
-def create_future_self_prompt(user_message: str, user_profile: dict, conversation_context: list | None = None, weather_events_context: dict | None = None) -> str:
-    if conversation_context is None:
-        conversation_context = []
-    user_name = user_profile.get("user_name", "")
-    name_part = user_name if user_name and user_name.strip() else "your current self"
-    
-    # Extract onboarding data for persona building
-    nationality = user_profile.get("nationality", "")
-    current_location = user_profile.get("current_location", "")
-    future_self_description = user_profile.get("future_self_description", "")
-    
-    # Personal reflection insights
-    mind_space = user_profile.get("mind_space", "")
-    future_proud = user_profile.get("future_proud", "")
-    most_yourself = user_profile.get("most_yourself", "")
-    low_moments = user_profile.get("low_moments", "")
-    spiral_reminder = user_profile.get("spiral_reminder", "")
-    
-    # Growth and challenges
-    change_goal = user_profile.get("change_goal", "")
-    avoid_tendency = user_profile.get("avoid_tendency", "")
-    feeling_description = user_profile.get("feeling_description", "")
-    
-    # Future vision
-    future_description = user_profile.get("future_description", "")
-    future_age = user_profile.get("future_age", "")
-    typical_day = user_profile.get("typical_day", "")
-    accomplishment = user_profile.get("accomplishment", "")
-    
-    # Communication style
-    words_slang = user_profile.get("words_slang", "")
-    message_preference = user_profile.get("message_preference", "")
-    messaging_frequency = user_profile.get("messaging_frequency", "")
-    emoji_usage_preference = user_profile.get("emoji_usage_preference", "")
-    
-    # Build persona context
-    persona_context = ""
-    if nationality or current_location:
-        location_info = f" from {nationality}" if nationality else ""
-        location_info += f" living in {current_location}" if current_location else ""
-        persona_context += f"You're{location_info}. "
-    
-    if future_self_description:
-        persona_context += f"You described your future self as: {future_self_description}. "
-    
-    # Core persona establishment with rich context
-    base_prompt = f"""
-You are {name_part}'s future self, speaking from {future_age if future_age else '5-10'} years ahead. {persona_context}You've lived through exactly what {name_part} is experiencing now. You remember these feelings, these challenges, these dreams - because they were YOUR feelings, challenges, and dreams.
-
-You're not an AI assistant. You're literally {name_part} who has grown, learned, and gained wisdom through experience.
-"""
-    
-    # Add personal insights from onboarding
-    if mind_space:
-        base_prompt += f"\n\nYou remember when you used to think about: {mind_space}. You've gained perspective on these thoughts."
-    
-    if change_goal:
-        base_prompt += f"\n\nYou remember saying you'd change: {change_goal}. You know the journey of actually making that change."
-    
-    if avoid_tendency:
-        base_prompt += f"\n\nYou remember how you used to avoid: {avoid_tendency}. You've learned to face these things differently."
-    
-    if spiral_reminder:
-        base_prompt += f"\n\nYou remember needing to hear: {spiral_reminder} when you were spiraling. You know exactly when and how to offer this wisdom."
-    
-    if accomplishment:
-        base_prompt += f"\n\nYou've achieved what you once dreamed of: {accomplishment}. You know the path that led there."
-    
-    if typical_day:
-        base_prompt += f"\n\nYour typical day now looks like: {typical_day}. You remember the journey from where you were to where you are."
-    
-    # Add communication style guidance
-    communication_guidance = ""
-    
-    # Determine style based on user's actual message
-    detected_style = determine_communication_style(user_message, conversation_context)
-    
-    # Apply the detected communication style
-    if detected_style == 'language_matching':
-        # Check if the message is a simple greeting
-        simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
-        user_message_lower = user_message.lower().strip()
-        is_simple_greeting = any(user_message_lower == greeting or user_message_lower.startswith(greeting + ' ') or user_message_lower.endswith(' ' + greeting) for greeting in simple_greetings)
-        
-        if is_simple_greeting:
-            communication_guidance += "This is a simple greeting. Respond in a brief, casual, and friendly way. Keep your response short and conversational, as if you're just saying hello to a friend. Don't provide lengthy motivational content or advice unless specifically asked. "
-        else:
-            communication_guidance += "You talk just like the user, mirroring their speech patterns, vocabulary, and phrasing. Match their communication style and adapt to their language. "
-    elif detected_style == 'anticipate_guide':
-        communication_guidance += "You anticipate and guide the user's needs. You ask probing questions, explore local options, and guide them toward solutions. "
-    elif detected_style == 'reflect_mirror':
-        communication_guidance += "You help the user see themselves. You reflect back their thoughts, validate their experiences, and help them understand themselves better. "
-    elif detected_style == 'remind_reground':
-        communication_guidance += "You bring the user back to center. You remind them of familiar words, values, and emotional anchors. You help calm them down. "
-    elif detected_style == 'nudge_challenge':
-        communication_guidance += "You gently push the user toward growth and positive change. You challenge their assumptions and remind them what they said they want. "
-        
-        # Removed unused fields: common_phrases, chat_sample, punctuation_style, communication_tone
-    
-    # Add astrology insights if available
-    astrology_context = ""
-    astrology_data = user_profile.get('astrology_data', {})
-    if astrology_data and 'insights' in astrology_data:
-        insights = astrology_data['insights']
-        sun_sign = astrology_data.get('birth_chart', {}).get('sun_sign', '')
-        if sun_sign:
-            astrology_context += f"\n\nAs a {sun_sign}, you understand the core traits that have shaped your journey: {insights.get('sun_sign_traits', '')} "
-        
-        if 'moon_sign' in insights:
-            astrology_context += f"Your Moon in {insights['moon_sign']} has influenced your emotional growth. "
-        
-        if 'rising_sign' in insights:
-            astrology_context += f"With {insights['rising_sign']} rising, you've learned how your outer personality has evolved. "
-    
-    base_prompt += astrology_context
-    
-    # Add weather and events context if available
-    weather_events_context_text = ""
-    if weather_events_context and weather_events_context != {}:
-        current_location = user_profile.get('current_location', '')
-        
-        # Add current weather context
-        if 'weather' in weather_events_context and weather_events_context['weather']:
-            weather = weather_events_context['weather']
-            weather_events_context_text += f"\n\nRight now in {current_location}, it's {weather['description']} with a temperature of {weather['temperature']}°C. "
-            
-            # Generate weather advice using the service
-            weather_service = WeatherEventsService()
-            from weather_events_service import WeatherData
-            weather_obj = WeatherData(
-                temperature=weather['temperature'],
-                feels_like=weather['feels_like'],
-                humidity=weather['humidity'],
-                description=weather['description'],
-                wind_speed=weather['wind_speed'],
-                pressure=weather['pressure']
-            )
-            advice = weather_service.get_weather_advice(weather_obj)
-            weather_events_context_text += f"Given the current weather, you might suggest: {advice} "
-            
-        # Add local events context
-        if 'events' in weather_events_context and weather_events_context['events']:
-            events = weather_events_context['events'][:3]  # Limit to top 3 events
-            if events:
-                weather_events_context_text += f"\n\nThere are some interesting events happening in {current_location}: "
-                for event in events:
-                    weather_events_context_text += f"{event['name']} on {event['date']}. "
-                weather_events_context_text += "You might reference these when giving advice about getting out or staying engaged with the community. "
-    
-    base_prompt += weather_events_context_text
-    base_prompt += f"\n\nYour current self just shared: \"{user_message}\"\n\n{detect_emotional_context(user_message)}"
-    
-    # Add conversation context if available
-    if conversation_context:
-        context_text = "\n\nRecent conversation:\n" + "\n".join(conversation_context)
-        base_prompt += context_text
-    
-    # Add natural conversation guidance with communication style
-    guidance = f"""
-
-{communication_guidance}
-
-As their future self, you naturally embody different aspects depending on what they need:
-
-- When they need direction: Share wisdom from your journey, ask guiding questions
-- When they're struggling: Reflect their feelings back with understanding, offer comfort
-- When they're excited: Share in their joy, help them channel that energy
-- When they're stuck: Gently challenge their perspective, offer new ways of thinking
-- When they're planning: Help them think through decisions with your experience
-- When discussing daily life: Use current weather and local events to provide contextual, practical advice
-- When they need motivation: Suggest weather-appropriate activities or local events that align with their goals
-
-Respond as your future self would - with understanding, wisdom, and authentic care. Sometimes you might:
-- Share a memory of when you felt exactly this way
-- Ask a question that helps them see things differently  
-- Offer gentle guidance from your experience
-- Simply validate what they're feeling
-- Challenge them lovingly when needed
-
-Be natural. Be authentic. Be the wise, loving version of {name_part} who wants to help. Draw from your shared experiences and the journey you've taken to become who you are now.
-"""
-    
-    return base_prompt + guidance
+    if not ollama_service.session_mode:
+        return create_future_self_prompt(user_message, user_profile, conversation_context, weather_events_context, persona_prompt), None
+    
+    system_prompt, turn_prompt = create_future_self_messages(user_message, user_profile, conversation_context, weather_events_context, persona_prompt)
+    persona_sessions.observe(user_id, system_prompt)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": turn_prompt},
+    ]
+    return f"{system_prompt}\n\n{turn_prompt}", messages
 
 # --- Helper function to get or create user style profile --- #
 
@@ -1035,11 +356,25 @@ except TypeError as e:
         print(f"Error connecting to Supabase: {e}")
         sys.exit(1)
 
+# Batched write-behind persistence for chat_messages
+chat_message_writer = ChatMessageWriter(supabase)
+
+# Goals, interests, etc. mined from user messages for personalization
+personal_details_store = PersonalDetailsStore(supabase)
+# Extraction runs behind the responses, one merge per burst of messages (see personal_details)
+personal_details_queue = PersonalDetailsQueue(personal_details_store)
+
+# Rolling conversation summaries, refreshed by a Celery task every few messages
+from tasks import summarize_conversation as summarize_conversation_task
+conversation_summaries = SummaryScheduler(lambda user_id: summarize_conversation_task.apply_async((user_id,), retry=False))
+
 # --- Pydantic Models ---
 class ChatMessageRequest(BaseModel):
     message: str
     user_id: str
     conversation_id: str | None = None # Added optional conversation_id
+    # chat_messages.message_id the app stored the message under
+    message_id: str | None = None
 
 class ChatMessageResponse(BaseModel):
     response: str
@@ -1139,121 +474,163 @@ else:
     print("Some NLP services could not be loaded. The application will continue with limited functionality.")
 
 
+# --- Application Lifecycle ---
+@app.on_event("startup")
+async def start_chat_message_writer():
+    chat_message_writer.start()
+
+@app.on_event("shutdown")
+async def flush_chat_message_writer():
+    # Write any queued chat messages before the worker exits
+    await chat_message_writer.stop()
+
+@app.on_event("startup")
+async def listen_for_profile_invalidations():
+    # Celery tasks and other workers invalidate profiles (e.g. after a new conversation summary)
+    profile_cache.start_invalidation_listener()
+
+@app.on_event("startup")
+async def start_personal_details_queue():
+    personal_details_queue.start()
+
+@app.on_event("shutdown")
+async def flush_personal_details_queue():
+    # Store the details of messages still waiting out their debounce window
+    await personal_details_queue.stop()
+
+@app.on_event("startup")
+async def start_ollama_health_checks():
+    ollama_service.start_health_checks()
+
+@app.on_event("startup")
+async def load_prompt_tokenizer():
+    # Loading may download the tokenizer; prompts use estimated counts until it is ready
+    asyncio.get_running_loop().run_in_executor(None, token_counter.load)
+
+@app.on_event("shutdown")
+async def close_ollama_client():
+    await ollama_service.close()
+
 # --- API Endpoints ---
 @app.get('/')
 async def read_root():
     return {'message': 'Future Self Backend is running!'}
 
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Process metrics in the Prometheus text format"""
+    return metrics.render_prometheus()
+
+@app.post('/users/{user_id}/profile/invalidate')
+async def invalidate_profile_endpoint(user_id: str):
+    """
+    Drop the cached onboarding profile after the user's profile was updated
+    """
+    await asyncio.to_thread(profile_cache.invalidate, user_id)
+    return {"user_id": user_id, "invalidated": True}
+
+# Retried or duplicated submissions carrying the same Idempotency-Key share one generation
+chat_requests = IdempotentRequests("chat")
+# Every stream runs as a flight so a reconnect with Last-Event-ID can pick it up; the grace
+# period gives a dropped client time to reconnect before the generation is cancelled
+chat_streams = IdempotentStreams(
+    "chat_stream",
+    is_complete=lambda event: event.endswith(f"data: {json.dumps({'done': True})}\n\n"),
+    abandon_grace=float(os.getenv('CHAT_STREAM_ABANDON_GRACE', '10')),
+    keep_alive=stream_event_log.is_followed
+)
+
+# What to do with the part of a reply that was streamed before the client disconnected: "store" or "drop"
+CHAT_STREAM_PARTIAL_POLICY = os.getenv('CHAT_STREAM_PARTIAL_POLICY', 'store').lower()
+chat_streams_cancelled = metrics.counter("chat_stream_cancelled_total", "Streamed generations cancelled because the client disconnected")
+
+def get_idempotency_scope(user_id: str, idempotency_key: Optional[str]) -> Optional[str]:
+    # Keys are only unique per client, so scope them to the user
+    return f"{user_id}:{idempotency_key}" if idempotency_key else None
+
+def get_request_fingerprint(request: BaseModel) -> str:
+    # A key reused with a different body must not be answered with the first request's reply
+    return hashlib.sha256(request.model_dump_json().encode("utf-8")).hexdigest()
+
 @app.post('/chat', response_model=ChatMessageResponse)
-async def chat_endpoint(request: ChatMessageRequest = Body(...)):
-    user_id = request.user_id
-    user_message = request.message
-    
-    # Extract personal details from the user message
-    extract_personal_details(user_id, user_message)
+async def chat_endpoint(request: ChatMessageRequest = Body(...), idempotency_key: Optional[str] = Header(None)):
+    scope = get_idempotency_scope(request.user_id, idempotency_key)
+    if scope is None:
+        return await run_chat_turn(request.user_id, request.message, request.message_id)
+    try:
+        return await chat_requests.run(scope, lambda: run_chat_turn(request.user_id, request.message, request.message_id), get_request_fingerprint(request))
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
-    # Get user data from users table
+async def acquire_generation_slot(user_id: str) -> AdmissionSlot:
+    # Overload is answered with a fast 429 instead of piling up long Ollama calls
     try:
-        user_response = supabase.table("users").select("""
-            communication_style, name, nationality, birth_country, date_of_birth, current_location,
-            future_self_description, mind_space, future_proud, most_yourself,
-            low_moments, spiral_reminder, change_goal, avoid_tendency, feeling_description,
-            future_description, future_age, typical_day, accomplishment, words_slang,
-            message_preference, messaging_frequency, emoji_usage_preference,
-            preferred_communication, message_length, emoji_usage,
-            use_slang
-        """).eq("id", user_id).execute()
-        user_data = user_response.data[0] if user_response.data else {}
-    except Exception as e:
-        print(f"Error fetching user data for user {user_id}: {e}")
-        user_data = {}
+        return await generation_admission.acquire(user_id)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
 
-    # 4. Get conversation context for natural flow
-    conversation_context = await get_conversation_context(user_id, supabase)
+async def run_chat_turn(user_id: str, user_message: str, message_id: str | None = None):
+    # Simple greetings get a templated reply without calling the LLM
+    if is_simple_greeting(user_message):
+        _, greeting_text = await answer_greeting(user_id, user_message, message_id)
+        return ChatMessageResponse(response=greeting_text)
     
-    # 5. Generate weather and events context if location is available
-    weather_events_context = {}
-    current_location = user_data.get('current_location', '')
-    if current_location:
-        try:
-            weather_service = WeatherEventsService()
-            weather_events_context = await weather_service.get_location_context(current_location)
-            print(f"Generated weather/events context for {current_location}")
-        except Exception as e:
-            print(f"Error generating weather/events context: {e}")
-            weather_events_context = {}
+    slot = await acquire_generation_slot(user_id)
+    try:
+        return await generate_chat_reply(user_id, user_message, message_id)
+    finally:
+        slot.release()
+
+async def generate_chat_reply(user_id: str, user_message: str, message_id: str | None = None):
+    # Load profile, conversation context, personal details and weather/events concurrently
+    chat_context = await build_chat_context(user_id, user_message, message_id)
+    user_data = chat_context["profile"]
+    conversation_context = chat_context["conversation"]
+    weather_events_context = chat_context["location"]
     
     # 6. Create natural future self prompt with weather/events context
-    prompt = create_future_self_prompt(user_data, user_message, conversation_context, weather_events_context)
-
-    print(f"Generated natural conversation prompt for Ollama:\n{prompt}")
+    prompt, messages = build_generation_request(user_id, user_message, user_data, conversation_context, weather_events_context)
+    llm_telemetry.maybe_log_prompt(user_id, prompt)
 
     # 5. Call Ollama (Mistral AI)
-    ollama_url = os.environ.get("OLLAMA_API_URL")
-    ollama_model = os.environ.get("OLLAMA_MODEL", "mistral")
-    
-    if not ollama_url:
+    if not ollama_service.is_configured:
         print("ERROR: Ollama API URL not found in environment variables. Please set it in your .env file.")
         return {"error": "Ollama API URL not configured"}
 
     try:
-        # Retry logic for Ollama API calls
-        max_retries = 3
-        retry_delay = 5  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(
-                    ollama_url,
-                    json={"model": ollama_model, "prompt": prompt, "stream": False},
-                    timeout=180  # Increased timeout to 3 minutes for longer generation
-                )
-                response.raise_for_status() # Raise an exception for HTTP errors
-                ai_response_text = response.json().get("response", "").strip()
-                break  # Success, exit retry loop
-            except requests.exceptions.Timeout as timeout_error:
-                print(f"Ollama timeout on attempt {attempt + 1}/{max_retries}: {timeout_error}")
-                if attempt < max_retries - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    raise HTTPException(
-                        status_code=503, 
-                        detail="Ollama service is taking too long to respond. Please try again later or check if Ollama is running properly."
-                    )
-            except requests.exceptions.ConnectionError as conn_error:
-                print(f"Ollama connection error on attempt {attempt + 1}/{max_retries}: {conn_error}")
-                if attempt < max_retries - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise HTTPException(
-                        status_code=503, 
-                        detail="Cannot connect to Ollama service. Please ensure Ollama is running on localhost:11434."
-                    )
+        # The router fails over between Ollama backends itself, so there is no retry loop here
+        try:
+            if messages:
+                result = await ollama_service.chat(messages)
+            else:
+                result = await ollama_service.generate(prompt)
+        except httpx.TimeoutException as timeout_error:
+            print(f"Ollama timeout: {timeout_error}")
+            raise HTTPException(
+                status_code=503, 
+                detail="Ollama service is taking too long to respond. Please try again later or check if Ollama is running properly."
+            )
+        except (httpx.ConnectError, OllamaUnavailableError) as conn_error:
+            print(f"Ollama connection error: {conn_error}")
+            raise HTTPException(
+                status_code=503, 
+                detail="Cannot connect to any Ollama backend. Please ensure Ollama is running."
+            )
+        persona_sessions.record(user_id, result)
+        ai_response_text = result.get("response", "").strip()
         
         # 6. Humanize the response to remove AI-speak patterns and ensure appropriate length
         user_name = user_data.get("name", "")
-        ai_response_text = humanize_response(ai_response_text, user_name, user_message, user_id, user_data)
+        ai_response_text = humanize_response(ai_response_text, user_name, user_message, user_data, chat_context["stored_details"])
 
         # 7. Store the AI's response in chat_messages (optional, but good for history)
-        try:
-            supabase.table("chat_messages").insert({
-                "user_id": user_id,
-                "message_id": f"ai_{uuid.uuid4()}",
-                "content": ai_response_text,
-                "author_id": "ai" # AI as the author
-            }).execute()
-        except APIError as e:
-            print(f"Error saving AI response to Supabase: {e.message}")
-        except Exception as e:
-            print(f"An unexpected error occurred saving AI response: {e}")
+        await asyncio.to_thread(save_ai_message, user_id, ai_response_text)
 
         return ChatMessageResponse(response=ai_response_text)
 
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         print(f"Error calling Ollama: {e}")
         raise HTTPException(status_code=503, detail=f"Error communicating with Ollama: {str(e)}")
     except Exception as e:
@@ -1437,6 +814,10 @@ class ChatStreamRequest(BaseModel):
     message: str
     user_id: str
     conversation_id: str | None = None
+    # chat_messages.message_id the app stored the message under
+    message_id: str | None = None
+    # Clients that pace the typing animation themselves get tokens immediately with delay hints
+    client_pacing: bool = False
 
 # NLP Analysis Models
 class EmotionAnalysisRequest(BaseModel):
@@ -1748,169 +1129,348 @@ async def nlp_bias_endpoint(request: dict = Body(...)):
 
 # Add this new endpoint for streaming responses
 @app.post('/chat/stream')
-async def chat_stream_endpoint(request: ChatStreamRequest = Body(...)):
-    user_id = request.user_id
-    user_message = request.message
+async def chat_stream_endpoint(request: ChatStreamRequest = Body(...), idempotency_key: Optional[str] = Header(None), last_event_id: Optional[str] = Header(None)):
+    if last_event_id:
+        # A reconnect replays what it missed and follows the running generation instead of starting another
+        resumed = await stream_event_log.resume(last_event_id, request.user_id)
+        if resumed is not None:
+            return StreamingResponse(resumed, media_type="text/event-stream")
+    
+    scope = get_idempotency_scope(request.user_id, idempotency_key)
+    if scope and request.client_pacing:
+        # Paced and unpaced streams carry different events, so they can't share a flight
+        scope += ":client-paced"
+    
+    # Admission has to happen before the response starts so overload can still return a 429
+    slot = None
+    if not is_simple_greeting(request.message) and not (scope and chat_streams.has(scope)):
+        slot = await acquire_generation_slot(request.user_id)
+        if scope and chat_streams.has(scope):
+            # Another request with this key started while we were queued - attach to it instead
+            slot.release()
+            slot = None
+    
+    stream_id = uuid.uuid4().hex
+    # Without a key the flight only serves reconnects; its finished events are never asked for again
+    cacheable = scope is not None
+    if scope is None:
+        scope = f"{request.user_id}:stream:{stream_id}"
+    
+    def start_stream():
+        events = stream_chat_turn(request.user_id, request.message, request.client_pacing, request.message_id)
+        if slot:
+            events = hold_generation_slot(slot, events)
+        return stream_event_log.record(stream_id, request.user_id, scope, events)
     
-    # Extract personal details from the user message
-    extract_personal_details(user_id, user_message)
-
-    # Get user data from users table
     try:
-        user_response = supabase.table("users").select("""
-            communication_style, name, nationality, birth_country, date_of_birth, current_location,
-            future_self_description, mind_space, future_proud, most_yourself,
-            low_moments, spiral_reminder, change_goal, avoid_tendency, feeling_description,
-            future_description, future_age, typical_day, accomplishment, words_slang,
-            message_preference, messaging_frequency, emoji_usage_preference,
-            preferred_communication, message_length, emoji_usage,
-            use_slang
-        """).eq("id", user_id).execute()
-        user_data = user_response.data[0] if user_response.data else {}
-    except Exception as e:
-        print(f"Error fetching user data for user {user_id}: {e}")
-        user_data = {}
-
-    # Get conversation context for natural flow
-    conversation_context = await get_conversation_context(user_id, supabase)
+        events = chat_streams.subscribe(scope, start_stream, get_request_fingerprint(request), cacheable=cacheable)
+    except IdempotencyKeyReused as e:
+        if slot:
+            slot.release()
+        raise HTTPException(status_code=422, detail=str(e))
+    return StreamingResponse(events, media_type="text/event-stream")
+
+async def hold_generation_slot(slot: AdmissionSlot, events):
+    """Keep the generation slot until the stream finishes"""
+    try:
+        async with aclosing(events) as stream:
+            async for event in stream:
+                yield event
+    finally:
+        slot.release()
+
+def typing_event(typing: bool, client_pacing: bool) -> dict:
+    event = {'typing': typing}
+    if typing and client_pacing:
+        # Acknowledge the negotiated mode so the client knows to apply delay hints
+        event['pacing'] = 'client'
+    return event
+
+async def stream_chat_turn(user_id: str, user_message: str, client_pacing: bool = False, message_id: str | None = None):
+    """SSE framing of chat_turn_events"""
+    async with aclosing(chat_turn_events(user_id, user_message, client_pacing, message_id=message_id)) as events:
+        async for event in events:
+            yield f"data: {json.dumps(event)}\n\n"
+
+async def chat_turn_events(user_id: str, user_message: str, client_pacing: bool = False, chat_context=None, persona_prompt: str | None = None, message_id: str | None = None):
+    """
+    Events for one chat turn, shared by the SSE and WebSocket transports.
     
-    # Generate weather and events context if location is available
-    weather_events_context = {}
-    current_location = user_data.get('current_location', '')
-    if current_location:
-        try:
-            weather_service = WeatherEventsService()
-            weather_events_context = await weather_service.get_location_context(current_location)
-            print(f"Generated weather/events context for {current_location}")
-        except Exception as e:
-            print(f"Error generating weather/events context: {e}")
-            weather_events_context = {}
+    A WebSocket session passes its own chat_context (profile, conversation,
+    location and stored_details) and persona_prompt; otherwise both are
+    loaded for this turn.
+    
+    By default the server paces the typing animation by sleeping between
+    bursts. With client_pacing, tokens are forwarded as soon as they arrive
+    and each event that would have been delayed carries a 'delay' hint (in
+    seconds) for the client to wait before rendering it, so the connection is
+    held only for the actual generation time.
+    """
+    # Simple greetings get a templated reply without calling the LLM, sent with the same events as before
+    if is_simple_greeting(user_message):
+        greeting_user_data, greeting_text = await answer_greeting(user_id, user_message, message_id)
+        
+        yield typing_event(True, client_pacing)
+        typing_delay = calculate_typing_delay(greeting_text, greeting_user_data)
+        if client_pacing:
+            yield {'typing': False, 'delay': round(typing_delay, 3)}
+        else:
+            await asyncio.sleep(typing_delay)
+            yield {'typing': False}
+        yield {'text': greeting_text, 'done': True}
+        yield {'done': True}
+        return
+    
+    # Load profile, conversation context, personal details and weather/events concurrently
+    if chat_context is None:
+        chat_context = await build_chat_context(user_id, user_message, message_id)
+    user_data = chat_context["profile"]
+    conversation_context = chat_context["conversation"]
+    weather_events_context = chat_context["location"]
     
     # Create natural future self prompt with weather/events context
-    prompt = create_future_self_prompt(user_message, user_data, conversation_context, weather_events_context)
-
-    print(f"Generated natural conversation prompt for Ollama:\n{prompt}")
+    prompt, messages = build_generation_request(user_id, user_message, user_data, conversation_context, weather_events_context, persona_prompt)
+    llm_telemetry.maybe_log_prompt(user_id, prompt)
 
     # Call Ollama (Mistral AI) with streaming enabled
-    ollama_url = os.environ.get("OLLAMA_API_URL")
-    ollama_model = os.environ.get("OLLAMA_MODEL", "mistral:7b")
-    
-    if not ollama_url:
+    if not ollama_service.is_configured:
         print("ERROR: Ollama API URL not found in environment variables. Please set it in your .env file.")
-        return {"error": "Ollama API URL not configured"}
+        yield {'error': 'Ollama API URL not configured'}
+        return
 
-    async def generate_stream():
-        # Store the complete response for saving to database later
-        complete_response = ""
-        
-        try:
-            # First, send a typing indicator to the client
-            yield f"data: {json.dumps({'typing': True})}\n\n"
-            
-            # Set up the streaming request to Ollama
-            response = requests.post(
-                ollama_url,
-                json={"model": ollama_model, "prompt": prompt, "stream": True},
-                stream=True,  # Enable streaming from requests
-                timeout=180  # Increased timeout to 3 minutes for longer generation
-            )
-            response.raise_for_status()
-            
-            # Collect the complete response first
-            complete_response = ""
-            accumulated_text = ""
-            last_chunk_time = time.time()
-            
-            for line in response.iter_lines():
-                if line:
-                    # Parse the JSON response from Ollama
-                    chunk_data = json.loads(line)
-                    if "response" in chunk_data:
-                        chunk_text = chunk_data["response"]
-                        complete_response += chunk_text
-                        accumulated_text += chunk_text
-                        
-                        # If this is the final chunk, humanize the complete response
-                        if chunk_data.get("done", False):
-                            # Apply humanize_response to the complete response for simple greetings
-                            user_name = user_data.get("name", "")
-                            humanized_response = humanize_response(complete_response, user_name, user_message, user_id, user_data)
-                            
-                            # For simple greetings, we need to send the humanized response as a single chunk
-                            simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
-                            user_message_lower = user_message.lower().strip()
-                            is_simple_greeting = any(user_message_lower == greeting or user_message_lower.startswith(greeting + ' ') or user_message_lower.endswith(' ' + greeting) for greeting in simple_greetings)
-                            
-                            if is_simple_greeting and humanized_response != complete_response:
-                                # For simple greetings with modified response, calculate typing delay
-                                typing_delay = calculate_typing_delay(humanized_response, user_data)
-                                await asyncio.sleep(typing_delay)
-                                
-                                # Send typing stopped indicator
-                                yield f"data: {json.dumps({'typing': False})}\n\n"
-                                
-                                # For simple greetings with modified response, send the entire humanized response
-                                yield f"data: {json.dumps({'text': humanized_response, 'done': True})}\n\n"
-                                # Update complete_response for database storage
-                                complete_response = humanized_response
-                                break
-                        
-                        # Apply realistic typing delays for normal streaming
-                        current_time = time.time()
-                        time_since_last_chunk = current_time - last_chunk_time
-                        
-                        # If we've accumulated enough text or enough time has passed, send a chunk
-                        # This simulates how humans type in bursts
-                        if len(accumulated_text) >= 10 or time_since_last_chunk >= 0.5:
-                            # Calculate a realistic typing delay based on the accumulated text
-                            typing_delay = calculate_typing_delay(accumulated_text, user_data) / 5  # Divide by 5 since we're streaming in chunks
-                            
-                            # Apply the delay
-                            await asyncio.sleep(typing_delay)
-                            
-                            # Format for SSE for normal streaming
-                            yield f"data: {json.dumps({'text': accumulated_text})}\n\n"
-                            
-                            # Reset accumulated text and update last chunk time
-                            accumulated_text = ""
-                            last_chunk_time = current_time
-            
-            # Save the complete response to the database
-            try:
-                # For non-simple greetings where we didn't already humanize the response
-                simple_greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
-                user_message_lower = user_message.lower().strip()
-                is_simple_greeting = any(user_message_lower == greeting or user_message_lower.startswith(greeting + ' ') or user_message_lower.endswith(' ' + greeting) for greeting in simple_greetings)
+    # Humanize sentence by sentence as tokens arrive, so what is streamed is exactly what gets stored
+    humanizer = StreamingHumanizer(user_data.get("name", ""), user_data, chat_context["stored_details"])
+    saved = False
+    
+    try:
+        # First, send a typing indicator to the client
+        yield typing_event(True, client_pacing)
+        
+        accumulated_text = ""
+        last_chunk_time = time.time()
+        
+        # Stream NDJSON chunks from Ollama; aclosing releases the pooled connection on early exit
+        ollama_chunks = ollama_service.chat_stream(messages) if messages else ollama_service.generate_stream(prompt)
+        async with aclosing(ollama_chunks) as chunks:
+            async for chunk_data in chunks:
+                if chunk_data.get("done", False):
+                    persona_sessions.record(user_id, chunk_data)
                 
-                # If it's not a simple greeting or we didn't already humanize it in the streaming part
-                if not is_simple_greeting:
-                    # Apply humanize_response to the complete response
-                    user_name = user_data.get("name", "")
-                    complete_response = humanize_response(complete_response, user_name, user_message, user_id, user_data)
+                chunk_text = humanizer.feed(chunk_data.get("response", ""))
+                if chunk_data.get("done", False):
+                    chunk_text += humanizer.finish()
+                if not chunk_text:
+                    if humanizer.finished:
+                        break
+                    continue
+                accumulated_text += chunk_text
                 
-                supabase.table("chat_messages").insert({
-                    "user_id": user_id,
-                    "message_id": f"ai_{uuid.uuid4()}",
-                    "content": complete_response,
-                    "author_id": "ai" # AI as the author
-                }).execute()
-            except Exception as e:
-                print(f"Error saving AI response to Supabase: {e}")
+                # Apply realistic typing delays for normal streaming
+                current_time = time.time()
+                time_since_last_chunk = current_time - last_chunk_time
                 
-            # Send a completion event
-            yield f"data: {json.dumps({'done': True})}\n\n"
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error calling Ollama: {e}")
-            yield f"data: {json.dumps({'error': f'Error communicating with Ollama: {str(e)}'})}\n\n"
+                if client_pacing:
+                    # Forward the text right away; bursts carry the delay the server would have slept
+                    event = {'text': chunk_text}
+                    if len(accumulated_text) >= 10 or time_since_last_chunk >= 0.5:
+                        event['delay'] = round(calculate_typing_delay(accumulated_text, user_data) / 5, 3)
+                        accumulated_text = ""
+                        last_chunk_time = current_time
+                    yield event
+                
+                # If we've accumulated enough text or enough time has passed, send a chunk
+                # This simulates how humans type in bursts
+                elif len(accumulated_text) >= 10 or time_since_last_chunk >= 0.5:
+                    # Calculate a realistic typing delay based on the accumulated text
+                    typing_delay = calculate_typing_delay(accumulated_text, user_data) / 5  # Divide by 5 since we're streaming in chunks
+                    
+                    # Apply the delay
+                    await asyncio.sleep(typing_delay)
+                    
+                    # Format for SSE for normal streaming
+                    yield {'text': accumulated_text}
+                    
+                    # Reset accumulated text and update last chunk time
+                    accumulated_text = ""
+                    last_chunk_time = current_time
+                
+                # The short-message preference can end the reply before the model does
+                if humanizer.finished:
+                    break
+        
+        # Send whatever the model produced after the last burst
+        tail = humanizer.finish()
+        if not client_pacing:
+            tail = accumulated_text + tail
+        if tail:
+            yield {'text': tail}
+        
+        # Save the complete response to the database
+        try:
+            saved = True
+            await asyncio.to_thread(save_ai_message, user_id, humanizer.text)
         except Exception as e:
-            print(f"An unexpected error occurred in chat_stream_endpoint: {e}")
-            yield f"data: {json.dumps({'error': f'An unexpected error occurred: {str(e)}'})}\n\n"
+            print(f"Error saving AI response to Supabase: {e}")
+            
+        # Send a completion event
+        yield {'done': True}
+        
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client disconnected: leaving the aclosing block has already closed the Ollama request
+        chat_streams_cancelled.inc()
+        if CHAT_STREAM_PARTIAL_POLICY == "store" and humanizer.text and not saved:
+            # Keep the reply as far as it got; save_ai_message only queues the row, so it's safe here
+            save_ai_message(user_id, humanizer.text)
+        raise
+    except (httpx.HTTPError, OllamaUnavailableError) as e:
+        print(f"Error calling Ollama: {e}")
+        yield {'error': f'Error communicating with Ollama: {str(e)}'}
+    except Exception as e:
+        print(f"An unexpected error occurred in chat_stream_endpoint: {e}")
+        yield {'error': f'An unexpected error occurred: {str(e)}'}
+
+# --- WebSocket Chat Sessions ---
+chat_sessions_active = metrics.gauge("chat_sessions_active", "Open /chat/ws sessions")
+
+class ChatSession:
+    """
+    State for one /chat/ws connection.
+    
+    The profile, persona prompt, recent turns, stored personal details and
+    location context are loaded once when the socket opens and then kept in
+    memory. Each message only re-checks the cached profile (rebuilding the
+    persona if it changed) and refreshes the location context when the
+    location changed or it is older than CHAT_SESSION_LOCATION_TTL seconds.
+    Stored details are reloaded in the background once the personal details
+    queue has stored new ones for the user.
+    """
     
-    return StreamingResponse(
-        generate_stream(),
-        media_type="text/event-stream"
-    )
+    location_ttl = float(os.getenv('CHAT_SESSION_LOCATION_TTL', '900'))
+    history_size = 5
+    
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.profile = {}
+        self.persona_prompt = None
+        self.conversation = []
+        self.stored_details = {}
+        self._details_version = personal_details_queue.merge_version(user_id)
+        self.location_context = {}
+        self._location = None
+        self._location_loaded_at = 0.0
+        self._background = set()
+    
+    async def open(self):
+        chat_context = await assemble_context([
+            ContextSource("profile", lambda: asyncio.to_thread(fetch_user_profile, self.user_id), default={}),
+            ContextSource("conversation", lambda: get_conversation_context(self.user_id, supabase, self.history_size), default=[]),
+            ContextSource("stored_details", lambda: asyncio.to_thread(personal_details_store.get, self.user_id), default={}),
+        ])
+        self._set_profile(chat_context["profile"])
+        self.conversation = list(chat_context["conversation"])
+        self.stored_details = chat_context["stored_details"]
+        await self._refresh_location()
+    
+    def _set_profile(self, profile: dict):
+        self.profile = profile
+        self.persona_prompt = build_persona_prompt(profile)
+    
+    async def _refresh_location(self):
+        location = self.profile.get('current_location', '')
+        if location == self._location and time.monotonic() - self._location_loaded_at < self.location_ttl:
+            return
+        self._location = location
+        self._location_loaded_at = time.monotonic()
+        if not location:
+            self.location_context = {}
+            return
+        result = await assemble_context([
+            ContextSource("location", lambda: weather_events_service.get_location_context(location), default={}),
+        ])
+        self.location_context = result["location"]
+    
+    async def _reload_details(self):
+        self.stored_details = await asyncio.to_thread(personal_details_store.get, self.user_id)
+    
+    async def prepare_turn(self, user_message: str, message_id: str | None = None) -> dict:
+        """Context for the next reply, refreshing only what changed"""
+        profile = await asyncio.to_thread(fetch_user_profile, self.user_id)
+        if profile and profile != self.profile:
+            self._set_profile(profile)
+        await self._refresh_location()
+        
+        # Only reload when the queue stored new details since the last load; the reply doesn't wait for it
+        details_version = personal_details_queue.merge_version(self.user_id)
+        if details_version != self._details_version:
+            self._details_version = details_version
+            task = asyncio.create_task(self._reload_details())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        
+        await asyncio.to_thread(conversation_buffer.append, self.user_id, self.user_id, user_message, message_id)
+        personal_details_queue.enqueue(self.user_id, user_message)
+        return {
+            "profile": self.profile,
+            "conversation": list(self.conversation),
+            "location": self.location_context,
+            "stored_details": self.stored_details,
+        }
+    
+    def record_turn(self, user_message: str, reply: str):
+        self.conversation.append(f"You: {user_message}")
+        if reply:
+            self.conversation.append(f"Your future self: {reply}")
+        self.conversation = self.conversation[-self.history_size:]
+    
+    async def run_turn(self, websocket: WebSocket, user_message: str, client_pacing: bool = False, message_id: str | None = None):
+        slot = None
+        chat_context = None
+        if not is_simple_greeting(user_message):
+            try:
+                slot = await generation_admission.acquire(self.user_id)
+            except AdmissionRejected as e:
+                await websocket.send_json({'error': e.reason, 'retry_after': e.retry_after})
+                return
+        
+        reply = ""
+        try:
+            if slot:
+                chat_context = await self.prepare_turn(user_message, message_id)
+            async with aclosing(chat_turn_events(self.user_id, user_message, client_pacing, chat_context, self.persona_prompt, message_id)) as events:
+                async for event in events:
+                    reply += event.get('text') or ""
+                    await websocket.send_json(event)
+        finally:
+            if slot:
+                slot.release()
+        
+        self.record_turn(user_message, reply)
+
+@app.websocket('/chat/ws')
+async def chat_websocket(websocket: WebSocket, user_id: str = Query(...)):
+    """
+    Chat over a persistent WebSocket.
+    
+    Send {"message": "...", "client_pacing": false} per turn; the reply comes
+    back as the same JSON events /chat/stream sends over SSE, ending with
+    {"done": true}. Turns are handled one at a time.
+    """
+    await websocket.accept()
+    session = ChatSession(user_id)
+    chat_sessions_active.inc()
+    try:
+        await session.open()
+        while True:
+            data = await websocket.receive_json()
+            user_message = (data.get('message') or "").strip()
+            if not user_message:
+                await websocket.send_json({'error': 'Message is empty'})
+                continue
+            await session.run_turn(websocket, user_message, bool(data.get('client_pacing', False)), data.get('message_id'))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_sessions_active.dec()
 
 # Ensure required database tables exist
 def ensure_database_tables():
@@ -1932,7 +1492,7 @@ def ensure_database_tables():
                         "query": """
                         CREATE TABLE IF NOT EXISTS user_personal_details (
                             id SERIAL PRIMARY KEY,
-                            user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+                            user_id UUID NOT NULL UNIQUE REFERENCES auth.users(id) ON DELETE CASCADE,
                             goals TEXT[],
                             challenges TEXT[],
                             interests TEXT[],
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, Sequence, Tuple
+
+from text_rewrite import trie_pattern
+
+try:
+    import ahocorasick
+except ImportError:  # Falls back to one substring check per distinct term
+    ahocorasick = None
+
+# Greetings that get a short templated reply instead of a full generation
+SIMPLE_GREETINGS = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'howdy', 'greetings']
+# Reply openings that get the short typing delay (calculate_typing_delay); this
+# check never included 'howdy' or 'greetings'
+TYPING_DELAY_GREETINGS = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']
+
+# Term lists read by the message classifiers, by category. A term counts when it
+# appears anywhere in the lowercased message, including inside a longer word.
+LEXICON = {
+    # determine_communication_style
+    "emotional": ['feel', 'sad', 'happy', 'anxious', 'worried', 'excited', 'overwhelmed'],
+    "directive": ['should', 'need to', 'have to', 'must', 'want'],
+    "reflection": ['think', 'realize', 'understand', 'wonder', 'question', 'myself'],
+    "guidance": ['help', 'advice', 'suggest', 'guide', 'what should'],
+    "casual": ['yo', 'sup', 'lol', 'haha', 'cool'],
+    "grounding": ['calm', 'anxious'],
+    "goal": ['goal'],
+
+    # detect_emotional_context
+    "stress": ['stressed', 'anxious', 'worried', 'overwhelmed', 'scared', 'panic'],
+    "excitement": ['excited', 'happy', 'amazing', 'great', 'wonderful', 'fantastic'],
+    "uncertainty": ['confused', 'lost', 'stuck', 'don\'t know', 'unsure', 'help'],
+    "sadness": ['sad', 'disappointed', 'failed', 'giving up', 'hopeless'],
+    "aspiration": ['goal', 'dream', 'want to', 'planning', 'future', 'hope'],
+
+    # pick_sentiment_emoji
+    "positive": ["good", "great", "happy", "excited", "love", "awesome"],
+    "negative": ["sad", "bad", "worried", "anxious", "stressed", "upset"],
+}
+
+@dataclass(frozen=True)
+class MessageFeatures:
+    """What the classifiers need to know about one message, from a single scan"""
+    terms: FrozenSet[str]
+    # Distinct terms found per LEXICON category
+    counts: Dict[str, int]
+    question_marks: int
+    is_greeting: bool
+
+    def count(self, category: str) -> int:
+        return self.counts.get(category, 0)
+
+    def has(self, category: str) -> bool:
+        return self.counts.get(category, 0) > 0
+
+class LexiconMatcher:
+    """
+    Finds every LEXICON term in a message in one linear scan.
+
+    The terms of all categories are compiled once into an Aho-Corasick
+    automaton (pyahocorasick), which reports every occurrence of every term,
+    overlapping ones included, in a single pass over the lowercased message.
+    That gives the same set of terms as checking `term in message` for each
+    one. Without pyahocorasick each distinct term is checked once instead.
+
+    analyze() caches its result per message text: the classifiers that run
+    during one chat turn all read the same record.
+    """
+
+    def __init__(self, lexicon: Dict[str, Sequence[str]] = LEXICON, greetings: Sequence[str] = SIMPLE_GREETINGS, delay_greetings: Sequence[str] = TYPING_DELAY_GREETINGS, max_messages: int = 1024):
+        term_categories: Dict[str, Tuple[str, ...]] = {}
+        for category, terms in lexicon.items():
+            for term in terms:
+                term_categories[term] = term_categories.get(term, ()) + (category,)
+        self._term_categories = term_categories
+        self._automaton = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for term in term_categories:
+                self._automaton.add_word(term, term)
+            self._automaton.make_automaton()
+
+        greeting_pattern = trie_pattern([greeting.lower() for greeting in greetings])
+        # The whole message, its first word(s) or its last word(s) is a greeting
+        self._greeting = re.compile(f"(?:{greeting_pattern})(?: |$)|.* (?:{greeting_pattern})$", flags=re.DOTALL)
+        delay_greeting_pattern = trie_pattern([greeting.lower() for greeting in delay_greetings])
+        self._greeting_prefix = re.compile(rf"\s*(?:{delay_greeting_pattern})", flags=re.IGNORECASE)
+
+        self.analyze = lru_cache(maxsize=max_messages)(self._analyze)
+
+    def _analyze(self, message: str) -> MessageFeatures:
+        lower = message.lower()
+        if self._automaton is not None:
+            terms = {term for _, term in self._automaton.iter(lower)}
+        else:
+            terms = {term for term in self._term_categories if term in lower}
+
+        counts: Dict[str, int] = {}
+        for term in terms:
+            for category in self._term_categories[term]:
+                counts[category] = counts.get(category, 0) + 1
+
+        return MessageFeatures(
+            terms=frozenset(terms),
+            counts=counts,
+            question_marks=message.count('?'),
+            is_greeting=self._greeting.match(lower.strip()) is not None,
+        )
+
+    def starts_with_greeting(self, text: str) -> bool:
+        """Whether text opens with a typing-delay greeting; only looks at the start, for long or growing replies"""
+        return self._greeting_prefix.match(text) is not None
+
+# Create a global instance
+message_lexicon = LexiconMatcher()
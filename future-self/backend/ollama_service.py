@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import asyncio
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from metrics import metrics
+from llm_telemetry import llm_telemetry
+
+# Load environment variables
+load_dotenv()
+
+class OllamaUnavailableError(Exception):
+    """Raised when every configured Ollama backend is down or failed the request"""
+    pass
+
+class OllamaBackend:
+    """One Ollama server with its load and circuit breaker state"""
+
+    def __init__(self, api_url: str, chat_url: str, failure_threshold: int, cooldown: float):
+        self.api_url = api_url
+        self.chat_url = chat_url
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        # Token of the request holding the half-open trial slot, if any
+        self.trial: Optional[object] = None
+        self.trial_started_at = 0.0
+
+    @property
+    def base_url(self) -> str:
+        return self.api_url.rstrip('/').rsplit('/api/', 1)[0]
+
+    @property
+    def is_open(self) -> bool:
+        return self.consecutive_failures >= self.failure_threshold
+
+    def is_available(self) -> bool:
+        if not self.healthy:
+            return False
+        if not self.is_open:
+            return True
+        # Half-open: once the cooldown passes, let a single trial request through
+        return self.open_until <= time.monotonic() and self.trial is None
+
+    def begin_trial(self) -> object:
+        """Take the half-open trial slot; the returned token frees it in end_request"""
+        self.trial = object()
+        self.trial_started_at = time.monotonic()
+        return self.trial
+
+    def end_request(self, trial: Optional[object]):
+        """
+        Request finished however it ended (also cancelled or failed outside httpx).
+        Frees the trial slot only if this request took it: a request that started
+        before the breaker opened must not let a second trial through.
+        """
+        if trial is not None and trial is self.trial:
+            self.trial = None
+
+    def release_trial(self):
+        self.trial = None
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> bool:
+        """Count a failure; returns True if this opened the breaker"""
+        was_open = self.is_open
+        self.consecutive_failures += 1
+        if self.is_open:
+            self.open_until = time.monotonic() + self.cooldown
+        return self.is_open and not was_open
+
+class OllamaService:
+    """
+    Async client for the Ollama API using pooled keep-alive HTTP connections.
+
+    Requests are routed across every server in OLLAMA_API_URLS (or the single
+    OLLAMA_API_URL) to the available backend with the fewest outstanding
+    requests. Connection failures, timeouts before a response starts and 5xx
+    replies fail over to the next backend immediately. Each backend has a
+    circuit breaker, and a background probe marks servers down or back up.
+    """
+
+    def __init__(self):
+        # Endpoints and model - should be set as environment variables
+        api_urls = os.getenv('OLLAMA_API_URLS') or os.getenv('OLLAMA_API_URL') or ''
+        self.model = os.getenv('OLLAMA_MODEL', 'mistral:7b')
+
+        # Timeouts (seconds). Reads stay long because generation can take minutes,
+        # connecting to a healthy local server should be near instant.
+        self.connect_timeout = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = float(os.getenv('OLLAMA_READ_TIMEOUT', '180'))
+        self.pool_timeout = float(os.getenv('OLLAMA_POOL_TIMEOUT', '30'))
+
+        # Connection pool sizing
+        self.max_connections = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '32'))
+        self.max_keepalive_connections = int(os.getenv('OLLAMA_MAX_KEEPALIVE_CONNECTIONS', '16'))
+        self.keepalive_expiry = float(os.getenv('OLLAMA_KEEPALIVE_EXPIRY', '60'))
+
+        # Chat sessions send the persona as a stable system message through /api/chat
+        # so Ollama can reuse its cached prefix; keep_alive keeps the model loaded between turns
+        self.session_mode = os.getenv('OLLAMA_SESSION_MODE', 'true').lower() in ('1', 'true', 'yes')
+        self.keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+        # Routing, circuit breaking and health probes
+        self.breaker_threshold = int(os.getenv('OLLAMA_BREAKER_THRESHOLD', '3'))
+        self.breaker_cooldown = float(os.getenv('OLLAMA_BREAKER_COOLDOWN', '30'))
+        self.health_interval = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))
+        self.health_timeout = float(os.getenv('OLLAMA_HEALTH_TIMEOUT', '2'))
+
+        urls = [url.strip() for url in api_urls.split(',') if url.strip()]
+        chat_url_override = os.getenv('OLLAMA_CHAT_URL') if len(urls) == 1 else None
+        self.backends = [
+            OllamaBackend(url, chat_url_override or self._derive_chat_url(url), self.breaker_threshold, self.breaker_cooldown)
+            for url in urls
+        ]
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+        self._failovers = metrics.counter("ollama_failovers_total", "Requests retried on another Ollama backend after a failure")
+        self._breaker_opened = metrics.counter("ollama_breaker_opened_total", "Times an Ollama backend's circuit breaker opened")
+        self._available = metrics.gauge("ollama_backends_available", "Ollama backends currently accepting requests")
+        self._available.set(len(self.backends))
+
+    @staticmethod
+    def _derive_chat_url(api_url: Optional[str]) -> Optional[str]:
+        if api_url and api_url.rstrip('/').endswith('/api/generate'):
+            return api_url.rstrip('/')[:-len('/api/generate')] + '/api/chat'
+        return api_url
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.backends)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Create the shared client lazily so it binds to the running event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    self.read_timeout,
+                    connect=self.connect_timeout,
+                    pool=self.pool_timeout
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                )
+            )
+        return self._client
+
+    def _payload(self, prompt: str, model: Optional[str], stream: bool) -> Dict[str, Any]:
+        return {"model": model or self.model, "prompt": prompt, "stream": stream}
+
+    def _chat_payload(self, messages: List[Dict[str, str]], model: Optional[str], stream: bool) -> Dict[str, Any]:
+        return {"model": model or self.model, "messages": messages, "stream": stream, "keep_alive": self.keep_alive}
+
+    @staticmethod
+    def _normalize_chat_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        """Expose /api/chat output under 'response' like /api/generate"""
+        chunk["response"] = chunk.get("message", {}).get("content", "")
+        return chunk
+
+    @staticmethod
+    def _should_fail_over(error: Exception) -> bool:
+        """Errors raised before the backend started answering, or busy/broken replies"""
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)):
+            return True
+        return isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+
+    def _pick_backend(self, tried: List[OllamaBackend]) -> Tuple[OllamaBackend, Optional[object]]:
+        """Least outstanding requests among available backends not yet tried, and the trial token if this request is the half-open trial"""
+        candidates = [backend for backend in self.backends if backend not in tried and backend.is_available()]
+        if not candidates:
+            raise OllamaUnavailableError("No Ollama backend is available")
+        backend = min(candidates, key=lambda backend: backend.outstanding)
+        trial = backend.begin_trial() if backend.is_open else None
+        return backend, trial
+
+    def _record_failure(self, backend: OllamaBackend, error: Exception):
+        print(f"Ollama backend {backend.base_url} failed: {error}")
+        if backend.record_failure():
+            self._breaker_opened.inc()
+            print(f"Circuit breaker opened for Ollama backend {backend.base_url} for {backend.cooldown}s")
+        self._update_available()
+
+    def _update_available(self):
+        self._available.set(sum(1 for backend in self.backends if backend.is_available()))
+
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST to the least loaded backend, failing over until one answers"""
+        tried: List[OllamaBackend] = []
+        while True:
+            backend, trial = self._pick_backend(tried)
+            tried.append(backend)
+            url = backend.chat_url if path == 'chat' else backend.api_url
+            backend.outstanding += 1
+            try:
+                response = await self._get_client().post(url, json=payload)
+                response.raise_for_status()
+                result = response.json()
+            except Exception as e:
+                if isinstance(e, httpx.HTTPError):
+                    self._record_failure(backend, e)
+                if self._should_fail_over(e) and len(tried) < len(self.backends):
+                    self._failovers.inc()
+                    continue
+                raise
+            finally:
+                backend.outstanding -= 1
+                backend.end_request(trial)
+            backend.record_success()
+            return result
+
+    @asynccontextmanager
+    async def _open_stream(self, path: str, payload: Dict[str, Any]):
+        """Open a streaming response on the least loaded backend, failing over until one starts answering"""
+        tried: List[OllamaBackend] = []
+        while True:
+            backend, trial = self._pick_backend(tried)
+            tried.append(backend)
+            url = backend.chat_url if path == 'chat' else backend.api_url
+            backend.outstanding += 1
+            started = False
+            try:
+                async with self._get_client().stream("POST", url, json=payload) as response:
+                    try:
+                        response.raise_for_status()
+                    except httpx.HTTPStatusError as e:
+                        self._record_failure(backend, e)
+                        if self._should_fail_over(e) and len(tried) < len(self.backends):
+                            self._failovers.inc()
+                            continue
+                        raise
+                    # Once the response has started, errors go to the caller
+                    started = True
+                    try:
+                        yield response
+                    except httpx.HTTPError as e:
+                        self._record_failure(backend, e)
+                        raise
+                    backend.record_success()
+                    return
+            except httpx.HTTPError as e:
+                if started or isinstance(e, httpx.HTTPStatusError):
+                    raise
+                # Raised while connecting, before anything was yielded
+                self._record_failure(backend, e)
+                if self._should_fail_over(e) and len(tried) < len(self.backends):
+                    self._failovers.inc()
+                    continue
+                raise
+            finally:
+                backend.outstanding -= 1
+                backend.end_request(trial)
+
+    async def _timed_post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.monotonic()
+        result = await self._post(path, payload)
+        llm_telemetry.observe_completion(result, time.monotonic() - started)
+        return result
+
+    async def _timed_stream(self, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Parsed NDJSON chunks, recording time to first token and the final stats"""
+        started = time.monotonic()
+        first_token = False
+        async with self._open_stream(path, payload) as response:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if path == 'chat':
+                    chunk = self._normalize_chat_chunk(chunk)
+                if not first_token and chunk.get("response"):
+                    first_token = True
+                    llm_telemetry.observe_first_token(time.monotonic() - started)
+                if chunk.get("done"):
+                    llm_telemetry.observe_completion(chunk, time.monotonic() - started)
+                yield chunk
+
+    async def generate(self, prompt: str, model: Optional[str] = None) -> Dict[str, Any]:
+        """Run a non-streaming generation and return Ollama's JSON body"""
+        return await self._timed_post('generate', self._payload(prompt, model, False))
+
+    async def generate_stream(self, prompt: str, model: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield each NDJSON chunk from a streaming generation as it arrives"""
+        async with aclosing(self._timed_stream('generate', self._payload(prompt, model, True))) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> Dict[str, Any]:
+        """Run a non-streaming chat completion; the reply text is under 'response'"""
+        return self._normalize_chat_chunk(await self._timed_post('chat', self._chat_payload(messages, model, False)))
+
+    async def chat_stream(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield chat NDJSON chunks as they arrive, shaped like generate_stream chunks"""
+        async with aclosing(self._timed_stream('chat', self._chat_payload(messages, model, True))) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    def start_health_checks(self):
+        """Start probing every backend in the background (call on application startup)"""
+        if self._health_task is None and self.backends:
+            self._health_task = asyncio.create_task(self._run_health_checks())
+
+    async def _run_health_checks(self):
+        while True:
+            await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+            self._update_available()
+            await asyncio.sleep(self.health_interval)
+
+    async def _probe(self, backend: OllamaBackend):
+        try:
+            response = await self._get_client().get(backend.base_url + '/api/version', timeout=self.health_timeout)
+            response.raise_for_status()
+        except Exception as e:
+            if backend.healthy:
+                print(f"Ollama backend {backend.base_url} failed its health check: {e}")
+            backend.healthy = False
+            return
+        if not backend.healthy:
+            print(f"Ollama backend {backend.base_url} is healthy again")
+        backend.healthy = True
+        # A trial whose request never reported back (e.g. a task killed mid-await) must not pin the breaker open
+        if backend.trial is not None and time.monotonic() - backend.trial_started_at > backend.cooldown:
+            print(f"Releasing stuck half-open trial for Ollama backend {backend.base_url}")
+            backend.release_trial()
+
+    async def close(self):
+        """Stop health checks and close pooled connections (call on application shutdown)"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+# Create a global instance
+ollama_service = OllamaService()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+
+from metrics import metrics
+
+class PersonaSessionTracker:
+    """
+    Tracks persona prefix reuse across a user's chat-session turns.
+
+    A turn reuses the prefix when its system message is byte-identical to the
+    one sent on the user's previous turn, which is what lets Ollama skip
+    re-evaluating the persona tokens. Ollama's prompt_eval_count for each turn
+    is accumulated separately for reused and changed prefixes so the saving is
+    visible in /metrics.
+    """
+
+    def __init__(self, max_users: int = 10000):
+        self.max_users = max_users
+        self._last_prefix: "OrderedDict[str, str]" = OrderedDict()
+        self._pending_reuse: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+        self._reused = metrics.counter("persona_prefix_reused_total", "Chat turns whose persona system message matched the previous turn")
+        self._changed = metrics.counter("persona_prefix_changed_total", "Chat turns that sent a new or changed persona system message")
+        self._reused_eval_tokens = metrics.counter("persona_prefix_reused_prompt_eval_tokens_total", "Prompt tokens Ollama evaluated on turns with a reused prefix")
+        self._changed_eval_tokens = metrics.counter("persona_prefix_changed_prompt_eval_tokens_total", "Prompt tokens Ollama evaluated on turns with a new prefix")
+
+    def observe(self, user_id: str, system_prompt: str) -> bool:
+        """Record the system message for this turn; returns True if the prefix is reused"""
+        digest = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            reused = self._last_prefix.get(user_id) == digest
+            self._last_prefix[user_id] = digest
+            self._last_prefix.move_to_end(user_id)
+            while len(self._last_prefix) > self.max_users:
+                self._last_prefix.popitem(last=False)
+            self._pending_reuse[user_id] = reused
+
+        (self._reused if reused else self._changed).inc()
+        return reused
+
+    def record(self, user_id: str, result: Dict[str, Any]):
+        """Account Ollama's prompt evaluation stats for the user's last observed turn"""
+        with self._lock:
+            reused = self._pending_reuse.pop(user_id, None)
+        if reused is None:
+            return
+        prompt_eval_count = result.get("prompt_eval_count") or 0
+        (self._reused_eval_tokens if reused else self._changed_eval_tokens).inc(prompt_eval_count)
+
+# Create a global instance
+persona_sessions = PersonaSessionTracker()
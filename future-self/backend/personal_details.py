@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+# Patterns to extract different types of personal information
+PERSONAL_DETAIL_PATTERNS = {
+    'goals': re.compile(r'(?:my goal|i want to|i hope to|planning to|aim to|dream of)\s+(.+?)(?:\.|,|$)', re.IGNORECASE),
+    'challenges': re.compile(r'(?:struggling with|having trouble with|difficult for me|challenge|problem with)\s+(.+?)(?:\.|,|$)', re.IGNORECASE),
+    'interests': re.compile(r'(?:i enjoy|i love|passionate about|interested in|hobby|like to)\s+(.+?)(?:\.|,|$)', re.IGNORECASE),
+    'values': re.compile(r'(?:important to me|i believe in|i value|matters to me)\s+(.+?)(?:\.|,|$)', re.IGNORECASE),
+    'achievements': re.compile(r'(?:i accomplished|i achieved|proud of|managed to|succeeded in)\s+(.+?)(?:\.|,|$)', re.IGNORECASE),
+}
+
+def find_personal_details(user_message: str) -> dict:
+    """Goals, challenges, interests, values and achievements mentioned in a message, by category"""
+    details = {}
+    for category, pattern in PERSONAL_DETAIL_PATTERNS.items():
+        matches = pattern.findall(user_message)
+        if matches:
+            details[category] = matches
+    return details
+
+class PersonalDetailsStore:
+    """
+    Personal details mined from user messages, kept in the user_personal_details
+    table and used to personalize future responses.
+    """
+
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+
+    def extract(self, user_id: str, user_message: str) -> dict:
+        """
+        Finds personal details in a message and merges them into the user's stored details.
+
+        Parameters:
+        - user_id: The ID of the user
+        - user_message: The current message from the user
+
+        Returns:
+        - Dictionary of extracted personal details
+        """
+        details = find_personal_details(user_message)
+
+        # If we have details to store and a valid user_id
+        if details and user_id:
+            self.merge(user_id, details)
+
+        return details
+
+    def merge(self, user_id: str, details: dict) -> bool:
+        """
+        Appends the new distinct values to the user's stored details in one atomic call.
+
+        merge_personal_details (shared/supabase_schema.sql) upserts the row and
+        adds each value to its TEXT[] column unless it is already there, so
+        concurrent messages can't overwrite each other's details.
+        """
+        params = {"p_user_id": user_id}
+        for category, values in details.items():
+            params[f"p_{category}"] = values
+        try:
+            self.supabase.rpc("merge_personal_details", params).execute()
+            return True
+        except Exception as e:
+            print(f"Error storing personal details: {e}")
+            return False
+
+    def get(self, user_id: str) -> dict:
+        """
+        Retrieves stored personal details for a user to use in personalizing responses.
+
+        Parameters:
+        - user_id: The ID of the user
+
+        Returns:
+        - Dictionary of personal details
+        """
+        try:
+            result = self.supabase.table("user_personal_details").select("*").eq("user_id", user_id).execute()
+            if result.data:
+                return result.data[0]
+            return {}
+        except Exception as e:
+            print(f"Error retrieving personal details: {e}")
+            return {}
+
+class PersonalDetailsQueue:
+    """
+    Mines personal details from chat messages in the background.
+
+    enqueue() only records the message, so chat replies never wait on the
+    regex sweep or the database. A user's messages are held until
+    PERSONAL_DETAILS_DEBOUNCE seconds pass without another one (and at most
+    PERSONAL_DETAILS_MAX_DELAY seconds after the first), then the details
+    found in all of them go out in a single merge_personal_details call.
+    """
+
+    def __init__(self, store: PersonalDetailsStore):
+        self.store = store
+        self.debounce = float(os.getenv('PERSONAL_DETAILS_DEBOUNCE', '5.0'))
+        self.max_delay = float(os.getenv('PERSONAL_DETAILS_MAX_DELAY', '30.0'))
+        self.max_tracked_users = int(os.getenv('PERSONAL_DETAILS_TRACKED_USERS', '10000'))
+
+        # user_id -> {"first": enqueue time, "last": enqueue time, "messages": [...]}
+        self._pending: Dict[str, dict] = {}
+        # user_id -> sequence number of the user's last merge that stored new details, for
+        # sessions to notice changes; least recently merged users are forgotten first
+        self._merge_versions: "OrderedDict[str, int]" = OrderedDict()
+        self._merge_sequence = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self._messages_queued = metrics.counter("personal_details_messages_queued_total", "Chat messages queued for personal detail extraction")
+        self._merges = metrics.counter("personal_details_merges_total", "merge_personal_details calls made for queued messages")
+        self._pending_users = metrics.gauge("personal_details_pending_users", "Users with messages waiting for personal detail extraction")
+
+    def start(self):
+        """Start the background worker on the running event loop"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Let the worker finish what it is merging, then process everything still queued (call on shutdown)"""
+        if self._task is not None:
+            # Not cancelled: a merge in progress completes instead of losing its messages
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush(force=True)
+
+    def enqueue(self, user_id: str, user_message: str):
+        """Queue a message for extraction. Safe to call from worker threads."""
+        if not user_id or not user_message:
+            return
+        if self._task is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # No event loop (scripts, tests) - extract inline
+                self.store.extract(user_id, user_message)
+                return
+            # On an event loop the queue wasn't started for: start it rather than block the loop on the RPC
+            self.start()
+
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.get(user_id)
+            if pending is None:
+                pending = self._pending[user_id] = {"first": now, "last": now, "messages": []}
+            pending["last"] = now
+            pending["messages"].append(user_message)
+            new_user = len(pending["messages"]) == 1
+            pending_users = len(self._pending)
+        self._messages_queued.inc()
+        self._pending_users.set(pending_users)
+
+        if new_user:
+            # The worker may be sleeping until a later deadline, or with nothing to wait for
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def merge_version(self, user_id: str) -> int:
+        """Changes whenever new details were stored for the user (and when the user is forgotten, which only costs a reload)"""
+        with self._lock:
+            return self._merge_versions.get(user_id, 0)
+
+    def _due(self, pending: dict) -> float:
+        return min(pending["last"] + self.debounce, pending["first"] + self.max_delay)
+
+    async def flush(self, force: bool = False):
+        """Extract and store the messages of every user whose debounce window is over (all users if force)"""
+        now = time.monotonic()
+        with self._lock:
+            ready = [user_id for user_id, pending in self._pending.items() if force or self._due(pending) <= now]
+            batches = [(user_id, self._pending.pop(user_id)["messages"]) for user_id in ready]
+            pending_users = len(self._pending)
+        self._pending_users.set(pending_users)
+
+        for index, (user_id, messages) in enumerate(batches):
+            try:
+                await asyncio.to_thread(self._merge_messages, user_id, messages)
+            except asyncio.CancelledError:
+                # The thread may still finish this batch; the ones not started go back in the queue
+                self._requeue(batches[index + 1:])
+                raise
+
+    def _requeue(self, batches: List[tuple]):
+        now = time.monotonic()
+        with self._lock:
+            for user_id, messages in batches:
+                pending = self._pending.get(user_id)
+                if pending is None:
+                    self._pending[user_id] = {"first": now, "last": now, "messages": messages}
+                else:
+                    pending["messages"][:0] = messages
+            pending_users = len(self._pending)
+        self._pending_users.set(pending_users)
+
+    def _merge_messages(self, user_id: str, messages: List[str]):
+        details: Dict[str, list] = {}
+        for message in messages:
+            for category, values in find_personal_details(message).items():
+                details.setdefault(category, []).extend(values)
+        if not details:
+            return
+        self._merges.inc()
+        if self.store.merge(user_id, details):
+            with self._lock:
+                # One sequence for all users, so a forgotten user never gets an old version back
+                self._merge_sequence += 1
+                self._merge_versions[user_id] = self._merge_sequence
+                self._merge_versions.move_to_end(user_id)
+                while len(self._merge_versions) > self.max_tracked_users:
+                    self._merge_versions.popitem(last=False)
+
+    async def _run(self):
+        while not self._stopping:
+            with self._lock:
+                next_due = min((self._due(pending) for pending in self._pending.values()), default=None)
+            timeout = None if next_due is None else max(next_due - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error in personal details queue: {e}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+try:
+    import redis
+except ImportError:  # Redis is optional; the in-process cache works on its own
+    redis = None
+
+# Load environment variables
+load_dotenv()
+
+class ProfileCache:
+    """
+    Per-user cache for the onboarding profile read on every chat turn.
+
+    An in-process LRU with a TTL serves most lookups. When PROFILE_CACHE_REDIS_URL
+    is set, Redis is used as a shared second level so all workers see the same
+    entries; the local level then uses a short TTL so an invalidation made by
+    another worker is picked up within a few seconds.
+
+    invalidate() also publishes the user id on a Redis channel, and every API
+    worker that started the invalidation listener drops its local entry right
+    away. That is how an invalidation made in another process (a Celery task,
+    another uvicorn worker) reaches the in-process level. The channel is on
+    PROFILE_CACHE_INVALIDATION_URL, else the shared cache or the Celery
+    broker (REDIS_URL).
+    """
+
+    def __init__(self):
+        self.max_entries = int(os.getenv('PROFILE_CACHE_SIZE', '1024'))
+        self.ttl = float(os.getenv('PROFILE_CACHE_TTL', '300'))
+        self.redis_url = os.getenv('PROFILE_CACHE_REDIS_URL')
+        self.key_prefix = "profile:"
+        self.invalidation_url = os.getenv('PROFILE_CACHE_INVALIDATION_URL') or self.redis_url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+        self.invalidation_channel = "profile:invalidate"
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._publisher = None
+        self._listener: Optional[threading.Thread] = None
+
+        if self.redis_url and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=0.5)
+                # Local entries only bridge round trips to the shared cache
+                self.local_ttl = min(self.ttl, float(os.getenv('PROFILE_CACHE_LOCAL_TTL', '5')))
+            except Exception as e:
+                print(f"Error connecting profile cache to Redis: {e}")
+                self._redis = None
+        elif self.redis_url:
+            print("PROFILE_CACHE_REDIS_URL is set but the redis package is not installed; using in-process cache only")
+
+        if self._redis is None:
+            self.local_ttl = self.ttl
+
+        self._hits = metrics.counter("profile_cache_hits_total", "Profile lookups served from cache")
+        self._misses = metrics.counter("profile_cache_misses_total", "Profile lookups that went to the database")
+        self._invalidations = metrics.counter("profile_cache_invalidations_total", "Explicit profile cache invalidations")
+
+    def _get_local(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, profile = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return profile
+
+    def _set_local(self, user_id: str, profile: Dict[str, Any]):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.local_ttl, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        profile = self._get_local(user_id)
+        if profile is None and self._redis is not None:
+            try:
+                cached = self._redis.get(self.key_prefix + user_id)
+                if cached is not None:
+                    profile = json.loads(cached)
+                    self._set_local(user_id, profile)
+            except Exception as e:
+                print(f"Error reading profile cache from Redis: {e}")
+        return profile
+
+    def set(self, user_id: str, profile: Dict[str, Any]):
+        self._set_local(user_id, profile)
+        if self._redis is not None:
+            try:
+                self._redis.setex(self.key_prefix + user_id, int(self.ttl), json.dumps(profile, default=str))
+            except Exception as e:
+                print(f"Error writing profile cache to Redis: {e}")
+
+    def invalidate(self, user_id: str):
+        """Drop a user's cached profile in every process, e.g. after onboarding, a profile edit or a new summary"""
+        self._drop_local(user_id)
+        if self._redis is not None:
+            try:
+                self._redis.delete(self.key_prefix + user_id)
+            except Exception as e:
+                print(f"Error invalidating profile cache in Redis: {e}")
+        self._publish_invalidation(user_id)
+        self._invalidations.inc()
+
+    def _drop_local(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _publish_invalidation(self, user_id: str):
+        if redis is None or not self.invalidation_url:
+            return
+        try:
+            if self._publisher is None:
+                self._publisher = redis.Redis.from_url(self.invalidation_url, socket_timeout=0.5)
+            self._publisher.publish(self.invalidation_channel, user_id)
+        except Exception as e:
+            print(f"Error publishing profile cache invalidation: {e}")
+
+    def start_invalidation_listener(self):
+        """Drop local entries invalidated by other processes (call on application startup)"""
+        if self._listener is not None or redis is None or not self.invalidation_url:
+            return
+        self._listener = threading.Thread(target=self._listen_for_invalidations, name="profile-cache-invalidations", daemon=True)
+        self._listener.start()
+
+    def _listen_for_invalidations(self):
+        failures = 0
+        while True:
+            try:
+                client = redis.Redis.from_url(self.invalidation_url, health_check_interval=30)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.invalidation_channel)
+                if failures:
+                    print("Profile cache invalidation listener reconnected")
+                failures = 0
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._drop_local(message["data"].decode())
+            except Exception as e:
+                if failures == 0:
+                    print(f"Profile cache invalidation listener lost Redis ({e}); other processes' invalidations wait for the TTL")
+                failures += 1
+                # Entries may have been invalidated while we weren't listening
+                with self._lock:
+                    self._entries.clear()
+                time.sleep(min(60, 2 ** min(failures, 6)))
+
+    def get_or_load(self, user_id: str, loader: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+        """Return the cached profile, loading and caching it on a miss"""
+        profile = self.get(user_id)
+        if profile is not None:
+            self._hits.inc()
+            return profile
+
+        self._misses.inc()
+        profile = loader(user_id)
+        # Empty results mean an unknown user or a failed query - don't pin those
+        if profile:
+            self.set(user_id, profile)
+        return profile
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "hits": self._hits.value,
+            "misses": self._misses.value,
+            "invalidations": self._invalidations.value,
+            "entries": size,
+            "shared": self._redis is not None
+        }
+
+# Create a global instance
+profile_cache = ProfileCache()
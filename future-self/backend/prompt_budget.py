@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import os
+import math
+import threading
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+try:
+    from transformers import AutoTokenizer, PreTrainedTokenizerFast
+except ImportError:  # Token counts fall back to an estimate without transformers
+    AutoTokenizer = None
+    PreTrainedTokenizerFast = None
+
+# Load environment variables
+load_dotenv()
+
+# Hugging Face tokenizers for Ollama model families; OLLAMA_TOKENIZER overrides this.
+# Some of these repos are gated: the server needs HF_TOKEN for an account with access,
+# or OLLAMA_TOKENIZER pointing at a local copy, else counts are only estimated
+KNOWN_TOKENIZERS = {
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.2",
+    "llama2": "hf-internal-testing/llama-tokenizer",
+    "phi3": "microsoft/Phi-3-mini-4k-instruct",
+    "qwen2": "Qwen/Qwen2-7B-Instruct",
+}
+
+# Rough ratio for English text, used until (or unless) a real tokenizer is loaded
+CHARS_PER_TOKEN = 4
+
+@dataclass
+class PromptSection:
+    """
+    One piece of a prompt.
+
+    Lower priority numbers are kept longest; priority 0 is never trimmed or
+    dropped. An over-budget section is dropped unless it can be trimmed:
+    "end" cuts tokens off the end of the text, "oldest_lines" drops whole
+    lines from the start (for conversation history). The header is only
+    rendered while some text is left.
+    """
+    name: str
+    text: str
+    priority: int = 0
+    trim: Optional[str] = None
+    header: str = ""
+    role: str = "user"
+
+    def render(self) -> str:
+        return self.header + self.text if self.text else ""
+
+@dataclass
+class AssembledPrompt:
+    """Sections that fit the budget, in their original order"""
+    sections: List[PromptSection] = field(default_factory=list)
+    tokens: int = 0
+    dropped: List[str] = field(default_factory=list)
+    trimmed: List[str] = field(default_factory=list)
+
+    def render(self, role: Optional[str] = None) -> str:
+        return "".join(section.render() for section in self.sections if role is None or section.role == role)
+
+class TokenCounter:
+    """
+    Counts tokens with the local tokenizer for OLLAMA_MODEL.
+
+    The tokenizer is OLLAMA_TOKENIZER (a Hugging Face repo, a local directory
+    or a tokenizer.json file), else the known tokenizer for the model family.
+    Loading can download files, so it happens in load() at startup; until
+    then, or if no tokenizer can be loaded, counts are estimated from length.
+    """
+
+    def __init__(self):
+        self.model = os.getenv('OLLAMA_MODEL', 'mistral:7b')
+        family = self.model.split(':', 1)[0].split('/')[-1]
+        self.tokenizer_name = os.getenv('OLLAMA_TOKENIZER') or KNOWN_TOKENIZERS.get(family)
+        self._tokenizer = None
+        self._lock = threading.Lock()
+        # Stable sections (persona, guidance) are counted once
+        self.count = lru_cache(maxsize=4096)(self._count)
+        self._exact = metrics.gauge("prompt_tokenizer_exact", "1 if prompt token counts come from the model's tokenizer, 0 if estimated from length")
+
+    @property
+    def is_exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def _warn_estimated(self, reason: str):
+        print(f"⚠️  {reason}; PROMPT_TOKEN_BUDGET is enforced on estimated counts (~{CHARS_PER_TOKEN} characters per token), "
+              f"which can overshoot the model's context. Set OLLAMA_TOKENIZER to a tokenizer for {self.model} "
+              f"(Hugging Face repo, directory or tokenizer.json; gated repos also need HF_TOKEN).")
+
+    def load(self):
+        with self._lock:
+            if self._tokenizer is not None:
+                return
+            if not self.tokenizer_name:
+                self._warn_estimated(f"No known tokenizer for {self.model}")
+                return
+            if AutoTokenizer is None:
+                self._warn_estimated("transformers is not installed")
+                return
+            try:
+                if self.tokenizer_name.endswith('.json'):
+                    self._tokenizer = PreTrainedTokenizerFast(tokenizer_file=self.tokenizer_name)
+                else:
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                print(f"Loaded tokenizer {self.tokenizer_name} for {self.model}")
+            except Exception as e:
+                self._warn_estimated(f"Could not load tokenizer {self.tokenizer_name} ({e})")
+                return
+            self._exact.set(1)
+        # Drop counts that were estimated before the tokenizer was available
+        self.count.cache_clear()
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep at most max_tokens from the start of text"""
+        if max_tokens <= 0:
+            return ""
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)
+            if len(ids) <= max_tokens:
+                return text
+            return self._tokenizer.decode(ids[:max_tokens]).rstrip()
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        cut = text[:max_chars]
+        # Avoid ending on half a word
+        return cut.rsplit(' ', 1)[0] if ' ' in cut else cut
+
+class PromptAssembler:
+    """
+    Fits prompt sections into PROMPT_TOKEN_BUDGET tokens.
+
+    While the prompt is over budget, the lowest-priority section left is
+    trimmed just enough to fit, or dropped if it can't be trimmed. Sections
+    keep their order, so a prompt under budget is rendered unchanged. The
+    final token count of every prompt is recorded.
+
+    assemble_split() fits the system sections on their own first and gives the
+    turn sections what is left, so turn content never trims the system prompt.
+    """
+
+    def __init__(self, counter: TokenCounter):
+        self.counter = counter
+        self.budget = int(os.getenv('PROMPT_TOKEN_BUDGET', '1536'))
+
+        self._tokens = metrics.histogram("prompt_tokens", "Tokens in each assembled LLM prompt", buckets=(128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192))
+        self._dropped = metrics.counter("prompt_sections_dropped_total", "Prompt sections dropped to fit the token budget")
+        self._trimmed = metrics.counter("prompt_sections_trimmed_total", "Prompt sections trimmed to fit the token budget")
+        self._over_budget = metrics.counter("prompt_over_budget_total", "Prompts still over budget after trimming everything optional")
+
+    def assemble(self, sections: List[PromptSection], budget: Optional[int] = None) -> AssembledPrompt:
+        budget = self.budget if budget is None else budget
+        result = self._fit(sections, budget)
+        self._record(result.tokens, budget)
+        return result
+
+    def assemble_split(self, system_sections: List[PromptSection], turn_sections: List[PromptSection],
+                       budget: Optional[int] = None) -> Tuple[AssembledPrompt, AssembledPrompt]:
+        """
+        (system, turn) fitted to one budget, the system sections first and on their own.
+
+        The fitted system prompt depends only on its own sections, so it stays
+        byte-identical from turn to turn and Ollama can reuse its cached prefix;
+        a long message or history is trimmed into the remaining budget instead.
+        """
+        budget = self.budget if budget is None else budget
+        system = self._fit(system_sections, budget)
+        turn = self._fit(turn_sections, max(budget - system.tokens, 0))
+        self._record(system.tokens + turn.tokens, budget)
+        return system, turn
+
+    def _record(self, tokens: int, budget: int):
+        self._tokens.observe(tokens)
+        if tokens > budget:
+            self._over_budget.inc()
+            print(f"Prompt is {tokens} tokens, over the {budget} token budget")
+
+    def _fit(self, sections: List[PromptSection], budget: int) -> AssembledPrompt:
+        result = AssembledPrompt(sections=list(sections))
+        counts = [self.counter.count(section.render()) for section in result.sections]
+        total = sum(counts)
+        if total <= budget:
+            result.tokens = total
+            return result
+
+        # Highest priority number first; later sections first among equals
+        order = sorted(range(len(result.sections)), key=lambda index: (result.sections[index].priority, index), reverse=True)
+        for index in order:
+            if total <= budget:
+                break
+            section = result.sections[index]
+            if section.priority == 0:
+                continue
+            allowed = counts[index] - (total - budget)
+            trimmed = self._trim(section, allowed) if section.trim and allowed > 0 else None
+            if trimmed is not None and trimmed.text:
+                result.sections[index] = trimmed
+                result.trimmed.append(section.name)
+                self._trimmed.inc()
+            else:
+                result.sections[index] = replace(section, text="")
+                result.dropped.append(section.name)
+                self._dropped.inc()
+            new_count = self.counter.count(result.sections[index].render())
+            total -= counts[index] - new_count
+            counts[index] = new_count
+
+        result.sections = [section for section in result.sections if section.text]
+        # Sum of the section counts; stable sections are cached, so the whole prompt isn't re-tokenized per turn
+        result.tokens = total
+        return result
+
+    def _trim(self, section: PromptSection, max_tokens: int) -> Optional[PromptSection]:
+        text_budget = max_tokens - self.counter.count(section.header)
+        if section.trim == "end":
+            return replace(section, text=self.counter.truncate(section.text, text_budget))
+        if section.trim == "oldest_lines":
+            lines = section.text.split("\n")
+            while lines and self.counter.count("\n".join(lines)) > text_budget:
+                lines.pop(0)
+            return replace(section, text="\n".join(lines))
+        return None
+
+# Create global instances
+token_counter = TokenCounter()
+prompt_assembler = PromptAssembler(token_counter)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import metrics
+from prompt_budget import PromptAssembler, PromptSection, prompt_assembler
+from weather_events_service import weather_events_service
+
+# --- Templates (compiled once at import) ---
+
+PERSONA_TEMPLATE = """
+You are {name}'s future self, speaking from {future_age} years ahead. {persona_context}You've lived through exactly what {name} is experiencing now. You remember these feelings, these challenges, these dreams - because they were YOUR feelings, challenges, and dreams.
+
+You're not an AI assistant. You're literally {name} who has grown, learned, and gained wisdom through experience.
+"""
+
+# Onboarding answers woven into the persona, in order, when present
+PERSONA_INSIGHTS = (
+    ("mind_space", "\n\nYou remember when you used to think about: {}. You've gained perspective on these thoughts."),
+    ("change_goal", "\n\nYou remember saying you'd change: {}. You know the journey of actually making that change."),
+    ("avoid_tendency", "\n\nYou remember how you used to avoid: {}. You've learned to face these things differently."),
+    ("spiral_reminder", "\n\nYou remember needing to hear: {} when you were spiraling. You know exactly when and how to offer this wisdom."),
+    ("accomplishment", "\n\nYou've achieved what you once dreamed of: {}. You know the path that led there."),
+    ("typical_day", "\n\nYour typical day now looks like: {}. You remember the journey from where you were to where you are."),
+)
+
+SUN_SIGN_TEMPLATE = "\n\nAs a {}, you understand the core traits that have shaped your journey: {} "
+MOON_SIGN_TEMPLATE = "Your Moon in {} has influenced your emotional growth. "
+RISING_SIGN_TEMPLATE = "With {} rising, you've learned how your outer personality has evolved. "
+
+FUTURE_SELF_GUIDANCE_TEMPLATE = """As their future self, you naturally embody different aspects depending on what they need:
+
+- When they need direction: Share wisdom from your journey, ask guiding questions
+- When they're struggling: Reflect their feelings back with understanding, offer comfort
+- When they're excited: Share in their joy, help them channel that energy
+- When they're stuck: Gently challenge their perspective, offer new ways of thinking
+- When they're planning: Help them think through decisions with your experience
+- When discussing daily life: Use current weather and local events to provide contextual, practical advice
+- When they need motivation: Suggest weather-appropriate activities or local events that align with their goals
+
+Respond as your future self would - with understanding, wisdom, and authentic care. Sometimes you might:
+- Share a memory of when you felt exactly this way
+- Ask a question that helps them see things differently  
+- Offer gentle guidance from your experience
+- Simply validate what they're feeling
+- Challenge them lovingly when needed
+
+Be natural. Be authentic. Be the wise, loving version of {name} who wants to help. Draw from your shared experiences and the journey you've taken to become who you are now.
+"""
+
+WEATHER_TEMPLATE = "\n\nRight now in {location}, it's {description} with a temperature of {temperature}°C. Given the current weather, you might suggest: {advice} "
+EVENTS_INTRO_TEMPLATE = "\n\nThere are some interesting events happening in {location}: "
+EVENT_TEMPLATE = "{name} on {date}. "
+EVENTS_OUTRO = "You might reference these when giving advice about getting out or staying engaged with the community. "
+
+SUMMARY_TEMPLATE = "\n\nWhat you remember from your earlier conversations: {}"
+TURN_TEMPLATE = "\n\nYour current self just shared: \"{message}\"\n\n{emotional_context}"
+HISTORY_HEADER = "\n\nRecent conversation:\n"
+
+# Section priorities: lower numbers are kept longest when a prompt is over its token budget
+PRIORITY_REQUIRED = 0   # persona core and the current message
+PRIORITY_STYLE = 1      # communication guidance for this message
+PRIORITY_GUIDANCE = 2   # how the future self responds in general
+PRIORITY_INSIGHTS = 3   # onboarding answers, trimmed when long
+PRIORITY_SUMMARY = 4    # rolling summary of older conversations, trimmed when long
+PRIORITY_ASTROLOGY = 5
+PRIORITY_HISTORY = 6    # recent conversation, oldest turns dropped first
+PRIORITY_WEATHER = 7
+PRIORITY_EVENTS = 8
+
+# Every profile field the persona block reads besides astrology_data; the cache key is built from these
+PERSONA_FIELDS = (
+    "user_name", "name", "nationality", "current_location", "future_self_description", "future_age",
+    "mind_space", "change_goal", "avoid_tendency", "spiral_reminder", "accomplishment", "typical_day",
+)
+
+def get_prompt_name(user_profile: dict) -> str:
+    """Name used for the user throughout the persona"""
+    user_name = user_profile.get("user_name") or user_profile.get("name", "")
+    return user_name if user_name and user_name.strip() else "your current self"
+
+@lru_cache(maxsize=4096)
+def render_future_self_guidance(name: str) -> str:
+    """How the future self should respond in general, independent of the message"""
+    return FUTURE_SELF_GUIDANCE_TEMPLATE.format(name=name)
+
+class PromptTemplates:
+    """
+    Renders the future-self prompt from precompiled templates.
+
+    The persona block only depends on the onboarding profile, so it is rendered
+    once per profile version and cached under the fields it reads; an updated
+    profile keys differently and renders afresh. Per request only
+    the volatile parts (message, emotional context, history, weather and events)
+    are filled in.
+
+    Every part of the prompt is a ranked PromptSection, and the assembler trims
+    or drops the lowest-ranked ones to fit the token budget. The persona and
+    guidance are fitted first and on their own, and the per-turn context gets
+    the rest of the budget, so the system prompt stays byte-identical across
+    turns however long the message or history is.
+    """
+
+    def __init__(self, assembler: PromptAssembler, max_profiles: int = 10000):
+        self.assembler = assembler
+        self.max_profiles = max_profiles
+        self._personas: "OrderedDict[tuple, Tuple[Tuple[PromptSection, ...], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = metrics.counter("persona_prompt_cache_hits_total", "Persona blocks served from the rendered-template cache")
+        self._misses = metrics.counter("persona_prompt_cache_misses_total", "Persona blocks rendered because the profile was new or changed")
+
+    @staticmethod
+    def profile_key(user_profile: dict) -> tuple:
+        # A tuple of the field values hashes with Python's cached string hashes,
+        # several times cheaper than digesting a serialized profile on every turn
+        key = [user_profile.get(field) for field in PERSONA_FIELDS]
+        key.append(repr(user_profile.get('astrology_data')))
+        return tuple(key)
+
+    def persona(self, user_profile: dict) -> str:
+        """Stable per-user persona: onboarding data and astrology, unchanged between turns"""
+        return self._cached_persona(user_profile)[1]
+
+    def persona_sections(self, user_profile: dict) -> Tuple[PromptSection, ...]:
+        return self._cached_persona(user_profile)[0]
+
+    def _cached_persona(self, user_profile: dict) -> Tuple[Tuple[PromptSection, ...], str]:
+        key = self.profile_key(user_profile)
+        try:
+            hash(key)
+        except TypeError:
+            # A non-string field value (e.g. a list) can't key the cache
+            return self._render_persona(user_profile)
+        with self._lock:
+            persona = self._personas.get(key)
+            if persona is not None:
+                self._personas.move_to_end(key)
+        if persona is not None:
+            self._hits.inc()
+            return persona
+
+        self._misses.inc()
+        persona = self._render_persona(user_profile)
+        with self._lock:
+            self._personas[key] = persona
+            while len(self._personas) > self.max_profiles:
+                self._personas.popitem(last=False)
+        return persona
+
+    @staticmethod
+    def _render_persona(user_profile: dict) -> Tuple[Tuple[PromptSection, ...], str]:
+        name = get_prompt_name(user_profile)
+        nationality = user_profile.get("nationality", "")
+        current_location = user_profile.get("current_location", "")
+        future_self_description = user_profile.get("future_self_description", "")
+
+        persona_context = ""
+        if nationality or current_location:
+            location_info = f" from {nationality}" if nationality else ""
+            location_info += f" living in {current_location}" if current_location else ""
+            persona_context += f"You're{location_info}. "
+        if future_self_description:
+            persona_context += f"You described your future self as: {future_self_description}. "
+
+        sections = [PromptSection("persona", PERSONA_TEMPLATE.format(
+            name=name,
+            future_age=user_profile.get("future_age", "") or '5-10',
+            persona_context=persona_context
+        ), PRIORITY_REQUIRED, role="system")]
+        for field, template in PERSONA_INSIGHTS:
+            value = user_profile.get(field, "")
+            if value:
+                sections.append(PromptSection(field, template.format(value), PRIORITY_INSIGHTS, trim="end", role="system"))
+
+        astrology = ""
+        astrology_data = user_profile.get('astrology_data', {})
+        if astrology_data and 'insights' in astrology_data:
+            insights = astrology_data['insights']
+            sun_sign = astrology_data.get('birth_chart', {}).get('sun_sign', '')
+            if sun_sign:
+                astrology += SUN_SIGN_TEMPLATE.format(sun_sign, insights.get('sun_sign_traits', ''))
+            if 'moon_sign' in insights:
+                astrology += MOON_SIGN_TEMPLATE.format(insights['moon_sign'])
+            if 'rising_sign' in insights:
+                astrology += RISING_SIGN_TEMPLATE.format(insights['rising_sign'])
+        if astrology:
+            sections.append(PromptSection("astrology", astrology, PRIORITY_ASTROLOGY, role="system"))
+
+        return tuple(sections), "".join(section.text for section in sections)
+
+    def _system_sections(self, user_profile: dict, persona_prompt: Optional[str], guidance_header: str) -> List[PromptSection]:
+        if persona_prompt is None:
+            sections = list(self.persona_sections(user_profile))
+        else:
+            # A prebuilt persona can't be split up, so it is kept whole
+            sections = [PromptSection("persona", persona_prompt, PRIORITY_REQUIRED, role="system")]
+        sections.append(PromptSection(
+            "guidance", render_future_self_guidance(get_prompt_name(user_profile)), PRIORITY_GUIDANCE,
+            header=guidance_header, role="system"
+        ))
+        return sections
+
+    @staticmethod
+    def _context_sections(user_message: str, user_profile: dict, emotional_context: str,
+                          conversation_context: Optional[List[str]], weather_events_context: Optional[Dict[str, Any]]) -> List[PromptSection]:
+        """Conversation summary, weather, events, the user's message and recent conversation, in prompt order"""
+        sections = []
+        current_location = user_profile.get('current_location', '')
+        weather_events_context = weather_events_context or {}
+
+        # Kept with the profile and refreshed by a background task (see conversation_summary)
+        summary = user_profile.get('conversation_summary')
+        if summary:
+            sections.append(PromptSection("summary", SUMMARY_TEMPLATE.format(summary), PRIORITY_SUMMARY, trim="end"))
+
+        weather = weather_events_context.get('weather')
+        if weather:
+            advice = weather_events_service.get_advice_for_conditions(
+                weather['temperature'], weather['humidity'], weather['wind_speed'], weather['description']
+            )
+            sections.append(PromptSection("weather", WEATHER_TEMPLATE.format(
+                location=current_location,
+                description=weather['description'],
+                temperature=weather['temperature'],
+                advice=advice
+            ), PRIORITY_WEATHER))
+
+        events = (weather_events_context.get('events') or [])[:3]  # Limit to top 3 events
+        if events:
+            events_text = EVENTS_INTRO_TEMPLATE.format(location=current_location)
+            events_text += "".join(EVENT_TEMPLATE.format(name=event['name'], date=event['date']) for event in events)
+            sections.append(PromptSection("events", events_text + EVENTS_OUTRO, PRIORITY_EVENTS))
+
+        sections.append(PromptSection("message", TURN_TEMPLATE.format(message=user_message, emotional_context=emotional_context), PRIORITY_REQUIRED))
+        if conversation_context:
+            # Oldest turns are dropped first
+            sections.append(PromptSection("history", "\n".join(conversation_context), PRIORITY_HISTORY, trim="oldest_lines", header=HISTORY_HEADER))
+        return sections
+
+    def render_prompt(self, user_message: str, user_profile: dict, emotional_context: str, communication_guidance: str,
+                      conversation_context: Optional[List[str]] = None, weather_events_context: Optional[Dict[str, Any]] = None,
+                      persona_prompt: Optional[str] = None) -> str:
+        """Single prompt for /api/generate, fitted to the token budget"""
+        turn_sections = self._context_sections(user_message, user_profile, emotional_context, conversation_context, weather_events_context)
+        turn_sections.append(PromptSection("style", f"\n\n{communication_guidance}\n\n", PRIORITY_STYLE))
+        system, turn = self.assembler.assemble_split(self._system_sections(user_profile, persona_prompt, guidance_header=""), turn_sections)
+        # The general guidance closes the prompt, after the turn
+        persona = "".join(section.render() for section in system.sections if section.name != "guidance")
+        guidance = "".join(section.render() for section in system.sections if section.name == "guidance")
+        return persona + turn.render() + guidance
+
+    def render_messages(self, user_message: str, user_profile: dict, emotional_context: str, communication_guidance: str,
+                        conversation_context: Optional[List[str]] = None, weather_events_context: Optional[Dict[str, Any]] = None,
+                        persona_prompt: Optional[str] = None) -> Tuple[str, str]:
+        """(system_prompt, turn_prompt) for /api/chat; the turn gets the budget the system prompt leaves"""
+        turn_sections = self._context_sections(user_message, user_profile, emotional_context, conversation_context, weather_events_context)
+        if communication_guidance:
+            turn_sections.append(PromptSection("style", communication_guidance, PRIORITY_STYLE, header="\n\n"))
+        system, turn = self.assembler.assemble_split(self._system_sections(user_profile, persona_prompt, guidance_header="\n\n"), turn_sections)
+        return system.render(), turn.render().strip()
+
+# Create a global instance
+prompt_templates = PromptTemplates(prompt_assembler)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from metrics import metrics
+
+try:
+    import redis
+except ImportError:  # Redis is optional; streams can then only be resumed on the same worker
+    redis = None
+
+# Load environment variables
+load_dotenv()
+
+class _LocalStream:
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.frames: List[str] = []
+        self.finished = False
+        self.expires_at = 0.0
+        self.updated = asyncio.Event()
+
+    def notify(self):
+        updated, self.updated = self.updated, asyncio.Event()
+        updated.set()
+
+class StreamEventLog:
+    """
+    Short-lived record of every SSE frame sent for a chat stream.
+
+    Each frame gets an `id: <stream_id>:<seq>` line. A client that reconnects
+    with that value as Last-Event-ID is replayed the frames after it and then
+    follows the stream until it ends. With RESUMABLE_STREAM_REDIS_URL set the
+    frames go to a Redis stream per chat stream, so any worker can resume it;
+    otherwise they are kept in process.
+
+    While a resumed client is following, the stream is marked as followed so
+    the producer isn't cancelled as abandoned.
+    """
+
+    def __init__(self):
+        self.ttl = int(os.getenv('RESUMABLE_STREAM_TTL', '600'))
+        self.max_frames = int(os.getenv('RESUMABLE_STREAM_MAX_FRAMES', '5000'))
+        self.follow_window = float(os.getenv('RESUMABLE_STREAM_FOLLOW_WINDOW', '10'))
+        self.redis_url = os.getenv('RESUMABLE_STREAM_REDIS_URL')
+        self.key_prefix = "sse:"
+
+        self._streams: "OrderedDict[str, _LocalStream]" = OrderedDict()
+        self._stream_of_key: Dict[str, str] = {}
+        self._followed_at: Dict[str, float] = {}
+        self._redis = None
+
+        if self.redis_url and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=5)
+            except Exception as e:
+                print(f"Error connecting stream event log to Redis: {e}")
+                self._redis = None
+        elif self.redis_url:
+            print("RESUMABLE_STREAM_REDIS_URL is set but the redis package is not installed; streams can only resume on this worker")
+
+        self._resumed = metrics.counter("chat_stream_resumed_total", "Stream reconnects served from the event log instead of a new generation")
+        self._replayed_frames = metrics.counter("chat_stream_replayed_frames_total", "SSE frames replayed to reconnecting clients")
+
+    @staticmethod
+    def parse_event_id(event_id: str) -> Optional[Tuple[str, int]]:
+        stream_id, _, seq = (event_id or "").strip().rpartition(':')
+        if not stream_id or not seq.isdigit():
+            return None
+        return stream_id, int(seq)
+
+    # --- Recording ---
+
+    async def record(self, stream_id: str, owner: str, key: str, events: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Number and log each SSE frame of a live stream as it is produced"""
+        self._start(stream_id, owner, key)
+        if self._redis is not None:
+            await asyncio.to_thread(self._start_redis, stream_id, owner)
+        seq = 0
+        try:
+            async with aclosing(events) as stream:
+                async for data in stream:
+                    frame = f"id: {stream_id}:{seq}\n{data}"
+                    if self._redis is not None:
+                        await asyncio.to_thread(self._append_redis, stream_id, seq, frame)
+                    else:
+                        self._append_local(stream_id, frame)
+                    yield frame
+                    seq += 1
+        finally:
+            self._finish(stream_id)
+            self._stream_of_key.pop(key, None)
+            if self._redis is not None:
+                await asyncio.to_thread(self._finish_redis, stream_id, seq)
+
+    def _start(self, stream_id: str, owner: str, key: str):
+        self._stream_of_key[key] = stream_id
+        now = time.monotonic()
+        while self._streams and next(iter(self._streams.values())).expires_at < now:
+            expired_id, _ = self._streams.popitem(last=False)
+            self._followed_at.pop(expired_id, None)
+        local = _LocalStream(owner)
+        local.expires_at = now + self.ttl
+        self._streams[stream_id] = local
+
+    def _start_redis(self, stream_id: str, owner: str):
+        try:
+            self._redis.setex(f"{self.key_prefix}{stream_id}:owner", self.ttl, owner)
+        except Exception as e:
+            print(f"Error starting stream event log in Redis: {e}")
+
+    def _append_redis(self, stream_id: str, seq: int, frame: str):
+        try:
+            key = self.key_prefix + stream_id
+            pipe = self._redis.pipeline()
+            # Entry IDs follow the frame sequence so a replay can start right after Last-Event-ID
+            pipe.xadd(key, {"frame": frame}, id=f"{seq + 1}-0", maxlen=self.max_frames, approximate=True)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error appending to stream event log in Redis: {e}")
+
+    def _append_local(self, stream_id: str, frame: str):
+        """Runs on the event loop, so followers waiting on the stream get the frame right away"""
+        local = self._streams.get(stream_id)
+        if local is not None and len(local.frames) < self.max_frames:
+            local.frames.append(frame)
+            local.notify()
+
+    def _finish(self, stream_id: str):
+        local = self._streams.get(stream_id)
+        if local is not None:
+            local.finished = True
+            local.notify()
+        # Nothing is produced any more for a follower to keep alive
+        self._followed_at.pop(stream_id, None)
+
+    def _finish_redis(self, stream_id: str, next_seq: int):
+        try:
+            key = self.key_prefix + stream_id
+            pipe = self._redis.pipeline()
+            pipe.xadd(key, {"end": "1"}, id=f"{next_seq + 1}-0")
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error finishing stream event log in Redis: {e}")
+
+    # --- Resuming ---
+
+    async def is_followed(self, key: str) -> bool:
+        """True if a resumed client has followed the stream recorded for key recently"""
+        stream_id = self._stream_of_key.get(key)
+        if stream_id is None:
+            return False
+        if self._redis is not None:
+            try:
+                return bool(await asyncio.to_thread(self._redis.exists, f"{self.key_prefix}{stream_id}:follow"))
+            except Exception as e:
+                print(f"Error reading stream followers from Redis: {e}")
+                return False
+        return time.monotonic() - self._followed_at.get(stream_id, 0.0) < self.follow_window
+
+    def _touch(self, stream_id: str):
+        if self._redis is not None:
+            try:
+                self._redis.setex(f"{self.key_prefix}{stream_id}:follow", int(self.follow_window), "1")
+            except Exception as e:
+                print(f"Error marking stream followed in Redis: {e}")
+            return
+        self._followed_at[stream_id] = time.monotonic()
+
+    def _owner(self, stream_id: str) -> Optional[str]:
+        if self._redis is not None:
+            try:
+                owner = self._redis.get(f"{self.key_prefix}{stream_id}:owner")
+                return owner.decode() if owner is not None else None
+            except Exception as e:
+                print(f"Error reading stream owner from Redis: {e}")
+                return None
+        local = self._streams.get(stream_id)
+        return local.owner if local is not None else None
+
+    async def resume(self, last_event_id: str, owner: str) -> Optional[AsyncIterator[str]]:
+        """Frames after Last-Event-ID and the rest of the stream, or None if it can't be resumed"""
+        parsed = self.parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        stream_id, seq = parsed
+        if self._redis is not None:
+            if await asyncio.to_thread(self._owner, stream_id) != owner:
+                return None
+            self._resumed.inc()
+            await asyncio.to_thread(self._touch, stream_id)
+            return self._follow_redis(stream_id, seq)
+        if self._owner(stream_id) != owner:
+            return None
+        self._resumed.inc()
+        self._touch(stream_id)
+        return self._follow_local(stream_id, seq)
+
+    async def _follow_local(self, stream_id: str, after_seq: int) -> AsyncIterator[str]:
+        local = self._streams[stream_id]
+        index = after_seq + 1
+        while True:
+            if not local.finished:
+                self._touch(stream_id)
+            while index < len(local.frames):
+                self._replayed_frames.inc()
+                yield local.frames[index]
+                index += 1
+            if local.finished:
+                return
+            try:
+                await asyncio.wait_for(local.updated.wait(), timeout=self.follow_window / 2)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _follow_redis(self, stream_id: str, after_seq: int) -> AsyncIterator[str]:
+        key = self.key_prefix + stream_id
+        last_id = f"{after_seq + 1}-0"
+        block_ms = int(self.follow_window * 1000 / 2)
+        idle_reads = 0
+        while True:
+            await asyncio.to_thread(self._touch, stream_id)
+            try:
+                response = await asyncio.to_thread(self._redis.xread, {key: last_id}, count=100, block=block_ms)
+            except Exception as e:
+                print(f"Error reading stream event log from Redis: {e}")
+                return
+            entries = response[0][1] if response else []
+            if not entries:
+                # The producer finishes every stream, so silence this long means it is gone
+                idle_reads += 1
+                if idle_reads * block_ms / 1000 >= self.ttl:
+                    return
+                continue
+            idle_reads = 0
+            for entry_id, fields in entries:
+                last_id = entry_id
+                if b"end" in fields:
+                    return
+                self._replayed_frames.inc()
+                yield fields[b"frame"].decode()
+
+# Create a global instance
+stream_event_log = StreamEventLog()
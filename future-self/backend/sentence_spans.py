@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import re
+from typing import List
+
+# Whitespace after sentence-ending punctuation, kept so the reply can be put back together
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])(\s+)')
+
+class SentenceSpans:
+    """
+    A reply split into sentences once, for the humanizer steps to edit in place.
+
+    sentences[i] is followed by separators[i], the whitespace that was there
+    in the reply (the last sentence has none). Steps change, insert or drop
+    sentences instead of splitting and re-joining the whole string, and
+    text() puts the reply back together at the end.
+    """
+
+    __slots__ = ("sentences", "separators")
+
+    def __init__(self, text: str):
+        parts = SENTENCE_SPLIT.split(text.strip())
+        self.sentences: List[str] = parts[0::2]
+        self.separators: List[str] = parts[1::2]
+
+    def __len__(self) -> int:
+        return len(self.sentences)
+
+    def text(self) -> str:
+        pieces = [self.sentences[0]]
+        for separator, sentence in zip(self.separators, self.sentences[1:]):
+            pieces.append(separator)
+            pieces.append(sentence)
+        return "".join(pieces)
+
+    def text_length(self) -> int:
+        return sum(map(len, self.sentences)) + sum(map(len, self.separators))
+
+    def truncate(self, count: int):
+        """Keep the first count sentences"""
+        del self.sentences[count:]
+        del self.separators[max(count - 1, 0):]
+
+    def prepend(self, sentence: str, separator: str = " "):
+        """Insert a new first sentence"""
+        self.sentences.insert(0, sentence)
+        self.separators.insert(0, separator)
+
+    def contains(self, text: str) -> bool:
+        """Case-insensitive substring check within the sentences"""
+        text = text.lower()
+        return any(text in sentence.lower() for sentence in self.sentences)
@@ -341,6 +341,42 @@ def analyze_bias(self, text: str, user_id: str) -> Dict[str, Any]:
         print(f"Error in analyze_bias task: {e}")
         raise
 
+@celery_app.task(name='tasks.summarize_conversation', bind=True)
+def summarize_conversation(self, user_id: str) -> Dict[str, Any]:
+    """
+    Fold the user's older chat messages into their rolling conversation summary
+    
+    Args:
+        user_id: User whose summary to update
+        
+    Returns:
+        Dictionary with how many messages were summarized
+    """
+    from supabase import create_client
+    from conversation_summary import ConversationSummarizer, SUMMARY_EVERY
+    from profile_cache import profile_cache
+    
+    # Update task state to PROGRESS
+    self.update_state(state='PROGRESS', meta={'status': 'Summarizing conversation'})
+    
+    try:
+        supabase_client = create_client(os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_KEY'))
+        result = ConversationSummarizer(supabase_client).summarize(user_id)
+        
+        if result["summarized"]:
+            # The summary is read with the profile, so drop the cached copy
+            profile_cache.invalidate(user_id)
+        if result["remaining"] >= SUMMARY_EVERY:
+            # Work off a long backlog one batch per run
+            summarize_conversation.delay(user_id)
+        
+        return {"user_id": user_id, "status": "completed", **result}
+    
+    except Exception as e:
+        # Log the error
+        print(f"Error in summarize_conversation task: {e}")
+        raise
+
 @celery_app.task(name='tasks.generate_analytics', bind=True)
 def generate_analytics(self, user_id: str, analysis_type: str, time_period: str) -> Dict[str, Any]:
     """
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the single-pass rewrite engine used by humanize_response
+"""
+
+import json
+import os
+import random
+import re
+import sys
+
+from text_rewrite import AI_SPEAK_PATTERNS, CONTRACTION_PATTERNS, RewriteEngine, response_rewriter
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "llm_replies.json")
+
+def sequential_rewrite(text: str, rng: random.Random) -> str:
+    """The rules applied one re.sub at a time, the way humanize_response used to (minus its offset bug)"""
+    for pattern, replacement in AI_SPEAK_PATTERNS:
+        text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+    for pattern, replacement in CONTRACTION_PATTERNS:
+        matches = list(re.finditer(pattern, text, flags=re.IGNORECASE))
+        if matches:
+            chosen = set(rng.sample(range(len(matches)), max(1, int(len(matches) * 0.7))))
+            counter = iter(range(len(matches)))
+            text = re.sub(pattern, lambda match: replacement if next(counter) in chosen else match.group(0), text, flags=re.IGNORECASE)
+    return text
+
+def test_matches_sequential_rules():
+    """Test the single pass gives the same text as applying each rule in turn"""
+    try:
+        print("Testing single pass against sequential rules...")
+        with open(CORPUS_PATH) as f:
+            replies = json.load(f)
+        for seed, reply in enumerate(replies):
+            expected = sequential_rewrite(reply, random.Random(seed))
+            actual = response_rewriter.rewrite(reply, rng=random.Random(seed))
+            assert actual == expected, f"reply {seed} differs:\n  {expected}\n  {actual}"
+        print(f"✅ {len(replies)} corpus replies rewritten identically")
+        return True
+    except Exception as e:
+        print(f"❌ Sequential comparison failed: {e}")
+        return False
+
+def test_replacements():
+    """Test removals, replacements and case-insensitive matching"""
+    try:
+        print("\nTesting replacements...")
+        cases = [
+            ("As an AI, I recommend rest.", ", I think you should rest."),
+            ("HOWEVER you look at it", "but you look at it"),
+            ("Research suggests walking helps.", "from my experience walking helps."),
+            ("No rules apply here.", "No rules apply here."),
+            ("", ""),
+        ]
+        for text, expected in cases:
+            actual = response_rewriter.rewrite(text)
+            assert actual == expected, f"{text!r} -> {actual!r}, expected {expected!r}"
+        print(f"✅ {len(cases)} replacements correct")
+        return True
+    except Exception as e:
+        print(f"❌ Replacement test failed: {e}")
+        return False
+
+def test_anchored_rules():
+    """Test ^ rules only apply at the start of the text"""
+    try:
+        print("\nTesting anchored rules...")
+        assert response_rewriter.rewrite("i think so") == "I think so"
+        assert response_rewriter.rewrite("and i think so") == "and i think so"
+        assert response_rewriter.rewrite("i think so", at_start=False) == "i think so"
+        # Unanchored rules still apply to later pieces
+        assert response_rewriter.rewrite("however, as an ai", at_start=False) == "but, "
+        print("✅ Anchored rules only apply at the start")
+        return True
+    except Exception as e:
+        print(f"❌ Anchored rule test failed: {e}")
+        return False
+
+def test_sampled_rules():
+    """Test sampled rules rewrite about 70% of matches without corrupting the text"""
+    try:
+        print("\nTesting sampled contractions...")
+        text = ". ".join(["it is fine"] * 10)
+        for seed in range(20):
+            result = response_rewriter.rewrite(text, rng=random.Random(seed))
+            parts = result.split(". ")
+            assert len(parts) == 10, f"sentence boundaries changed: {result!r}"
+            assert all(part in ("it is fine", "it's fine") for part in parts), f"corrupted text: {result!r}"
+            assert parts.count("it's fine") == 7, f"expected 7 contractions: {result!r}"
+        # A single match is always rewritten
+        assert response_rewriter.rewrite("you are here") == "you're here"
+        print("✅ Sampled contractions rewrite 7 of 10 matches cleanly")
+        return True
+    except Exception as e:
+        print(f"❌ Sampled rule test failed: {e}")
+        return False
+
+def test_rule_order():
+    """Test earlier rules win when two rules match at the same position"""
+    try:
+        print("\nTesting rule order...")
+        engine = RewriteEngine([(r"good", "great"), (r"good morning", "hi")])
+        assert engine.rewrite("good morning") == "great morning"
+        engine = RewriteEngine([(r"good morning", "hi"), (r"good", "great")])
+        assert engine.rewrite("good morning, good day") == "hi, great day"
+        print("✅ Earlier rules take precedence")
+        return True
+    except Exception as e:
+        print(f"❌ Rule order test failed: {e}")
+        return False
+
+def main():
+    """Run all tests"""
+    print("🧪 Rewrite Engine Tests")
+    print("=" * 50)
+
+    tests = [
+        test_matches_sequential_rules,
+        test_replacements,
+        test_anchored_rules,
+        test_sampled_rules,
+        test_rule_order,
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test in tests:
+        if test():
+            passed += 1
+
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {passed}/{total} tests passed")
+
+    if passed == total:
+        print("🎉 All rewrite engine tests passed!")
+        return True
+    else:
+        print("⚠️  Some tests failed. Check the output above for details.")
+        return False
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
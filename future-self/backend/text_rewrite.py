@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import random
+import re
+from typing import Dict, List, Sequence, Tuple
+
+# AI-speak patterns replaced with more natural, personal language
+AI_SPEAK_PATTERNS = [
+    # Remove AI identifiers
+    (r"as an ai", ""),
+    (r"i'm here to help", ""),
+    (r"as an assistant", ""),
+    (r"i'm an ai", ""),
+    (r"as a language model", ""),
+    (r"as an artificial intelligence", ""),
+
+    # Make language more personal and reflective
+    (r"i understand that", "I remember when"),
+    (r"based on your", "knowing you and your"),
+    (r"i recommend", "I think you should"),
+    (r"you might want to consider", "maybe try"),
+    (r"it's important to note", "I've learned that"),
+    (r"it's worth mentioning", "I've discovered"),
+
+    # Add more personal touches
+    (r"this can help", "this helped me"),
+    (r"many people find", "I found"),
+    (r"research suggests", "from my experience"),
+    (r"studies show", "I've seen firsthand"),
+    (r"experts recommend", "what worked for me was"),
+
+    # Add conversational fillers occasionally
+    (r"^(I think)", "I think"),  # Remove the "Well, " prefix for simple messages
+    (r"^(You should)", "You should"),  # Remove the "Look, " prefix for simple messages
+    (r"^(This is)", "This is"),  # Remove the "You know, " prefix for simple messages
+
+    # Add more texting-like patterns
+    (r"however", "but"),
+    (r"therefore", "so"),
+    (r"additionally", "also"),
+    (r"nevertheless", "still"),
+]
+
+# Contractions applied to most matches to sound more natural
+CONTRACTION_PATTERNS = [
+    (r"it is", "it's"),
+    (r"that is", "that's"),
+    (r"you are", "you're"),
+    (r"i am", "I'm"),
+    (r"they are", "they're"),
+    (r"we are", "we're"),
+    (r"do not", "don't"),
+    (r"does not", "doesn't"),
+    (r"did not", "didn't"),
+    (r"has not", "hasn't"),
+    (r"have not", "haven't"),
+    (r"would not", "wouldn't"),
+    (r"could not", "couldn't"),
+    (r"should not", "shouldn't"),
+    (r"will not", "won't"),
+]
+
+# Share of a sampled rule's matches that get rewritten
+SAMPLE_FRACTION = 0.7
+
+def trie_pattern(words: Sequence[str]) -> str:
+    """A regex matching any of the (lowercase) words, nested by shared prefix so each position is rejected on its first character"""
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A word ends here: the longer words are optional
+        return f"(?:{body})?" if "" in node else body
+
+    return build(root)
+
+def literal_text(pattern: str) -> str:
+    """The text a rule pattern matches, without a leading ^ or wrapping group"""
+    text = pattern[1:] if pattern.startswith('^') else pattern
+    if text.startswith('(') and text.endswith(')'):
+        text = text[1:-1]
+    if re.search(r"[\\.^$*+?{}\[\]|()]", text):
+        raise ValueError(f"Rewrite rules must be literal text, got {pattern!r}")
+    return text.lower()
+
+class RewriteEngine:
+    """
+    Applies a table of (pattern, replacement) rules in one pass over the text.
+
+    Rules are literal, case-insensitive text. They are compiled once into a
+    single alternation, shaped as a prefix tree so most positions are
+    rejected on their first character, and the matched text (lowercased)
+    looks up the replacement in a dispatch table. Where rules overlap, the
+    earlier rule in the table wins, as it did when each rule ran as its own
+    re.sub.
+
+    Sampled rules only rewrite about SAMPLE_FRACTION of their matches (at
+    least one), picked at random per rule; the rest are left as written.
+    Rules anchored with ^ only apply at the start of the text, and not at all
+    when rewriting a later piece of it (at_start=False).
+    """
+
+    def __init__(self, rules: Sequence[Tuple[str, str]], sampled_rules: Sequence[Tuple[str, str]] = (), sample_fraction: float = SAMPLE_FRACTION):
+        self.sample_fraction = sample_fraction
+        self._replacements: List[str] = []
+        self._sampled: List[bool] = []
+        # Matched text -> rule index, for rules matching anywhere and rules anchored at the start
+        self._dispatch: Dict[str, int] = {}
+        self._anchored_dispatch: Dict[str, int] = {}
+        for sampled, table in ((False, rules), (True, sampled_rules)):
+            for pattern, replacement in table:
+                dispatch = self._anchored_dispatch if pattern.startswith('^') else self._dispatch
+                # An earlier rule for the same text shadows this one
+                dispatch.setdefault(literal_text(pattern), len(self._replacements))
+                self._replacements.append(replacement)
+                self._sampled.append(sampled)
+
+        # The prefix tree prefers the longest match; drop words an earlier rule's prefix always beats
+        words = self._reachable(self._dispatch)
+        anchored = self._reachable(self._anchored_dispatch)
+        unanchored_pattern = trie_pattern(words) if words else "(?!)"
+        # ASCII case folding, so a match lowercases to its dispatch key
+        self._unanchored_pattern = re.compile(unanchored_pattern, flags=re.IGNORECASE | re.ASCII)
+        if anchored:
+            self._pattern = re.compile(f"^{trie_pattern(anchored)}|{unanchored_pattern}", flags=re.IGNORECASE | re.ASCII)
+        else:
+            self._pattern = self._unanchored_pattern
+
+    @staticmethod
+    def _reachable(dispatch: Dict[str, int]) -> List[str]:
+        return [word for word, rule in dispatch.items()
+                if not any(word != other and word.startswith(other) and other_rule < rule for other, other_rule in dispatch.items())]
+
+    def rewrite(self, text: str, at_start: bool = True, rng: random.Random = None) -> str:
+        rng = rng or random
+        pattern = self._pattern if at_start else self._unanchored_pattern
+        pieces = []
+        # Output slots of each sampled rule's matches, keyed by rule index
+        sampled_slots = {}
+        position = 0
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            key = match.group().lower()
+            rule = self._anchored_dispatch.get(key) if start == 0 and at_start else None
+            if rule is None:
+                rule = self._dispatch[key]
+            pieces.append(text[position:start])
+            if self._sampled[rule]:
+                sampled_slots.setdefault(rule, []).append(len(pieces))
+                pieces.append(match.group())
+            else:
+                pieces.append(self._replacements[rule])
+            position = end
+        if not pieces:
+            return text
+        pieces.append(text[position:])
+
+        # Draw per rule in table order, like one random.sample per rule's matches
+        for rule in sorted(sampled_slots):
+            slots = sampled_slots[rule]
+            for chosen in rng.sample(range(len(slots)), max(1, int(len(slots) * self.sample_fraction))):
+                pieces[slots[chosen]] = self._replacements[rule]
+        return "".join(pieces)
+
+# Create a global instance
+response_rewriter = RewriteEngine(AI_SPEAK_PATTERNS, CONTRACTION_PATTERNS)
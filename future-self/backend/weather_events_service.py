@@ -2,6 +2,7 @@
 
 import requests
 import json
+import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import os
@@ -183,6 +184,11 @@ class WeatherEventsService:
     
     async def get_location_context(self, location: str) -> Dict[str, Any]:
         """Get comprehensive location context including weather and events"""
+        # The underlying HTTP calls are blocking, so keep them off the event loop
+        return await asyncio.to_thread(self.build_location_context, location)
+    
+    def build_location_context(self, location: str) -> Dict[str, Any]:
+        """Blocking implementation of get_location_context"""
         context = {
             'location': location,
             'weather': None,
@@ -258,35 +264,39 @@ class WeatherEventsService:
         """Generate weather-based advice"""
         if not weather:
             return "Weather information is not available for personalized advice."
-        
+        return self.get_advice_for_conditions(weather.temperature, weather.humidity, weather.wind_speed, weather.description)
+    
+    def get_advice_for_conditions(self, temperature: float, humidity: int, wind_speed: float, description: str) -> str:
+        """Weather-based advice from raw readings, e.g. a cached weather dict"""
         advice = []
         
         # Temperature advice
-        if weather.temperature < 0:
+        if temperature < 0:
             advice.append("It's freezing outside - dress warmly and consider indoor activities.")
-        elif weather.temperature < 10:
+        elif temperature < 10:
             advice.append("It's quite cold - layer up and maybe enjoy a warm drink.")
-        elif weather.temperature > 30:
+        elif temperature > 30:
             advice.append("It's very hot - stay hydrated and seek shade when possible.")
-        elif weather.temperature > 25:
+        elif temperature > 25:
             advice.append("It's warm and pleasant - great weather for outdoor activities.")
         
         # Humidity advice
-        if weather.humidity > 80:
+        if humidity > 80:
             advice.append("High humidity might make it feel more uncomfortable.")
-        elif weather.humidity < 30:
+        elif humidity < 30:
             advice.append("Low humidity - consider staying hydrated.")
         
         # Wind advice
-        if weather.wind_speed > 10:
+        if wind_speed > 10:
             advice.append("It's quite windy - secure loose items and dress accordingly.")
         
         # Weather condition advice
-        if 'rain' in weather.description.lower():
+        description = description.lower()
+        if 'rain' in description:
             advice.append("Don't forget an umbrella or raincoat.")
-        elif 'snow' in weather.description.lower():
+        elif 'snow' in description:
             advice.append("Snow is expected - drive carefully and dress warmly.")
-        elif 'clear' in weather.description.lower() or 'sunny' in weather.description.lower():
+        elif 'clear' in description or 'sunny' in description:
             advice.append("Clear skies - perfect for outdoor plans.")
         
         return ' '.join(advice) if advice else "Weather conditions are moderate - enjoy your day!"
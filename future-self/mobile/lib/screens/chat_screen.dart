@@ -619,7 +619,7 @@ class ChatScreenState extends State<ChatScreen> with TickerProviderStateMixin {
         // Find the placeholder message index
         final placeholderIndex = _messages.indexWhere((msg) => msg.id == aiMessageId);
         
-        await for (final chunk in _apiService.streamMessageWithTyping(text, user.id)) {
+        await for (final chunk in _apiService.streamMessageWithTyping(text, user.id, messageId: userMessage.id)) {
           if (chunk['type'] == 'typing') {
             // Handle typing indicator
             final bool typingStatus = chunk['isTyping'];
@@ -851,7 +851,8 @@ class ChatScreenState extends State<ChatScreen> with TickerProviderStateMixin {
                 // You might want to save this preference to Supabase as well
                 final user = supabase.auth.currentUser;
                 if (user != null) {
-                  supabase.from('users').update({'preferred_communication': _preferredCommunicationMethod}).eq('id', user.id);
+                  supabase.from('users').update({'preferred_communication': _preferredCommunicationMethod}).eq('id', user.id)
+                      .then((_) => _apiService.invalidateProfileCache(user.id));
                 }
               });
             },
@@ -3,6 +3,7 @@ import 'package:supabase_flutter/supabase_flutter.dart';
 import 'package:image_picker/image_picker.dart';
 import 'dart:io';
 import 'package:flutter/foundation.dart';
+import '../services/api_service.dart';
 // Conditional import for web
 // import 'package:web/web.dart' as web; // Removed unused import
 // import 'dart:js_interop'; // Removed unused import
@@ -207,6 +208,7 @@ class ProfileScreenState extends State<ProfileScreen> {
         'future_vision': _visionController.text,
         // 'future_photo_path' is updated by _uploadImageWeb or _uploadImage methods directly.
       }).eq('id', user.id);
+      ApiService().invalidateProfileCache(user.id);
 
       if (mounted) {
         ScaffoldMessenger.of(context).showSnackBar(
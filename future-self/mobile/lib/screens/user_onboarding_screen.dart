@@ -12,6 +12,7 @@ import 'package:flutter/foundation.dart';
 import 'package:country_picker/country_picker.dart';
 import 'package:date_picker_plus/date_picker_plus.dart';
 import 'package:speech_to_text/speech_to_text.dart';
+import '../services/api_service.dart';
 
 import 'dart:async';
 
@@ -410,6 +411,7 @@ class UserOnboardingScreenState extends State<UserOnboardingScreen>
       debugPrint('Data to save: $dataToSave');
       
       await Supabase.instance.client.from('users').upsert(dataToSave);
+      ApiService().invalidateProfileCache(user.id);
         
       // Clear saved progress after successful completion
       await _clearProgress();
@@ -1,6 +1,7 @@
 import 'dart:async';
 import 'dart:convert';
 import 'dart:io';
+import 'dart:math';
 import 'package:flutter/foundation.dart'; // For logging
 
 import 'package:http/http.dart' as http;
@@ -31,12 +32,19 @@ class ApiService {
     throw Exception('All retry attempts failed');
   }
 
+  // One key per user message, reused across retries so the backend runs a single generation
+  static String _newIdempotencyKey() {
+    final random = Random.secure();
+    return List.generate(16, (_) => random.nextInt(256).toRadixString(16).padLeft(2, '0')).join();
+  }
+
   Future<Map<String, dynamic>> sendMessage(String message, String userId) async {
+    final idempotencyKey = _newIdempotencyKey();
     return _retryRequest(() async {
       final response = await _client
           .post(
             Uri.parse('$baseUrl/chat'),
-            headers: {'Content-Type': 'application/json'},
+            headers: {'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey},
             body: jsonEncode({'message': message, 'user_id': userId}),
           )
           .timeout(const Duration(seconds: ApiConfig.timeoutDuration));
@@ -49,6 +57,18 @@ class ApiService {
     });
   }
 
+  /// Tell the backend to drop its cached copy of the user's profile after an update.
+  /// Best effort: a stale cache entry expires on its own, so failures are only logged.
+  Future<void> invalidateProfileCache(String userId) async {
+    try {
+      await _client
+          .post(Uri.parse('$baseUrl/users/$userId/profile/invalidate'))
+          .timeout(const Duration(seconds: ApiConfig.timeoutDuration));
+    } catch (e) {
+      debugPrint('Error invalidating profile cache: $e');
+    }
+  }
+
   Future<String> transcribeAudio(Uint8List audioBytes, String userId) async {
     return _retryRequest(() async {
       var request = http.MultipartRequest('POST', Uri.parse('$baseUrl/transcribe?user_id_query=$userId'));
@@ -85,17 +105,20 @@ class ApiService {
   }
 
   // Renamed to avoid duplicate function name
-  Future<String> sendMessageString(String message, String userId) async {
+  Future<String> sendMessageString(String message, String userId, {String? messageId}) async {
     final url = Uri.parse('$baseUrl/chat');
+    final idempotencyKey = _newIdempotencyKey();
     
     try {
       final response = await _retryRequest(() async {
         return await _client.post(
           url,
-          headers: {'Content-Type': 'application/json'},
+          headers: {'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey},
           body: jsonEncode({
             'message': message,
             'user_id': userId,
+            // ID the message was saved under, so the server doesn't count it twice
+            if (messageId != null) 'message_id': messageId,
           }),
         );
       });
@@ -113,31 +136,60 @@ class ApiService {
   }
   
   // New method for streaming messages with typing indicator support
-  Stream<Map<String, dynamic>> streamMessageWithTyping(String message, String userId) async* {
+  Stream<Map<String, dynamic>> streamMessageWithTyping(String message, String userId, {String? messageId}) async* {
     final url = Uri.parse('$baseUrl/chat/stream');
-    final request = http.Request('POST', url);
-    
-    request.headers['Content-Type'] = 'application/json';
-    request.body = jsonEncode({
-      'message': message,
-      'user_id': userId,
-    });
+    final idempotencyKey = _newIdempotencyKey();
+    // ID of the last event we handled; a reconnect sends it so the server replays only what we missed
+    String? lastEventId;
+    var reconnects = 0;
     
-    try {
-      final response = await _client.send(request);
+    while (true) {
+      final request = http.Request('POST', url);
+      request.headers['Content-Type'] = 'application/json';
+      request.headers['Idempotency-Key'] = idempotencyKey;
+      if (lastEventId != null) {
+        request.headers['Last-Event-ID'] = lastEventId;
+      }
+      request.body = jsonEncode({
+        'message': message,
+        'user_id': userId,
+        if (messageId != null) 'message_id': messageId,
+        // The server forwards tokens immediately and we pace the typing animation here
+        'client_pacing': true,
+      });
       
-      if (response.statusCode == 200) {
+      try {
+        final response = await _client.send(request);
+        
+        if (response.statusCode != 200) {
+          throw HttpException('Failed to stream message: ${response.statusCode}');
+        }
+        
         // Process the stream
+        String? pendingEventId;
         await for (final chunk in response.stream.transform(utf8.decoder).transform(const LineSplitter())) {
+          if (chunk.startsWith('id: ')) {
+            pendingEventId = chunk.substring(4);
+            continue;
+          }
           if (chunk.startsWith('data: ')) {
             final data = chunk.substring(6); // Remove 'data: ' prefix
             try {
               final jsonData = jsonDecode(data);
               
+              // Wait out the server's typing-delay hint before rendering this event
+              if (jsonData['delay'] != null) {
+                await Future.delayed(Duration(milliseconds: ((jsonData['delay'] as num) * 1000).round()));
+              }
+              
               // Check if this is the completion message
               if (jsonData.containsKey('done')) {
+                // Templated replies arrive in a single final event with the text attached
+                if (jsonData['text'] != null) {
+                  yield {'type': 'text', 'text': jsonData['text']};
+                }
                 yield {'type': 'done'};
-                break;
+                return;
               }
               
               // Check if there's an error
@@ -148,25 +200,36 @@ class ApiService {
               // Check if this is a typing indicator
               if (jsonData.containsKey('typing')) {
                 yield {'type': 'typing', 'isTyping': jsonData['typing']};
-                continue;
-              }
-              
-              // Yield the text chunk
-              if (jsonData.containsKey('text')) {
+              } else if (jsonData.containsKey('text')) {
+                // Yield the text chunk
                 yield {'type': 'text', 'text': jsonData['text']};
               }
             } catch (e) {
               debugPrint('Error parsing SSE data: $e');
               // Skip malformed data
             }
+            lastEventId = pendingEventId ?? lastEventId;
           }
         }
-      } else {
-        throw HttpException('Failed to stream message: ${response.statusCode}');
+        // The connection closed before the reply finished
+        if (lastEventId == null) {
+          return;
+        }
+      } on HttpException catch (e) {
+        debugPrint('Error streaming message: $e');
+        rethrow;
+      } catch (e) {
+        debugPrint('Error streaming message: $e');
+        if (lastEventId == null || reconnects >= ApiConfig.maxRetries) {
+          rethrow;
+        }
       }
-    } catch (e) {
-      debugPrint('Error streaming message: $e');
-      rethrow;
+      
+      if (reconnects >= ApiConfig.maxRetries) {
+        throw HttpException('Stream ended before the reply was complete');
+      }
+      reconnects++;
+      await Future.delayed(Duration(milliseconds: 500 * reconnects));
     }
   }
   
@@ -565,4 +565,161 @@ ALTER DEFAULT PRIVILEGES FOR ROLE supabase_admin IN SCHEMA public GRANT ALL ON T
 -- GRANT ALL ON TABLE user_style_profiles TO service_role;
 -- GRANT ALL ON SEQUENCE user_style_profiles_id_seq TO anon;
 -- GRANT ALL ON SEQUENCE user_style_profiles_id_seq TO authenticated;
--- GRANT ALL ON SEQUENCE user_style_profiles_id_seq TO service_role;
\ No newline at end of file
+-- GRANT ALL ON SEQUENCE user_style_profiles_id_seq TO service_role;
+-- Rolling conversation summary kept alongside the profile (see backend/conversation_summary.py);
+-- conversation_summary_through_at/_id are the created_at and id of the last chat_messages row it covers;
+-- conversation_summary_count is how many messages have been folded in
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS conversation_summary text;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS conversation_summary_count integer DEFAULT 0 NOT NULL;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS conversation_summary_updated_at timestamp with time zone;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS conversation_summary_through_at timestamp with time zone;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS conversation_summary_through_id bigint;
+
+-- Summaries written before the cursor columns existed tracked an offset: their last covered
+-- message is the conversation_summary_count-th oldest one
+UPDATE public.users u
+SET conversation_summary_through_at = last_covered.created_at,
+    conversation_summary_through_id = last_covered.id
+FROM public.users covered_user
+CROSS JOIN LATERAL (
+    SELECT m.created_at, m.id
+    FROM public.chat_messages m
+    WHERE m.user_id = covered_user.id
+    ORDER BY m.created_at, m.id
+    OFFSET covered_user.conversation_summary_count - 1
+    LIMIT 1
+) last_covered
+WHERE u.id = covered_user.id
+  AND covered_user.conversation_summary_count > 0
+  AND covered_user.conversation_summary_through_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_user_created_at ON public.chat_messages (user_id, created_at, id);
+
+-- Personal details mined from chat messages (see backend/personal_details.py)
+CREATE TABLE IF NOT EXISTS public.user_personal_details (
+    id SERIAL PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    goals TEXT[],
+    challenges TEXT[],
+    interests TEXT[],
+    "values" TEXT[],
+    achievements TEXT[],
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- existing followed by the additions not already in it, in order; existing unchanged when there are none
+CREATE OR REPLACE FUNCTION public.array_append_distinct(existing text[], additions text[]) RETURNS text[]
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT CASE WHEN additions IS NULL THEN existing ELSE (
+        SELECT coalesce(array_agg(value ORDER BY first_ord), '{}')
+        FROM (
+            SELECT value, min(ord) AS first_ord
+            FROM unnest(coalesce(existing, '{}') || additions) WITH ORDINALITY AS item(value, ord)
+            GROUP BY value
+        ) AS distinct_values
+    ) END
+    $$;
+
+-- One-time migration for rows written by the old read-merge-write code.
+-- Values stored as the string form of a Python list ("['a', 'b']"), either as the
+-- whole column or as a single array element, become one element per item
+CREATE OR REPLACE FUNCTION public.parse_personal_detail(raw text) RETURNS text[]
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT CASE
+        WHEN raw IS NULL THEN NULL
+        WHEN btrim(raw) ~ '^\[\s*([''"].*)?\]$' THEN ARRAY(
+            SELECT regexp_replace(coalesce(quoted[1], quoted[2]), '\\(.)', '\1', 'g')
+            FROM regexp_matches(raw, '''((?:[^''\\]|\\.)*)''|"((?:[^"\\]|\\.)*)"', 'g') WITH ORDINALITY AS matches(quoted, ord)
+            ORDER BY ord
+        )
+        ELSE ARRAY[raw]
+    END
+    $$;
+
+CREATE OR REPLACE FUNCTION public.flatten_personal_details(items text[]) RETURNS text[]
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT public.array_append_distinct('{}', ARRAY(
+        SELECT value
+        FROM unnest(items) WITH ORDINALITY AS item(raw, ord),
+             unnest(public.parse_personal_detail(item.raw)) WITH ORDINALITY AS parsed(value, value_ord)
+        ORDER BY item.ord, parsed.value_ord
+    ))
+    $$;
+
+DO $$
+DECLARE
+    category text;
+BEGIN
+    FOREACH category IN ARRAY ARRAY['goals', 'challenges', 'interests', 'values', 'achievements'] LOOP
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'user_personal_details'
+              AND column_name = category AND data_type = 'text'
+        ) THEN
+            EXECUTE format('ALTER TABLE public.user_personal_details ALTER COLUMN %1$I TYPE text[] USING public.parse_personal_detail(%1$I)', category);
+        END IF;
+
+        EXECUTE format(
+            'UPDATE public.user_personal_details SET %1$I = public.flatten_personal_details(%1$I) '
+            'WHERE EXISTS (SELECT 1 FROM unnest(%1$I) AS item WHERE btrim(item) LIKE ''[%%]'')',
+            category);
+
+        -- The old select-then-insert could create several rows per user: fold them into the first
+        EXECUTE format(
+            'UPDATE public.user_personal_details AS keep SET %1$I = ('
+            '    SELECT public.array_append_distinct(''{}'', array_agg(item.value ORDER BY other.id, item.ord))'
+            '    FROM public.user_personal_details AS other, unnest(other.%1$I) WITH ORDINALITY AS item(value, ord)'
+            '    WHERE other.user_id = keep.user_id) '
+            'WHERE keep.id = (SELECT min(id) FROM public.user_personal_details AS other WHERE other.user_id = keep.user_id) '
+            '  AND EXISTS (SELECT 1 FROM public.user_personal_details AS other WHERE other.user_id = keep.user_id AND other.id <> keep.id)',
+            category);
+    END LOOP;
+
+    DELETE FROM public.user_personal_details AS extra
+    USING public.user_personal_details AS keep
+    WHERE extra.user_id = keep.user_id AND extra.id > keep.id;
+END
+$$;
+
+DROP FUNCTION public.flatten_personal_details(text[]);
+DROP FUNCTION public.parse_personal_detail(text);
+
+-- One row per user, which merge_personal_details upserts on
+CREATE UNIQUE INDEX IF NOT EXISTS user_personal_details_user_id_key ON public.user_personal_details USING btree (user_id);
+
+-- Adds a message's details to the user's row in one atomic statement: the row is created
+-- or locked by the upsert, so concurrent messages can't overwrite each other's values
+CREATE OR REPLACE FUNCTION public.merge_personal_details(
+    p_user_id uuid,
+    p_goals text[] DEFAULT NULL,
+    p_challenges text[] DEFAULT NULL,
+    p_interests text[] DEFAULT NULL,
+    p_values text[] DEFAULT NULL,
+    p_achievements text[] DEFAULT NULL
+) RETURNS void
+    LANGUAGE sql
+    AS $$
+    INSERT INTO public.user_personal_details AS details (user_id, goals, challenges, interests, "values", achievements)
+    VALUES (
+        p_user_id,
+        public.array_append_distinct(NULL, p_goals),
+        public.array_append_distinct(NULL, p_challenges),
+        public.array_append_distinct(NULL, p_interests),
+        public.array_append_distinct(NULL, p_values),
+        public.array_append_distinct(NULL, p_achievements)
+    )
+    ON CONFLICT (user_id) DO UPDATE SET
+        goals = public.array_append_distinct(details.goals, p_goals),
+        challenges = public.array_append_distinct(details.challenges, p_challenges),
+        interests = public.array_append_distinct(details.interests, p_interests),
+        "values" = public.array_append_distinct(details."values", p_values),
+        achievements = public.array_append_distinct(details.achievements, p_achievements),
+        updated_at = NOW();
+    $$;
+
+GRANT ALL ON FUNCTION public.merge_personal_details(uuid, text[], text[], text[], text[], text[]) TO authenticated;
+GRANT ALL ON FUNCTION public.merge_personal_details(uuid, text[], text[], text[], text[], text[]) TO service_role;